@@ -0,0 +1,211 @@
+"""Cost-aware admission control.
+
+Every expensive request is charged a cost in "units", where one unit is
+one minute of 720p video. Downloads cost duration × relative pixel count
+from cached metadata, times COMPRESS_MULTIPLIER when compressing.
+Metadata lookups cost a small flat amount. Costs are taken from a token
+bucket per client (IP address, or a configured API key) and from one
+global bucket. A request that does not fit is rejected with 429 and a
+Retry-After header saying when it would.
+"""
+import hashlib
+import hmac
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, Request
+
+from formats import best_by_height
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Per-client bucket: units refilled per second and bucket size
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", 0.5))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", 60))
+# Bucket shared by all clients of this worker
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", 5))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", 600))
+ADMISSION_COMPRESS_MULTIPLIER = float(os.getenv("ADMISSION_COMPRESS_MULTIPLIER", 4))
+# Cost of an info/formats/convert lookup and the smallest cost of a download
+ADMISSION_INFO_COST = float(os.getenv("ADMISSION_INFO_COST", 0.25))
+ADMISSION_MIN_DOWNLOAD_COST = float(os.getenv("ADMISSION_MIN_DOWNLOAD_COST", 1))
+# Cost of audio-only downloads relative to 720p video
+ADMISSION_AUDIO_FACTOR = float(os.getenv("ADMISSION_AUDIO_FACTOR", 0.1))
+# Assumed duration in seconds when the metadata is not cached yet
+ADMISSION_DEFAULT_DURATION = int(os.getenv("ADMISSION_DEFAULT_DURATION", 300))
+# Comma separated keys sent as X-API-Key that get their own bucket instead of their IP's
+ADMISSION_API_KEYS = {key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(',') if key.strip()}
+# Reverse proxies in front of the app; the client IP is taken from X-Forwarded-For that many hops back
+ADMISSION_PROXY_HOPS = int(os.getenv("ADMISSION_PROXY_HOPS", 0))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", 10000))
+# Sent as X-Admin-Token to see per-client figures in /api/stats/admission; unset hides them from everyone
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+REFERENCE_HEIGHT = 720
+
+
+def download_cost(info: Optional[Dict], height: Optional[int], compress: bool) -> float:
+    """Units a download of ``info`` at up to ``height`` costs."""
+    info = info or {}
+    duration = info.get('duration') or ADMISSION_DEFAULT_DURATION
+    height = height or REFERENCE_HEIGHT
+    # The request may ask for more than the video has
+    available = [h for h in best_by_height(info.get('formats') or []) if h <= height]
+    if available:
+        height = max(available)
+    cost = duration / 60 * (height / REFERENCE_HEIGHT) ** 2
+    if compress:
+        cost *= ADMISSION_COMPRESS_MULTIPLIER
+    return max(ADMISSION_MIN_DOWNLOAD_COST, cost)
+
+
+def is_admin(request: Request) -> bool:
+    """Whether the request carries ADMIN_TOKEN."""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('x-admin-token', ''), ADMIN_TOKEN)
+
+
+def audio_cost(info: Optional[Dict]) -> float:
+    """Units an audio-only download of ``info`` costs."""
+    duration = (info or {}).get('duration') or ADMISSION_DEFAULT_DURATION
+    return max(ADMISSION_INFO_COST, duration / 60 * ADMISSION_AUDIO_FACTOR)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'admitted', 'rejected', 'spent')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.admitted = 0
+        self.rejected = 0
+        self.spent = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens are available; 0 if they are now."""
+        missing = cost - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else math.inf
+
+    def take(self, cost: float):
+        self.tokens -= cost
+        self.admitted += 1
+        self.spent += cost
+
+
+class AdmissionController:
+    """Per-client and global token buckets charged by request cost."""
+
+    def __init__(self, client_rate: float, client_burst: float, global_rate: float, global_burst: float,
+                 max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._clients: Dict[str, TokenBucket] = {}
+
+    def client_id(self, request: Request) -> str:
+        api_key = request.headers.get('x-api-key')
+        if api_key and api_key in ADMISSION_API_KEYS:
+            return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+        forwarded = request.headers.get('x-forwarded-for')
+        if ADMISSION_PROXY_HOPS and forwarded:
+            hops = [hop.strip() for hop in forwarded.split(',')]
+            # Each proxy appends the address it received the request from
+            return 'ip:' + hops[max(0, len(hops) - ADMISSION_PROXY_HOPS)]
+        return 'ip:' + (request.client.host if request.client else 'unknown')
+
+    def _client_bucket(self, client: str, now: float) -> TokenBucket:
+        bucket = self._clients.get(client)
+        if bucket is None:
+            if len(self._clients) >= self.max_clients:
+                self._prune(now)
+            bucket = self._clients[client] = TokenBucket(self.client_rate, self.client_burst)
+        return bucket
+
+    def _prune(self, now: float):
+        """Forget clients whose buckets have refilled, which is the same as never having seen them."""
+        for client, bucket in list(self._clients.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._clients[client]
+
+    def admit(self, request: Request, cost: float):
+        """Charge ``cost`` to the client and the global budget, or raise 429."""
+        if not ADMISSION_ENABLED:
+            return
+        now = time.monotonic()
+        client = self.client_id(request)
+        buckets = (self._client_bucket(client, now), self.global_bucket)
+        waits = []
+        for bucket in buckets:
+            bucket.refill(now)
+            # A request larger than a whole bucket is let through once it is full, and empties it
+            waits.append(bucket.wait_time(min(cost, bucket.capacity)))
+        if any(waits):
+            retry_after = max(1, math.ceil(max(waits)))
+            for bucket, wait in zip(buckets, waits):
+                if wait:
+                    bucket.rejected += 1
+            detail = "Rate limit exceeded" if waits[0] else "Server is at capacity"
+            logger.warning(f"Rejecting {client} ({detail.lower()}, cost {cost:.2f}, retry after {retry_after}s)")
+            raise HTTPException(status_code=429, detail=f"{detail}, please retry in {retry_after} seconds",
+                                headers={'Retry-After': str(retry_after)})
+        for bucket in buckets:
+            bucket.take(min(cost, bucket.capacity))
+
+    def stats(self, top: int = 20, include_clients: bool = False) -> Dict[str, Any]:
+        """Limits and global usage; per-client figures (addresses, key IDs) only with ``include_clients``."""
+        now = time.monotonic()
+        self.global_bucket.refill(now)
+        stats = {
+            "enabled": ADMISSION_ENABLED,
+            "limits": {
+                "client_rate": self.client_rate,
+                "client_burst": self.client_burst,
+                "global_rate": self.global_bucket.rate,
+                "global_burst": self.global_bucket.capacity,
+                "compress_multiplier": ADMISSION_COMPRESS_MULTIPLIER,
+                "info_cost": ADMISSION_INFO_COST,
+            },
+            "global": {
+                "tokens": round(self.global_bucket.tokens, 2),
+                "utilisation": round(1 - self.global_bucket.tokens / self.global_bucket.capacity, 4),
+                "admitted": self.global_bucket.admitted,
+                "rejected": self.global_bucket.rejected,
+                "spent": round(self.global_bucket.spent, 2),
+            },
+            "clients_tracked": len(self._clients),
+        }
+        if not include_clients:
+            return stats
+        clients = sorted(self._clients.items(), key=lambda item: item[1].spent, reverse=True)
+        for _, bucket in clients[:top]:
+            bucket.refill(now)
+        stats["top_clients"] = [
+            {
+                "client": client,
+                "tokens": round(bucket.tokens, 2),
+                "utilisation": round(1 - bucket.tokens / bucket.capacity, 4),
+                "admitted": bucket.admitted,
+                "rejected": bucket.rejected,
+                "spent": round(bucket.spent, 2),
+            }
+            for client, bucket in clients[:top]
+        ]
+        return stats
+
+
+admission_controller = AdmissionController(
+    ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST, ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST
+)
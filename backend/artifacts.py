@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from cache import LeaderCancelled
+from streaming import remove_temp_dir
+
+logger = logging.getLogger(__name__)
+
+# On-disk cache of finished (and compressed) downloads
+ARTIFACT_CACHE_ENABLED = os.getenv("ARTIFACT_CACHE_ENABLED", "true").lower() == "true"
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "video_downloader_artifacts"))
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+
+def artifact_key(platform: str, video_key: str, variant: str, compress: bool) -> str:
+    """Content address for one rendition of one video."""
+    raw = json.dumps([platform, video_key, variant, bool(compress)])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ArtifactCache:
+    """Byte-bounded LRU cache of finished downloads on disk.
+
+    Files are written under a temporary name and renamed into place, so a
+    reader never sees a partial artifact. Recency is tracked with the file
+    mtime, which also lets several workers share one cache directory.
+    Concurrent misses for the same key in a worker wait on one producer.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        # Size as of the last eviction pass (run on startup and after every store), so stats never walk the directory
+        self._entry_count = 0
+        self._bytes = 0
+        os.makedirs(root, exist_ok=True)
+        self.evict()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        directory = os.path.join(self.root, key[:2])
+        return os.path.join(directory, f"{key}.bin"), os.path.join(directory, f"{key}.json")
+
+    def lookup(self, key: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                headers = json.load(f)
+            # Bump recency for LRU eviction
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+        return data_path, headers
+
+    def store(self, key: str, source_path: str, headers: Dict[str, str]) -> str:
+        """Move a finished file into the cache atomically. Blocking."""
+        data_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        tmp_suffix = f".tmp-{uuid.uuid4().hex}"
+        # Rename within one filesystem, copy across filesystems
+        shutil.move(source_path, data_path + tmp_suffix)
+        with open(meta_path + tmp_suffix, 'w') as f:
+            json.dump(headers, f)
+        os.replace(data_path + tmp_suffix, data_path)
+        os.replace(meta_path + tmp_suffix, meta_path)
+        self.evict()
+        return data_path
+
+    def _entries(self):
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith('.bin'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """Delete least recently used artifacts until under the byte budget."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        entries_left = len(entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for victim in (path, path[:-len('.bin')] + '.json'):
+                try:
+                    os.unlink(victim)
+                except OSError:
+                    pass
+            total -= size
+            self.evictions += 1
+            entries_left -= 1
+        self._entry_count = entries_left
+        self._bytes = total
+
+    async def get_or_produce(self, key: str, producer: Callable[[], Awaitable[Any]]) -> Tuple[str, Dict[str, str]]:
+        """Return (path, headers) of a cached artifact, producing it once on a miss.
+
+        ``producer`` returns an object with ``path``, ``temp_dir`` and
+        ``headers``; its file is moved into the cache and its temp dir removed.
+        """
+        while True:
+            cached = self.lookup(key)
+            if cached is not None:
+                self.hits += 1
+                self.bytes_saved += os.path.getsize(cached[0])
+                return cached
+            if key not in self._inflight:
+                break
+            self.coalesced += 1
+            try:
+                result = await asyncio.shield(self._inflight[key])
+            except LeaderCancelled:
+                # The first follower to get here produces the artifact, the rest wait on it
+                continue
+            self.bytes_saved += os.path.getsize(result[0])
+            return result
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            produced = await producer()
+            try:
+                path = await run_in_threadpool(self.store, key, produced.path, produced.headers)
+            finally:
+                remove_temp_dir(produced.temp_dir)
+            result = (path, produced.headers)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Only this caller was cancelled, the followers retry instead of failing with it
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": self._entry_count,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "bytes_saved": self.bytes_saved,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES)
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import zipfile
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from executor import parse_platform_limits
+from streaming import STREAM_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Most URLs (after playlist expansion) accepted in one batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
+# Items of one batch processed at the same time, per platform and in total
+BATCH_PLATFORM_LIMITS = parse_platform_limits(os.getenv("BATCH_PLATFORM_LIMITS", "youtube=4,facebook=2,instagram=2,tiktok=2"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 6))
+# Downloads of one batch running at the same time
+BATCH_DOWNLOAD_CONCURRENCY = int(os.getenv("BATCH_DOWNLOAD_CONCURRENCY", 3))
+
+CONTENT_DISPOSITION_FILENAME = re.compile(r'filename="([^"]*)"')
+
+
+def error_detail(error: BaseException) -> str:
+    return str(error.detail) if isinstance(error, HTTPException) else str(error)
+
+
+def ndjson_line(data: Dict[str, Any]) -> bytes:
+    return (json.dumps(data, default=str) + "\n").encode()
+
+
+def attachment_filename(headers: Dict[str, str], default: str) -> str:
+    """File name from a Content-Disposition header built by the download functions."""
+    match = CONTENT_DISPOSITION_FILENAME.search(headers.get('Content-Disposition', ''))
+    name = unquote(match.group(1)) if match else ''
+    return os.path.basename(name) or default
+
+
+async def run_batch(items: List[Any], worker: Callable[[Any], Awaitable[Any]], platform_of: Callable[[Any], str],
+                    concurrency: int = BATCH_CONCURRENCY,
+                    cleanup: Optional[Callable[[Any], None]] = None) -> AsyncIterator[Tuple[int, Any, Optional[BaseException]]]:
+    """Run ``worker`` over ``items`` concurrently, yielding results as they finish.
+
+    Yields (index, result, error) tuples in completion order. Concurrency is
+    bounded per platform by BATCH_PLATFORM_LIMITS and overall by
+    ``concurrency``. When the consumer stops early the remaining work is
+    cancelled and ``cleanup`` receives results that were never yielded.
+    """
+    total = asyncio.Semaphore(concurrency)
+    platforms: Dict[str, asyncio.Semaphore] = {}
+
+    async def run(index: int, item: Any):
+        platform = platform_of(item)
+        if platform not in platforms:
+            platforms[platform] = asyncio.Semaphore(BATCH_PLATFORM_LIMITS.get(platform, concurrency))
+        async with platforms[platform], total:
+            try:
+                return index, await worker(item), None
+            except Exception as e:
+                return index, None, e
+
+    tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+    consumed = set()
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, result, error = await next_done
+            consumed.add(index)
+            yield index, result, error
+    finally:
+        for task in tasks:
+            task.cancel()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        if cleanup:
+            for outcome in outcomes:
+                if isinstance(outcome, tuple) and outcome[0] not in consumed and outcome[1] is not None:
+                    cleanup(outcome[1])
+
+
+class _Sink:
+    """Write-only, unseekable file object; zipfile then uses data descriptors."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class ZipStream:
+    """ZIP archive built incrementally in memory, one chunk at a time.
+
+    Entries are stored uncompressed (the videos already are compressed) and
+    the produced bytes are handed out as soon as they are written, so the
+    archive is never staged on disk.
+    """
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._names = set()
+
+    def _drain(self) -> bytes:
+        data = bytes(self._sink.buffer)
+        self._sink.buffer.clear()
+        return data
+
+    def _entry(self, name: str) -> zipfile.ZipInfo:
+        base, ext = os.path.splitext(name)
+        counter = 1
+        while name in self._names:
+            counter += 1
+            name = f"{base} ({counter}){ext}"
+        self._names.add(name)
+        return zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+
+    async def add_file(self, name: str, path: str) -> AsyncIterator[bytes]:
+        """Yield archive bytes while copying a file into a new entry."""
+        with open(path, 'rb') as source, self._zip.open(self._entry(name), 'w', force_zip64=True) as entry:
+            while True:
+                chunk = await run_in_threadpool(source.read, STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                entry.write(chunk)
+                yield self._drain()
+        yield self._drain()
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(self._entry(name), data)
+        return self._drain()
+
+    def close(self) -> bytes:
+        """Write the central directory and return the final bytes."""
+        self._zip.close()
+        return self._drain()
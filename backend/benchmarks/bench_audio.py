@@ -0,0 +1,128 @@
+"""Compare audio-only extraction from bestaudio against extracting from the full video.
+
+For every audio format (mp3, m4a, opus) this streams the output of
+``stream_audio`` twice. The first run reads an audio-only source, picked
+the way the format selectors pick it: the matching codec when one exists,
+so it is remuxed. The second run reads the full video the old path had to
+download first. Each run records the input bytes, the CPU seconds spent by
+ffmpeg, the time to the first output byte and the total time. Without a
+corpus directory, samples are generated with ffmpeg: a 1080p H.264/AAC
+video, plus AAC (.m4a) and Opus (.webm) audio standing in for YouTube's
+bestaudio formats.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_audio [corpus_dir] [--duration 60] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from transcode import AUDIO_FORMATS, STRATEGY_COPY, audio_strategy, probe, stream_audio
+
+# name -> ffmpeg arguments; video samples have "video" in their name
+SAMPLES = {
+    'video_1080p.mp4': ['-c:v', 'libx264', '-b:v', '6000k', '-s', '1920x1080', '-c:a', 'aac', '-b:a', '128k'],
+    'audio.m4a': ['-vn', '-c:a', 'aac', '-b:a', '128k'],
+    'audio.webm': ['-vn', '-c:a', 'libopus', '-b:a', '128k'],
+}
+
+
+def generate_samples(directory: str, duration: int):
+    for name, codec_args in SAMPLES.items():
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', f'testsrc2=duration={duration}:rate=30',
+             '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+             *codec_args, '-shortest', os.path.join(directory, name)],
+            check=True
+        )
+
+
+def child_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def audio_codec(path: str) -> str:
+    streams = (await probe(path)).get('streams', [])
+    return next((st.get('codec_name') for st in streams if st.get('codec_type') == 'audio'), None)
+
+
+async def measure(path: str, acodec: str, audio_format: str):
+    strategy = audio_strategy(acodec, audio_format)
+    cpu_before = child_cpu_seconds()
+    started = time.monotonic()
+    first_byte = None
+    output_bytes = 0
+    async for chunk in stream_audio(path, audio_format, strategy):
+        if first_byte is None:
+            first_byte = time.monotonic() - started
+        output_bytes += len(chunk)
+    return {
+        'source': os.path.basename(path),
+        'strategy': strategy,
+        'input_bytes': os.path.getsize(path),
+        'output_bytes': output_bytes,
+        'cpu_seconds': round(child_cpu_seconds() - cpu_before, 3),
+        'first_byte_seconds': round(first_byte or 0.0, 3),
+        'wall_seconds': round(time.monotonic() - started, 3),
+    }
+
+
+async def run(corpus: str):
+    sources = {}
+    for name in sorted(os.listdir(corpus)):
+        path = os.path.join(corpus, name)
+        if os.path.isfile(path):
+            sources[path] = await audio_codec(path)
+    videos = [path for path in sources if 'video' in os.path.basename(path)]
+    audio = [path for path in sources if path not in videos and sources[path]]
+    if not videos or not audio:
+        raise SystemExit("The corpus needs at least one video and one audio-only file")
+
+    results = []
+    for audio_format in AUDIO_FORMATS:
+        # Like the format selectors: the matching codec if there is one, else any audio-only source
+        source = next((path for path in audio if audio_strategy(sources[path], audio_format) == STRATEGY_COPY), audio[0])
+        direct = await measure(source, sources[source], audio_format)
+        via_video = await measure(videos[0], sources[videos[0]], audio_format)
+        results.append({
+            'format': audio_format,
+            'bestaudio': direct,
+            'full_video': via_video,
+            'input_bytes_ratio': round(via_video['input_bytes'] / direct['input_bytes'], 1) if direct['input_bytes'] else None,
+        })
+        print(f"{audio_format:<5} {direct['strategy']:<10} {direct['input_bytes'] / 1e6:>8.2f} MB in  "
+              f"{direct['cpu_seconds']:>6.2f}s cpu  {direct['first_byte_seconds']:>6.3f}s ttfb  "
+              f"vs full video {via_video['input_bytes'] / 1e6:>8.2f} MB in  {via_video['cpu_seconds']:>6.2f}s cpu")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('corpus', nargs='?', help="Directory with a *video* file and audio-only files (generated when omitted)")
+    parser.add_argument('--duration', type=int, default=60, help="Seconds of generated samples")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        corpus = args.corpus
+        if not corpus:
+            corpus = scratch
+            generate_samples(corpus, args.duration)
+        results = asyncio.run(run(corpus))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'formats': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Measure CPU time saved by the skip-transcode fast path.
+
+For every file in a corpus this runs the strategy chosen by
+``plan_compression`` and a forced full transcode, and compares the CPU
+seconds ffmpeg spent on each. Without a corpus directory a small set of
+synthetic samples covering all three strategies is generated with ffmpeg.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_compression [corpus_dir] [--quality 720] [--preset quality] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from transcode import STRATEGY_TRANSCODE, compress_to_file, plan_compression
+
+# name -> ffmpeg arguments producing a 10 second sample
+SAMPLES = {
+    # H.264 within the 720p budget with AAC audio: stream copy
+    'h264_720p_aac.mp4': ['-c:v', 'libx264', '-b:v', '1500k', '-s', '1280x720', '-c:a', 'aac', '-b:a', '96k'],
+    # H.264 within budget but MP3 audio: audio-only re-encode
+    'h264_720p_mp3.mp4': ['-c:v', 'libx264', '-b:v', '1500k', '-s', '1280x720', '-c:a', 'libmp3lame', '-b:a', '192k'],
+    # Taller than the target: full transcode
+    'h264_1080p_aac.mp4': ['-c:v', 'libx264', '-b:v', '6000k', '-s', '1920x1080', '-c:a', 'aac', '-b:a', '128k'],
+    # Not H.264: full transcode
+    'mpeg4_720p_aac.mp4': ['-c:v', 'mpeg4', '-b:v', '2000k', '-s', '1280x720', '-c:a', 'aac', '-b:a', '128k'],
+}
+
+
+def generate_samples(directory: str):
+    for name, codec_args in SAMPLES.items():
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', 'testsrc2=duration=10:rate=30',
+             '-f', 'lavfi', '-i', 'sine=frequency=440:duration=10',
+             *codec_args, '-shortest', os.path.join(directory, name)],
+            check=True
+        )
+
+
+def child_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def measure(path: str, quality: int, preset: str, strategy: str):
+    cpu_before = child_cpu_seconds()
+    wall_before = time.monotonic()
+    output_path, _ = await compress_to_file(path, quality, preset, strategy)
+    result = {
+        'strategy': strategy,
+        'cpu_seconds': round(child_cpu_seconds() - cpu_before, 3),
+        'wall_seconds': round(time.monotonic() - wall_before, 3),
+        'output_bytes': os.path.getsize(output_path),
+    }
+    os.unlink(output_path)
+    return result
+
+
+async def run(corpus: str, quality: int, preset: str):
+    results = []
+    for name in sorted(os.listdir(corpus)):
+        path = os.path.join(corpus, name)
+        if not os.path.isfile(path) or '_compressed' in name:
+            continue
+        chosen = await plan_compression(path, quality, preset)
+        fast = await measure(path, quality, preset, chosen)
+        full = await measure(path, quality, preset, STRATEGY_TRANSCODE)
+        results.append({
+            'file': name,
+            'input_bytes': os.path.getsize(path),
+            'chosen': fast,
+            'transcode': full,
+            'cpu_seconds_saved': round(full['cpu_seconds'] - fast['cpu_seconds'], 3),
+        })
+        print(f"{name:<28} {chosen:<10} {fast['cpu_seconds']:>8.2f}s cpu  vs transcode {full['cpu_seconds']:>8.2f}s cpu")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('corpus', nargs='?', help="Directory of sample videos (generated when omitted)")
+    parser.add_argument('--quality', type=int, default=720)
+    parser.add_argument('--preset', default='quality')
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        corpus = args.corpus
+        if not corpus:
+            corpus = scratch
+            generate_samples(corpus)
+        results = asyncio.run(run(corpus, args.quality, args.preset))
+
+    saved = sum(r['cpu_seconds_saved'] for r in results)
+    total = sum(r['transcode']['cpu_seconds'] for r in results)
+    print(f"\nCPU seconds saved: {saved:.2f} of {total:.2f} ({saved / total * 100 if total else 0:.1f}%)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'quality': args.quality, 'preset': args.preset, 'files': results, 'cpu_seconds_saved': saved}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
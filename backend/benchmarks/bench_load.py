@@ -0,0 +1,349 @@
+"""Load-test the API against local stand-ins and report throughput and latency.
+
+Starts a media server and a RapidAPI stand-in in this process, then the
+backend in a subprocess with yt-dlp replaced by ``standins.FakeYoutubeDL``.
+Each scenario sends ``--requests`` requests at ``--concurrency`` and
+records RPS and p50/p95/p99 latency. The server's peak RSS and event-loop
+lag are recorded as well. Results are written as JSON so runs can be
+compared between commits.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_load [--requests 200] [--concurrency 20] [--scenarios info,convert,download]
+                                    [--bandwidth 0] [--latency 0] [--output results.json]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import resource
+import secrets
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.standins import api_configs, install_fake_ytdlp, media_app, rapidapi_app
+
+SCENARIOS = ('info', 'convert', 'download', 'download_compress', 'progress', 'job')
+JOB_POLL_INTERVAL = 0.1
+
+
+class JobFailed(Exception):
+    pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from short sleeps."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = collections.deque(maxlen=100000)
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def stats(self) -> Dict:
+        samples = list(self.samples)
+        return {
+            "loop_lag_ms_mean": round(statistics.mean(samples) * 1000, 3) if samples else 0.0,
+            "loop_lag_ms_p99": round(percentile(samples, 99) * 1000, 3),
+            "loop_lag_ms_max": round(max(samples) * 1000, 3) if samples else 0.0,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+    def reset(self):
+        self.samples.clear()
+        return {}
+
+
+def serve(args):
+    """Run the backend with stand-ins; started as a subprocess by the driver."""
+    install_fake_ytdlp(args.media_url, args.media_size, args.extract_latency)
+    import uvicorn
+    import main as backend
+
+    # API_CONFIGS is not defined by main itself; point RapidAPI lookups at the stand-in
+    backend.API_CONFIGS = api_configs(args.rapidapi_url)
+    monitor = LoopLagMonitor()
+    backend.app.add_api_route('/__bench/stats', monitor.stats, methods=['GET'])
+    backend.app.add_api_route('/__bench/reset', monitor.reset, methods=['POST'])
+
+    async def run():
+        task = asyncio.ensure_future(monitor.run())
+        server = uvicorn.Server(uvicorn.Config(backend.app, host='127.0.0.1', port=args.port, log_level='warning'))
+        try:
+            await server.serve()
+        finally:
+            task.cancel()
+
+    asyncio.run(run())
+
+
+def request_for(scenario: str, index: int, args) -> Dict:
+    """HTTP method, path and body of one request of a scenario."""
+    video_id = f"bench{index % args.unique_urls:06d}"
+    youtube_url = f"https://www.youtube.com/watch?v={video_id}"
+    if scenario == 'info':
+        return {'method': 'GET', 'path': '/api/info', 'params': {'url': youtube_url}}
+    if scenario == 'convert':
+        # Alternate between the yt-dlp path (YouTube) and the RapidAPI path
+        url = youtube_url if index % 2 == 0 else f"https://www.facebook.com/watch/?v={index % args.unique_urls}"
+        return {'method': 'POST', 'path': '/api/convert', 'json': {'url': url, 'quality': '360'}}
+    if scenario in ('download', 'download_compress'):
+        download_id = uuid.uuid4().hex
+        args.download_ids.append(download_id)
+        return {'method': 'POST', 'path': '/api/download', 'json': {
+            'url': youtube_url,
+            'format': 'best',
+            'quality': 360,
+            'compress': scenario == 'download_compress',
+            'download_id': download_id,
+        }}
+    if scenario == 'job':
+        # Like the frontend, sends no fileName
+        return {'method': 'POST', 'path': '/api/jobs', 'json': {'url': youtube_url, 'format': 'best', 'quality': 360}}
+    # Poll the downloads of the earlier scenarios
+    download_id = args.download_ids[index % len(args.download_ids)] if args.download_ids else 'unknown'
+    return {'method': 'GET', 'path': f"/api/progress/{download_id}"}
+
+
+async def run_job(session: aiohttp.ClientSession, base_url: str, spec: Dict) -> int:
+    """Queue a job, wait for it and fetch its file. Returns the bytes received."""
+    async with session.post(base_url + spec['path'], json=spec['json']) as response:
+        if response.status >= 400:
+            raise JobFailed(str(response.status))
+        job_id = (await response.json())['job_id']
+    while True:
+        async with session.get(f"{base_url}/api/jobs/{job_id}") as response:
+            state = (await response.json())['state']
+        if state == 'finished':
+            break
+        if state in ('failed', 'expired'):
+            raise JobFailed(state)
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+    received = 0
+    async with session.get(f"{base_url}/api/jobs/{job_id}/file") as response:
+        async for chunk in response.content.iter_chunked(256 * 1024):
+            received += len(chunk)
+        if response.status >= 400:
+            raise JobFailed(str(response.status))
+    return received
+
+
+async def run_scenario(session: aiohttp.ClientSession, base_url: str, scenario: str, args) -> Dict:
+    latencies = []
+    errors = collections.Counter()
+    bytes_received = 0
+    counter = iter(range(args.requests))
+
+    async def worker():
+        nonlocal bytes_received
+        for index in counter:
+            spec = request_for(scenario, index, args)
+            start = time.perf_counter()
+            try:
+                if scenario == 'job':
+                    bytes_received += await run_job(session, base_url, spec)
+                else:
+                    async with session.request(spec['method'], base_url + spec['path'],
+                                               params=spec.get('params'), json=spec.get('json')) as response:
+                        async for chunk in response.content.iter_chunked(256 * 1024):
+                            bytes_received += len(chunk)
+                        if response.status >= 400:
+                            errors[str(response.status)] += 1
+                            continue
+            except JobFailed as e:
+                errors[f"job {e}"] += 1
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                errors[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    async with session.post(base_url + '/__bench/reset'):
+        pass
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    async with session.get(base_url + '/__bench/stats') as response:
+        server_stats = await response.json()
+
+    return {
+        "requests": args.requests,
+        "ok": len(latencies),
+        "errors": dict(errors),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms_p50": round(percentile(latencies, 50) * 1000, 2),
+        "latency_ms_p95": round(percentile(latencies, 95) * 1000, 2),
+        "latency_ms_p99": round(percentile(latencies, 99) * 1000, 2),
+        "mb_received": round(bytes_received / 1024 / 1024, 2),
+        **server_stats,
+    }
+
+
+async def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Backend exited with {process.returncode}")
+            try:
+                async with session.get(base_url + '/__bench/stats') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Backend did not start in time")
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def drive(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    sample_path = args.sample or os.path.join(workdir, 'sample.mp4')
+    if not args.sample:
+        with open(sample_path, 'wb') as f:
+            f.write(os.urandom(args.sample_size))
+    media_size = os.path.getsize(sample_path)
+
+    media_port, rapidapi_port, api_port = free_port(), free_port(), free_port()
+    media_url = f"http://127.0.0.1:{media_port}/media/sample.mp4"
+    runners = [
+        await start_site(media_app(sample_path, args.bandwidth, args.latency), media_port),
+        await start_site(rapidapi_app(media_url, args.latency), rapidapi_port),
+    ]
+
+    # Keep the backend's caches, job queue and progress store out of the real locations
+    env = {
+        **os.environ,
+        'ARTIFACT_CACHE_ENABLED': 'true' if args.artifact_cache else 'false',
+        'ARTIFACT_CACHE_DIR': os.path.join(workdir, 'artifacts'),
+        'JOBS_DB_PATH': os.path.join(workdir, 'jobs.sqlite3'),
+        'JOBS_FILES_DIR': os.path.join(workdir, 'jobs'),
+        'PROGRESS_DB_PATH': os.path.join(workdir, 'progress.sqlite3'),
+        'YTDL_CACHE_DIR': os.path.join(workdir, 'ytdl_cache'),
+        'SCRATCH_DIR': os.path.join(workdir, 'scratch'),
+        # Every request comes from one address; measure the server, not the rate limiter
+        'ADMISSION_ENABLED': 'false',
+        'RELAY_SIGNING_KEY': os.environ.get('RELAY_SIGNING_KEY') or secrets.token_hex(32),
+    }
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.bench_load', 'serve',
+        '--port', str(api_port), '--media-url', media_url, '--media-size', str(media_size),
+        '--rapidapi-url', f"http://127.0.0.1:{rapidapi_port}", '--extract-latency', str(args.extract_latency),
+    ], env=env)
+    base_url = f"http://127.0.0.1:{api_port}"
+    results = {}
+    try:
+        await wait_until_ready(base_url, process)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=300)
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            for scenario in args.scenarios:
+                print(f"Running {scenario} ({args.requests} requests, concurrency {args.concurrency})...")
+                results[scenario] = await run_scenario(session, base_url, scenario, args)
+                print(f"  {results[scenario]['rps']} rps, p50 {results[scenario]['latency_ms_p50']} ms, "
+                      f"p99 {results[scenario]['latency_ms_p99']} ms, errors {results[scenario]['errors']}")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        for runner in runners:
+            await runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "unique_urls": args.unique_urls,
+            "sample_bytes": media_size,
+            "bandwidth": args.bandwidth,
+            "latency": args.latency,
+            "extract_latency": args.extract_latency,
+            "artifact_cache": args.artifact_cache,
+        },
+        "scenarios": results,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--port', type=int, required=True)
+        parser.add_argument('--media-url', required=True)
+        parser.add_argument('--media-size', type=int, required=True)
+        parser.add_argument('--rapidapi-url', required=True)
+        parser.add_argument('--extract-latency', type=float, default=0.05)
+        serve(parser.parse_args(sys.argv[2:]))
+        return 0
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        type=lambda value: [s for s in value.split(',') if s in SCENARIOS])
+    parser.add_argument('--unique-urls', type=int, default=50, help="Distinct videos requests are spread over")
+    parser.add_argument('--sample', help="Media file to serve (random bytes when omitted)")
+    parser.add_argument('--sample-size', type=int, default=20 * 1024 * 1024)
+    parser.add_argument('--bandwidth', type=int, default=0, help="Media server bytes/s per connection, 0 = unlimited")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every stand-in response")
+    parser.add_argument('--extract-latency', type=float, default=0.05, help="Seconds each fake extraction takes")
+    parser.add_argument('--artifact-cache', action='store_true', help="Leave the on-disk artifact cache enabled")
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+    args.download_ids = []
+
+    results = asyncio.run(drive(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Check the URL corpus against urls.parse_video_url and time parsing.
+
+Every corpus entry is verified first; the script exits non-zero if one
+maps to the wrong (platform, canonical_id). The timing compares a cold
+parse (lru_cache cleared) with a cached one.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_urls [--rounds 200] [--output results.json]
+"""
+import argparse
+import json
+import sys
+import time
+
+from urls import parse_video_url
+
+# (url, expected platform, expected canonical_id); None means unsupported
+CORPUS = [
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://youtube.com/watch?v=dQw4w9WgXcQ&t=5', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ?si=abcdef', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://m.youtube.com/shorts/dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/embed/dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/live/dQw4w9WgXcQ?feature=share', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RD', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('  HTTPS://WWW.YOUTUBE.COM/watch?v=dQw4w9WgXcQ  ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.facebook.com/watch/?v=10153231379946729', 'facebook', '10153231379946729'),
+    ('https://www.facebook.com/watch?v=10153231379946729&ref=sharing', 'facebook', '10153231379946729'),
+    ('https://www.facebook.com/someone/videos/10153231379946729/', 'facebook', '10153231379946729'),
+    ('https://m.facebook.com/someone/videos/title-slug/10153231379946729', 'facebook', '10153231379946729'),
+    ('https://www.facebook.com/reel/1234567890123', 'facebook', '1234567890123'),
+    ('https://fb.watch/abcDEF123/', 'facebook', 'fb.watch/abcDEF123'),
+    ('https://www.instagram.com/p/CuT8ld0LGvb/', 'instagram', 'CuT8ld0LGvb'),
+    ('https://www.instagram.com/reel/CuT8ld0LGvb/?igsh=xyz', 'instagram', 'CuT8ld0LGvb'),
+    ('https://instagram.com/reels/CuT8ld0LGvb', 'instagram', 'CuT8ld0LGvb'),
+    ('https://www.instagram.com/someone/reel/CuT8ld0LGvb/', 'instagram', 'CuT8ld0LGvb'),
+    ('https://www.instagram.com/tv/CuT8ld0LGvb', 'instagram', 'CuT8ld0LGvb'),
+    ('https://www.tiktok.com/@scout2015/video/6718335390845095173', 'tiktok', '6718335390845095173'),
+    ('https://www.tiktok.com/@scout2015/video/6718335390845095173?is_from_webapp=1', 'tiktok', '6718335390845095173'),
+    ('https://m.tiktok.com/v/6718335390845095173.html', 'tiktok', '6718335390845095173'),
+    ('https://vm.tiktok.com/ZMabcdef/', 'tiktok', 'vm.tiktok.com/ZMabcdef'),
+    ('https://twitter.com/someone/status/1234567890123456789', 'twitter', '1234567890123456789'),
+    ('https://x.com/someone/status/1234567890123456789?s=20', 'twitter', '1234567890123456789'),
+    ('https://mobile.twitter.com/i/status/1234567890123456789', 'twitter', '1234567890123456789'),
+    ('https://www.linkedin.com/posts/someone_title-activity-7012345678901234567-abcd', 'linkedin', '7012345678901234567'),
+    ('https://www.linkedin.com/feed/update/urn:li:activity:7012345678901234567/', 'linkedin', '7012345678901234567'),
+    ('https://www.pinterest.com/pin/123456789012345678/', 'pinterest', '123456789012345678'),
+    ('https://pin.it/abc123', 'pinterest', 'pin.it/abc123'),
+    ('https://www.youtube.com/@channel', 'youtube', 'youtube.com/@channel'),
+    ('https://www.youtube.com/@channel?si=abcdef', 'youtube', 'youtube.com/@channel'),
+    ('https://www.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf', 'youtube', 'playlist:PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf'),
+    ('https://youtube.com/playlist?list=PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI&si=abcdef', 'youtube', 'playlist:PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI'),
+    ('https://www.youtube.com/watch?list=PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI', 'youtube', 'playlist:PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI'),
+    ('https://www.youtube.com/results?search_query=cats&sp=EgIQAQ', 'youtube', 'youtube.com/results?search_query=cats&sp=EgIQAQ'),
+    ('https://www.youtube.com/results?sp=EgIQAQ&search_query=cats', 'youtube', 'youtube.com/results?search_query=cats&sp=EgIQAQ'),
+    ('https://www.facebook.com/photo.php?fbid=10153231379946729', 'facebook', '10153231379946729'),
+    ('https://www.facebook.com/photo.php?fbid=10153231379946730&set=a.1', 'facebook', '10153231379946730'),
+    ('https://www.facebook.com/groups/123/permalink/?id=456&mibextid=abc', 'facebook', 'facebook.com/groups/123/permalink?id=456'),
+    ('https://notyoutube.com/watch?v=dQw4w9WgXcQ', None, None),
+    ('https://youtube.com.evil.example/watch?v=dQw4w9WgXcQ', None, None),
+    ('https://example.com/?u=https://youtube.com/watch?v=dQw4w9WgXcQ', None, None),
+    ('https://vimeo.com/76979871', None, None),
+]
+
+
+def parse_or_none(url: str):
+    try:
+        return parse_video_url(url)
+    except ValueError:
+        return None, None
+
+
+def check_corpus() -> list:
+    failures = []
+    for url, platform, canonical_id in CORPUS:
+        parse_video_url.cache_clear()
+        got = parse_or_none(url)
+        if got != (platform, canonical_id):
+            failures.append({"url": url, "expected": [platform, canonical_id], "got": list(got)})
+    return failures
+
+
+def time_parsing(rounds: int, cached: bool) -> float:
+    """Microseconds per parse, averaged over the corpus."""
+    urls = [url for url, _, _ in CORPUS]
+    parse_video_url.cache_clear()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if not cached:
+            parse_video_url.cache_clear()
+        for url in urls:
+            parse_or_none(url)
+    return (time.perf_counter() - start) / (rounds * len(urls)) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    failures = check_corpus()
+    for failure in failures:
+        print(f"FAIL {failure['url']}: expected {failure['expected']}, got {failure['got']}")
+    results = {
+        "corpus_size": len(CORPUS),
+        "failures": failures,
+        "cold_us_per_url": round(time_parsing(args.rounds, cached=False), 3),
+        "cached_us_per_url": round(time_parsing(args.rounds, cached=True), 3),
+    }
+    print(f"{len(CORPUS) - len(failures)}/{len(CORPUS)} corpus entries OK")
+    print(f"cold: {results['cold_us_per_url']} us/url, cached: {results['cached_us_per_url']} us/url")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Compare cold and warm yt-dlp extract_info latency per platform.
+
+Cold runs build a new YoutubeDL for every extraction, the way the
+handlers used to. Warm runs borrow an instance from ``ydl_pool`` that has
+already extracted the URL once. Needs network access.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_ytdl_pool [--runs 5] [--output results.json] [platform=url ...]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import yt_dlp
+
+from ytdl import PROFILES, ydl_pool
+
+DEFAULT_URLS = {
+    'youtube': 'https://www.youtube.com/watch?v=jNQXAC9IVRw',
+    'facebook': 'https://www.facebook.com/watch/?v=10153231379946729',
+    'instagram': 'https://www.instagram.com/p/CuT8ld0LGvb/',
+    'tiktok': 'https://www.tiktok.com/@scout2015/video/6718335390845095173',
+}
+
+
+def time_cold(url: str, profile: str) -> float:
+    start = time.perf_counter()
+    with yt_dlp.YoutubeDL(dict(PROFILES[profile])) as ydl:
+        ydl.extract_info(url, download=False)
+    return time.perf_counter() - start
+
+
+def time_warm(url: str, profile: str) -> float:
+    start = time.perf_counter()
+    with ydl_pool.checkout(profile) as ydl:
+        ydl.extract_info(url, download=False)
+    return time.perf_counter() - start
+
+
+def summarize(samples):
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'min_ms': round(min(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='*', help="platform=url pairs overriding the defaults")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    urls = dict(DEFAULT_URLS)
+    for pair in args.urls:
+        platform, _, url = pair.partition('=')
+        urls[platform] = url
+
+    results = {}
+    for platform, url in urls.items():
+        try:
+            # First warm extraction fills the instance's caches
+            time_warm(url, 'info')
+            cold = [time_cold(url, 'info') for _ in range(args.runs)]
+            warm = [time_warm(url, 'info') for _ in range(args.runs)]
+        except yt_dlp.utils.DownloadError as e:
+            print(f"{platform:<10} skipped: {e}")
+            continue
+        results[platform] = {'url': url, 'cold': summarize(cold), 'warm': summarize(warm)}
+        print(f"{platform:<10} cold {results[platform]['cold']['median_ms']:>8.1f} ms   warm {results[platform]['warm']['median_ms']:>8.1f} ms")
+
+    ydl_pool.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'runs': args.runs, 'platforms': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
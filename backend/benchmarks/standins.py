@@ -0,0 +1,259 @@
+"""Local stand-ins for the services the backend talks to, used by bench_load.
+
+- ``FakeYoutubeDL`` replaces ``yt_dlp.YoutubeDL``. It returns canned info dicts
+  with separate DASH video and audio formats and a progressive one, all
+  pointing at the local media server, selects among them the way yt-dlp
+  does, and "downloads" by fetching from that server.
+- ``media_app`` serves one sample file with Range support, a per-connection
+  bandwidth cap and added latency, standing in for a video CDN.
+- ``rapidapi_app`` answers RapidAPI lookups with links to the media server.
+"""
+import asyncio
+import copy
+import hashlib
+import os
+import re
+import shutil
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+SELECTOR = re.compile(r'(best|worst)(video|audio)?((?:\[[^\]]+\])*)$')
+SELECTOR_FILTER = re.compile(r'\[(\w+)(<=|>=|!=|=|<|>)([^\]]+)\]')
+FILTER_OPS = {
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+
+
+def canned_info(url: str, media_url: str, size: int) -> Dict:
+    """Info dict shaped like yt-dlp's extractor output for a YouTube video.
+
+    Like YouTube it has video-only and audio-only DASH formats besides a
+    lower resolution progressive one, so selectors that merge and ones
+    that don't pick different formats. Formats are sorted worst to best.
+    """
+    video_id = hashlib.md5(url.encode()).hexdigest()[:11]
+    protocol = 'https' if media_url.startswith('https') else 'http'
+    common = {'url': media_url, 'protocol': protocol, 'filesize': size, 'http_headers': {'User-Agent': 'bench'}}
+    return {
+        'id': video_id,
+        'title': f'Benchmark video {video_id}',
+        'thumbnail': '',
+        'duration': 60,
+        'webpage_url': url,
+        'extractor': 'generic',
+        'formats': [
+            {**common, 'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2'},
+            {**common, 'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2',
+             'height': 360, 'width': 640, 'fps': 30},
+            {**common, 'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none',
+             'height': 1080, 'width': 1920, 'fps': 30},
+        ],
+    }
+
+
+class FakeYoutubeDL:
+    """Drop-in for the parts of yt_dlp.YoutubeDL the backend uses."""
+
+    media_url = ''
+    media_size = 0
+    # Simulated extraction time in seconds
+    extract_latency = 0.05
+
+    def __init__(self, params: Optional[Dict] = None):
+        self.params = dict(params or {})
+        self.format_selector = None
+        self._progress_hooks = list(self.params.get('progress_hooks') or [])
+        self.cookiejar = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_info_extractor(self, name: str):
+        return None
+
+    def build_format_selector(self, spec: str):
+        return spec
+
+    def _pick(self, formats: List[Dict], spec: str) -> Optional[Dict]:
+        match = SELECTOR.match(spec)
+        if match is None:
+            return next((f for f in formats if f['format_id'] == spec), None)
+        which, kind, filters = match.groups()
+        candidates = []
+        for fmt in formats:
+            video, audio = fmt.get('vcodec') != 'none', fmt.get('acodec') != 'none'
+            if (kind == 'video' and (not video or audio)) or (kind == 'audio' and (video or not audio)):
+                continue
+            if kind is None and not (video and audio):
+                continue
+            if all(self._passes(fmt, *condition) for condition in SELECTOR_FILTER.findall(filters)):
+                candidates.append(fmt)
+        if not candidates:
+            return None
+        return candidates[-1] if which == 'best' else candidates[0]
+
+    @staticmethod
+    def _passes(fmt: Dict, key: str, op: str, value: str) -> bool:
+        actual = fmt.get(key)
+        if actual is None:
+            return False
+        if isinstance(actual, (int, float)):
+            value = float(value)
+        return FILTER_OPS[op](actual, value)
+
+    def _select(self, info: Dict) -> Dict:
+        # yt-dlp's default when no format is given
+        spec = self.params.get('format') or 'bestvideo*+bestaudio/best'
+        for alternative in spec.replace('*', '').split('/'):
+            picked = [self._pick(info['formats'], part) for part in alternative.split('+')]
+            if all(picked):
+                break
+        else:
+            raise ValueError(f"Requested format is not available: {spec}")
+        # Like yt-dlp, the selected format's fields are copied over the info dict
+        selected = copy.deepcopy(info)
+        if len(picked) == 1:
+            selected.update(picked[0])
+        else:
+            selected.update({
+                'requested_formats': picked,
+                'format_id': '+'.join(f['format_id'] for f in picked),
+                'ext': 'mp4',
+                'vcodec': picked[0]['vcodec'],
+                'acodec': picked[-1]['acodec'],
+                'height': picked[0].get('height'),
+                'width': picked[0].get('width'),
+            })
+        return selected
+
+    def extract_info(self, url: str, download: bool = True, process: bool = True, **kwargs) -> Dict:
+        time.sleep(self.extract_latency)
+        info = canned_info(url, self.media_url, self.media_size)
+        if not process:
+            return info
+        return self.process_ie_result(info, download=download)
+
+    def process_ie_result(self, info: Dict, download: bool = True, **kwargs) -> Dict:
+        info = self._select(info)
+        if download:
+            self._download(info)
+        return info
+
+    def prepare_filename(self, info: Dict) -> str:
+        template = self.params.get('outtmpl') or {'default': '%(title)s.%(ext)s'}
+        if isinstance(template, dict):
+            template = template['default']
+        return template % info
+
+    def _download(self, info: Dict):
+        path = self.prepare_filename(info)
+        # Merged formats are "merged" by writing their parts one after another
+        with open(path, 'wb') as f:
+            for fmt in info.get('requested_formats') or [info]:
+                request = urllib.request.Request(fmt['url'], headers=fmt.get('http_headers') or {})
+                with urllib.request.urlopen(request) as response:
+                    shutil.copyfileobj(response, f)
+        for hook in self._progress_hooks:
+            hook({'status': 'finished', 'info_dict': info, 'filename': path})
+
+
+def install_fake_ytdlp(media_url: str, media_size: int, extract_latency: float):
+    """Replace yt_dlp.YoutubeDL before the backend modules are imported."""
+    import yt_dlp
+    FakeYoutubeDL.media_url = media_url
+    FakeYoutubeDL.media_size = media_size
+    FakeYoutubeDL.extract_latency = extract_latency
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+
+
+def media_app(sample_path: str, bandwidth: int = 0, latency: float = 0.0) -> web.Application:
+    """CDN stand-in serving ``sample_path`` at every path.
+
+    ``bandwidth`` caps each connection in bytes per second (0 = unlimited)
+    and ``latency`` delays every response by that many seconds.
+    """
+    size = os.path.getsize(sample_path)
+    chunk_size = 64 * 1024
+
+    async def serve(request: web.Request) -> web.StreamResponse:
+        if latency:
+            await asyncio.sleep(latency)
+        start, end, status = 0, size - 1, 200
+        match = RANGE.match(request.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            status = 206
+        response = web.StreamResponse(status=status, headers={
+            'Content-Type': 'video/mp4',
+            'Accept-Ranges': 'bytes',
+            'Content-Length': str(end - start + 1),
+        })
+        if status == 206:
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+        with open(sample_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                await response.write(chunk)
+                remaining -= len(chunk)
+                if bandwidth:
+                    await asyncio.sleep(len(chunk) / bandwidth)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', serve)
+    return app
+
+
+def rapidapi_app(media_url: str, latency: float = 0.0) -> web.Application:
+    """RapidAPI stand-in answering every platform lookup with media server links."""
+
+    async def lookup(request: web.Request) -> web.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        url = request.query.get('url', '')
+        title = f"Benchmark video {hashlib.md5(url.encode()).hexdigest()[:11]}"
+        return web.json_response({
+            'title': title,
+            'desc': title,
+            'hd': media_url,
+            'sd': media_url,
+            'thumb': '',
+            'downloads': {'360p': media_url},
+            'videos': {'360p': media_url},
+        })
+
+    app = web.Application()
+    app.router.add_get('/{platform}', lookup)
+    return app
+
+
+def api_configs(base_url: str) -> Dict[str, Dict[str, str]]:
+    """RapidAPI configuration pointing every platform at the stand-in."""
+    return {
+        platform: {'url': f"{base_url}/{platform}", 'host': f"{platform}.bench.local"}
+        for platform in ('facebook', 'instagram', 'tiktok')
+    }
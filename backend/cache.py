@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Metadata cache configuration
+METADATA_CACHE_MAX_BYTES = int(os.getenv("METADATA_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", 1000))
+# Titles, thumbnails and durations rarely change
+METADATA_TTL = int(os.getenv("METADATA_TTL", 3600))
+# Format URLs are signed and expire upstream, so they are refreshed sooner
+METADATA_URL_TTL = int(os.getenv("METADATA_URL_TTL", 600))
+
+
+def estimate_size(info: Dict) -> int:
+    """Approximate memory footprint of an info dict."""
+    try:
+        return len(json.dumps(info, default=str))
+    except (TypeError, ValueError):
+        return 64 * 1024
+
+
+class LeaderCancelled(Exception):
+    """The caller loading an entry for others was cancelled; one of the waiting callers takes over."""
+
+
+class MetadataCache:
+    """LRU cache for yt-dlp info dicts with a memory bound and two TTLs.
+
+    Static fields (title, thumbnail, duration) stay valid for ``ttl``
+    seconds while the signed format URLs only stay valid for ``url_ttl``.
+    Concurrent misses for the same key share a single load.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int, ttl: int, url_ttl: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.url_ttl = min(url_ttl, ttl)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: str, need_urls: bool = False) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry['stored_at']
+        if age > self.ttl:
+            self._remove(key)
+            return None
+        if need_urls and age > self.url_ttl:
+            return None
+        self._entries.move_to_end(key)
+        return entry['info']
+
+    def put(self, key: str, info: Dict):
+        size = estimate_size(info)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = {'info': info, 'size': size, 'stored_at': time.monotonic()}
+        self._bytes += size
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry['size']
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Optional[Dict]]], need_urls: bool = False) -> Optional[Dict]:
+        """Return cached info for ``key`` or load it once for all concurrent callers."""
+        while True:
+            info = self.get(key, need_urls)
+            if info is not None:
+                self.hits += 1
+                return info
+            if key not in self._inflight:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(self._inflight[key])
+            except LeaderCancelled:
+                # The first follower to get here becomes the new leader, the rest wait on it
+                continue
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            info = await loader()
+            if info is not None:
+                self.put(key, info)
+            future.set_result(info)
+            return info
+        except asyncio.CancelledError:
+            # Only this caller was cancelled, the followers retry instead of failing with it
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a load without followers doesn't warn
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+metadata_cache = MetadataCache(
+    max_bytes=METADATA_CACHE_MAX_BYTES,
+    max_entries=METADATA_CACHE_MAX_ENTRIES,
+    ttl=METADATA_TTL,
+    url_ttl=METADATA_URL_TTL,
+)
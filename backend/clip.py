@@ -0,0 +1,158 @@
+"""Clip extraction that only fetches the byte ranges a clip needs.
+
+ffmpeg seeks on the remote media itself, reading the container index and
+then just the part around the clip with range requests. It does so
+through ``RangeProxy``, a local endpoint that relays each request over
+the shared HTTP client and counts the bytes, so the response can report
+how much was fetched compared with the full size.
+"""
+import asyncio
+import logging
+import os
+import re
+import socket
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+from fastapi import HTTPException
+
+from http_client import get_http_session
+from streaming import STREAM_CHUNK_SIZE
+from transcode import STRATEGY_COPY, STRATEGY_TRANSCODE, clip_args, keyframe_near, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# A clip starting this close to a keyframe is stream-copied, otherwise the video is re-encoded
+CLIP_KEYFRAME_TOLERANCE = float(os.getenv("CLIP_KEYFRAME_TOLERANCE", 0.5))
+
+# Upstream headers ffmpeg needs to seek
+PROXY_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'Content-Type')
+CONTENT_RANGE_TOTAL = re.compile(r'bytes [^/]+/(\d+)')
+
+
+def clip_bounds(start: Optional[float], end: Optional[float], duration: Optional[float]) -> Tuple[float, float]:
+    """Validate a requested clip against the video's duration and return (start, end) in seconds."""
+    start = start or 0.0
+    if end is None:
+        if not duration:
+            raise HTTPException(status_code=400, detail="end is required when the video duration is unknown")
+        end = duration
+    if start < 0 or end <= start:
+        raise HTTPException(status_code=400, detail="Clip must satisfy 0 <= start < end")
+    if duration:
+        if start >= duration:
+            raise HTTPException(status_code=400, detail=f"start is past the end of the video ({duration}s)")
+        end = min(end, duration)
+    return start, end
+
+
+class ProxyTarget:
+    """A remote URL exposed on the local proxy, with the bytes fetched for it."""
+
+    def __init__(self, url: str, headers: Dict[str, str], local_url: str):
+        self.url = url
+        self.headers = headers
+        self.local_url = local_url
+        self.fetched = 0
+        self.total: Optional[int] = None
+
+
+class RangeProxy:
+    """Loopback HTTP server relaying range requests to registered remote URLs."""
+
+    def __init__(self):
+        self._targets: Dict[str, ProxyTarget] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._port: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    async def _ensure_started(self):
+        async with self._lock:
+            if self._runner is not None:
+                return
+            app = web.Application()
+            app.router.add_get('/{token}', self._handle)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            await web.SockSite(runner, sock).start()
+            self._port = sock.getsockname()[1]
+            self._runner = runner
+
+    async def register(self, url: str, headers: Optional[Dict[str, str]] = None) -> ProxyTarget:
+        await self._ensure_started()
+        token = uuid.uuid4().hex
+        target = ProxyTarget(url, dict(headers or {}), f"http://127.0.0.1:{self._port}/{token}")
+        self._targets[token] = target
+        return target
+
+    def unregister(self, target: ProxyTarget):
+        self._targets.pop(target.local_url.rsplit('/', 1)[1], None)
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        target = self._targets.get(request.match_info['token'])
+        if target is None:
+            raise web.HTTPNotFound()
+        headers = dict(target.headers)
+        if 'Range' in request.headers:
+            headers['Range'] = request.headers['Range']
+        async with get_http_session().get(target.url, headers=headers) as upstream:
+            response = web.StreamResponse(status=upstream.status, headers={
+                name: upstream.headers[name] for name in PROXY_RESPONSE_HEADERS if name in upstream.headers
+            })
+            match = CONTENT_RANGE_TOTAL.match(upstream.headers.get('Content-Range', ''))
+            if match:
+                target.total = int(match.group(1))
+            elif upstream.status == 200 and upstream.content_length:
+                target.total = upstream.content_length
+            await response.prepare(request)
+            try:
+                async for chunk in upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    target.fetched += len(chunk)
+                    await response.write(chunk)
+            except (ConnectionResetError, aiohttp.ClientConnectionError):
+                # ffmpeg drops the connection whenever it seeks
+                return response
+            await response.write_eof()
+            return response
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+range_proxy = RangeProxy()
+
+
+async def cut_clip(sources: List[Dict], start: float, end: float, output: str, quality=None,
+                   preset: Optional[str] = None) -> Dict:
+    """Cut start..end of the selected format(s) into ``output``.
+
+    ``sources`` is one progressive format or a (video, audio) pair. Returns
+    the strategy used and the bytes fetched and available upstream.
+    """
+    targets = [await range_proxy.register(fmt['url'], fmt.get('http_headers')) for fmt in sources]
+    try:
+        try:
+            aligned = await keyframe_near(targets[0].local_url, start, CLIP_KEYFRAME_TOLERANCE)
+        except Exception as e:
+            logger.warning(f"Keyframe probe failed, re-encoding clip: {str(e)}")
+            aligned = False
+        strategy = STRATEGY_COPY if aligned else STRATEGY_TRANSCODE
+        await run_ffmpeg(clip_args([t.local_url for t in targets], start, end, output, strategy, quality, preset))
+    finally:
+        for target in targets:
+            range_proxy.unregister(target)
+
+    totals = [target.total or fmt.get('filesize') for target, fmt in zip(targets, sources)]
+    result = {
+        'strategy': strategy,
+        'bytes_fetched': sum(target.fetched for target in targets),
+        'source_bytes': sum(totals) if all(totals) else None,
+    }
+    logger.info(f"Cut {end - start:.1f}s clip ({strategy}), fetched {result['bytes_fetched']} of {result['source_bytes']} bytes")
+    return result
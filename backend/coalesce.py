@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        # Values the callers passed as ``subscriber``; the list grows while the work runs
+        self.subscribers: List[Any] = []
+
+
+class RequestCoalescer:
+    """Deduplicates identical in-flight work within a worker.
+
+    The first caller for a key (the leader) starts the work as a task and
+    later callers (followers) await the same task. The work runs detached
+    from any single request, so a leader whose client disconnects does not
+    fail its followers; it is only cancelled once every caller has left.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.leaders: Dict[str, int] = {}
+        self.followers: Dict[str, int] = {}
+
+    def _finished(self, key: Hashable, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def subscribers(self, kind: str, key: Hashable) -> List[Any]:
+        """The ``subscriber`` values of the callers of in-flight work, or [] if there is none."""
+        flight = self._inflight.get((kind, key))
+        return flight.subscribers if flight else []
+
+    async def run(self, kind: str, key: Hashable, work: Callable[[], Awaitable[Any]],
+                  discard: Optional[Callable[[Any], None]] = None, subscriber: Any = None) -> Any:
+        """Run ``work`` once for all concurrent callers with the same key.
+
+        ``discard`` receives the result if it arrives after every caller has
+        been cancelled, so resources such as temp dirs can be released.
+        ``subscriber`` (e.g. a progress ID) is added to ``subscribers``, so
+        the work can report to every caller rather than only the leader.
+        """
+        key = (kind, key)
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(work()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._finished(key, flight))
+            self.leaders[kind] = self.leaders.get(kind, 0) + 1
+        else:
+            self.followers[kind] = self.followers.get(kind, 0) + 1
+            logger.debug(f"Coalesced {kind} request for {key[1]}")
+
+        if subscriber is not None:
+            flight.subscribers.append(subscriber)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0:
+                if not flight.task.done():
+                    flight.task.cancel()
+                elif discard and not flight.task.cancelled() and flight.task.exception() is None:
+                    discard(flight.task.result())
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        kinds = sorted(set(self.leaders) | set(self.followers))
+        stats = {}
+        for kind in kinds:
+            leaders = self.leaders.get(kind, 0)
+            followers = self.followers.get(kind, 0)
+            stats[kind] = {
+                "leaders": leaders,
+                "followers": followers,
+                "coalesce_ratio": round(followers / (leaders + followers), 4) if leaders + followers else 0.0,
+            }
+        return {"in_flight": len(self._inflight), "kinds": stats}
+
+
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Worker pool configuration
+YTDLP_WORKERS = int(os.getenv("YTDLP_WORKERS", 8))
+YTDLP_QUEUE_SIZE = int(os.getenv("YTDLP_QUEUE_SIZE", 32))
+# Comma separated "platform=limit" pairs, e.g. "youtube=4,facebook=2"
+YTDLP_PLATFORM_LIMITS = os.getenv("YTDLP_PLATFORM_LIMITS", "youtube=4,facebook=2,instagram=2,tiktok=2")
+
+
+def parse_platform_limits(value: str) -> Dict[str, int]:
+    """Parse a "platform=limit,..." string into a dict."""
+    limits = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        platform, limit = item.split('=', 1)
+        try:
+            limits[platform.strip()] = max(1, int(limit))
+        except ValueError:
+            logger.warning(f"Ignoring invalid platform limit: {item}")
+    return limits
+
+
+class YtdlpExecutor:
+    """Bounded thread pool that all blocking yt-dlp work goes through.
+
+    Jobs first wait on a per-platform semaphore and then run on a shared
+    thread pool. Once more than ``max_workers + max_queue`` jobs are
+    pending, new ones are rejected with a 503 instead of piling up.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, platform_limits: Optional[Dict[str, int]] = None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.platform_limits = platform_limits or {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ytdlp")
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._pending = 0
+        self._active = 0
+        self._platform_active: Dict[str, int] = {}
+        self._max_queue_depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def _semaphore(self, platform: str) -> asyncio.Semaphore:
+        if platform not in self._semaphores:
+            limit = self.platform_limits.get(platform, self.max_workers)
+            self._semaphores[platform] = asyncio.Semaphore(limit)
+        return self._semaphores[platform]
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs accepted but not yet running."""
+        return self._pending - self._active
+
+    def _record_wait(self, wait: float):
+        self._started += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+
+    async def run(self, platform: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` on the pool under the platform's limit."""
+        if self._pending >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            logger.warning(f"yt-dlp queue full, rejecting {platform} job (depth={self.queue_depth})")
+            raise HTTPException(status_code=503, detail="Server is busy, please try again shortly")
+
+        loop = asyncio.get_running_loop()
+        enqueued = time.monotonic()
+        self._pending += 1
+        self._max_queue_depth = max(self._max_queue_depth, self.queue_depth)
+
+        def job():
+            # Measured on the worker thread so pool queueing counts as wait time
+            loop.call_soon_threadsafe(self._record_wait, time.monotonic() - enqueued)
+            return fn(*args, **kwargs)
+
+        try:
+            async with self._semaphore(platform):
+                self._active += 1
+                self._platform_active[platform] = self._platform_active.get(platform, 0) + 1
+                try:
+                    result = await loop.run_in_executor(self._pool, job)
+                    self._completed += 1
+                    return result
+                except Exception:
+                    self._failed += 1
+                    raise
+                finally:
+                    self._active -= 1
+                    self._platform_active[platform] -= 1
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue-depth and wait-time metrics."""
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.max_queue,
+            "platform_limits": self.platform_limits,
+            "active": self._active,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self._max_queue_depth,
+            "platform_active": dict(self._platform_active),
+            "started": self._started,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "avg_wait_seconds": round(self._wait_total / self._started, 4) if self._started else 0.0,
+            "max_wait_seconds": round(self._wait_max, 4),
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+ytdlp_executor = YtdlpExecutor(
+    max_workers=YTDLP_WORKERS,
+    max_queue=YTDLP_QUEUE_SIZE,
+    platform_limits=parse_platform_limits(YTDLP_PLATFORM_LIMITS),
+)
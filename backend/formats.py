@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+
+from http_client import get_http_session
+
+logger = logging.getLogger(__name__)
+
+# Fill in missing format sizes with HEAD requests in the background
+FORMAT_SIZE_PROBE = os.getenv("FORMAT_SIZE_PROBE", "true").lower() == "true"
+FORMAT_PROBE_CONCURRENCY = int(os.getenv("FORMAT_PROBE_CONCURRENCY", 8))
+
+_probe_tasks = set()
+_probe_slots: Optional[asyncio.Semaphore] = None
+
+
+def has_video(fmt: Dict) -> bool:
+    vcodec = fmt.get('vcodec')
+    # Some extractors leave vcodec unset but do report a height
+    return vcodec != 'none' and (vcodec is not None or bool(fmt.get('height')))
+
+
+def has_audio(fmt: Dict) -> bool:
+    return fmt.get('acodec') not in (None, 'none')
+
+
+def best_audio(formats: List[Dict]) -> Optional[Dict]:
+    """Audio-only format yt-dlp would merge with a video-only one."""
+    audio = [f for f in formats if has_audio(f) and f.get('vcodec') == 'none']
+    # yt-dlp sorts formats from worst to best
+    return audio[-1] if audio else None
+
+
+def best_by_height(formats: List[Dict]) -> Dict[int, Dict]:
+    """Best video format per height, matching bestvideo[height<=N]."""
+    by_height = {}
+    for fmt in formats:
+        if has_video(fmt) and fmt.get('height'):
+            # Later formats are better
+            by_height[fmt['height']] = fmt
+    return by_height
+
+
+def _total(*values) -> Optional[int]:
+    if any(value is None for value in values):
+        return None
+    return int(sum(values))
+
+
+def format_ladder(info: Dict) -> List[Dict]:
+    """One entry per available height, best format first, as the downloads select them.
+
+    Video-only formats are merged with the best audio when downloaded, so
+    their sizes include it.
+    """
+    formats = info.get('formats') or [info]
+    audio = best_audio(formats)
+    ladder = []
+    for height, fmt in sorted(best_by_height(formats).items(), reverse=True):
+        muxed = has_audio(fmt)
+        parts = [fmt] if muxed or audio is None else [fmt, audio]
+        ladder.append({
+            'format_id': f"{height}p",
+            'source_format_id': fmt.get('format_id'),
+            'height': height,
+            'width': fmt.get('width'),
+            'ext': fmt.get('ext'),
+            'fps': fmt.get('fps'),
+            'vcodec': fmt.get('vcodec'),
+            'acodec': fmt.get('acodec') if muxed else (audio or {}).get('acodec', 'none'),
+            'has_audio': muxed or audio is not None,
+            'filesize': _total(*(f.get('filesize') for f in parts)),
+            'filesize_approx': _total(*(f.get('filesize') or f.get('filesize_approx') for f in parts)),
+            'format_note': fmt.get('format_note') or f"{height}p",
+        })
+    return ladder
+
+
+def expected_download_size(info: Dict, max_height: Optional[int] = None) -> Optional[int]:
+    """Approximate bytes a download of up to ``max_height`` writes, or None if unknown."""
+    for entry in format_ladder(info):
+        if max_height is None or entry['height'] <= max_height:
+            return entry['filesize'] or entry['filesize_approx']
+    return info.get('filesize') or info.get('filesize_approx')
+
+
+def _needs_probe(fmt: Dict) -> bool:
+    return (
+        not fmt.get('filesize')
+        and not fmt.get('_size_probed')
+        and str(fmt.get('protocol', 'https')).startswith('http')
+        and bool(fmt.get('url'))
+    )
+
+
+async def _probe_size(fmt: Dict):
+    global _probe_slots
+    if _probe_slots is None:
+        _probe_slots = asyncio.Semaphore(FORMAT_PROBE_CONCURRENCY)
+    async with _probe_slots:
+        try:
+            async with get_http_session().head(fmt['url'], headers=fmt.get('http_headers'), allow_redirects=True) as response:
+                length = response.headers.get('Content-Length')
+                if response.status == 200 and length and length.isdigit():
+                    # Stored on the cached info dict, so later ladders include it
+                    fmt['filesize'] = int(length)
+        except Exception as e:
+            logger.debug(f"Size probe failed for format {fmt.get('format_id')}: {str(e)}")
+
+
+def schedule_size_probes(info: Dict):
+    """Start HEAD requests for ladder formats without a known size. Does not wait for them."""
+    if not FORMAT_SIZE_PROBE:
+        return
+    formats = info.get('formats') or []
+    candidates = list(best_by_height(formats).values())
+    audio = best_audio(formats)
+    if audio is not None:
+        candidates.append(audio)
+
+    pending = [fmt for fmt in candidates if _needs_probe(fmt)]
+    if not pending:
+        return
+    for fmt in pending:
+        fmt['_size_probed'] = True
+    task = asyncio.ensure_future(asyncio.gather(*(_probe_size(fmt) for fmt in pending)))
+    _probe_tasks.add(task)
+    task.add_done_callback(_probe_tasks.discard)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Shared connection pool configuration
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", 0.5))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 8))
+# Circuit breaker: open after this many consecutive failures, retry after the cooldown
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+class UpstreamError(Exception):
+    """An upstream HTTP call failed after all retries."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(Exception):
+    """Calls to a host are short-circuited because it keeps failing."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for a single upstream host."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        # In half-open state calls go through; the next result closes or re-opens it
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    if host not in _breakers:
+        _breakers[host] = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+    return _breakers[host]
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_TTL,
+        use_dns_cache=True,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+    )
+
+
+async def start_http_client():
+    """Create the application-lifetime connection pool."""
+    global _session
+    _session = _create_session()
+
+
+async def close_http_client():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it lazily outside the app lifespan."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff, honouring a numeric Retry-After."""
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+async def get_json(url: str, headers: Optional[Dict[str, str]] = None, params: Optional[Dict[str, Any]] = None, breaker_key: Optional[str] = None) -> Any:
+    """GET a JSON document through the shared pool with retries and a circuit breaker."""
+    breaker = get_breaker(breaker_key) if breaker_key else None
+    if breaker and not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {breaker_key}")
+
+    session = get_http_session()
+    last_error: Optional[UpstreamError] = None
+    for attempt in range(HTTP_RETRIES + 1):
+        retry_after = None
+        try:
+            async with session.get(url, headers=headers, params=params) as response:
+                if response.status == 200:
+                    data = await response.json(content_type=None)
+                    if breaker:
+                        breaker.record_success()
+                    return data
+                error_text = await response.text()
+                last_error = UpstreamError(response.status, error_text)
+                if response.status not in RETRY_STATUSES:
+                    # Client errors are not the host's fault, don't trip the breaker
+                    raise last_error
+                retry_after = response.headers.get('Retry-After')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_error = UpstreamError(502, str(e) or e.__class__.__name__)
+
+        if breaker:
+            breaker.record_failure()
+            if not breaker.allow():
+                break
+        if attempt < HTTP_RETRIES:
+            delay = backoff_delay(attempt, retry_after)
+            logger.warning(f"Retrying {breaker_key or url} in {delay:.2f}s after: {last_error}")
+            await asyncio.sleep(delay)
+
+    raise last_error
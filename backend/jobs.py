@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from streaming import remove_temp_dir
+
+logger = logging.getLogger(__name__)
+
+# Background download job configuration
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(tempfile.gettempdir(), "video_downloader_jobs.sqlite3"))
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", 2))
+# Seconds a finished job's file is kept for GET /api/jobs/{id}/file
+JOBS_RETENTION = int(os.getenv("JOBS_RETENTION", 3600))
+# Finished job files are kept here, away from the scratch janitor and artifact cache eviction
+JOBS_FILES_DIR = os.getenv("JOBS_FILES_DIR", os.path.join(tempfile.gettempdir(), "video_downloader_jobs"))
+# Seconds expired and failed job records are kept before being deleted
+JOBS_HISTORY_TTL = int(os.getenv("JOBS_HISTORY_TTL", 86400))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", 1.0))
+
+JOB_STATES = ('queued', 'running', 'finished', 'failed', 'expired')
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def keep_job_file(job_id: str, path: str) -> Tuple[str, str]:
+    """Hardlink (or copy, across filesystems) a finished download into a directory owned by the job.
+
+    Returns the job's file and directory. Blocking.
+    """
+    job_dir = os.path.join(JOBS_FILES_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    target = os.path.join(job_dir, os.path.basename(path))
+    # Left over from an earlier run of a requeued job
+    if os.path.exists(target):
+        os.unlink(target)
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+    return target, job_dir
+
+
+class JobStore:
+    """SQLite-backed job queue that survives worker restarts.
+
+    Every uvicorn worker opens the same file; ``claim_next`` takes a job
+    inside an immediate transaction so each job runs on one worker only.
+    Methods block (up to the 5s busy timeout while another worker holds the
+    write lock), so call them through run_in_threadpool. A lock keeps the
+    shared connection to one thread at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+            "request TEXT NOT NULL, created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+            "worker_pid INTEGER, file_path TEXT, temp_dir TEXT, headers TEXT, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (state, priority DESC, created_at)")
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['request'] = json.loads(job['request'])
+        job['headers'] = json.loads(job['headers']) if job['headers'] else {}
+        return job
+
+    def create(self, request: Dict, priority: int = 0) -> str:
+        with self._lock:
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, state, priority, request, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, priority, json.dumps(request), time.time())
+            )
+            return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._row(self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically move the highest-priority queued job to running."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE state = 'queued' ORDER BY priority DESC, created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'running', started_at = ?, worker_pid = ? WHERE id = ?",
+                        (time.time(), os.getpid(), row['id'])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._row(row)
+
+    def finish(self, job_id: str, file_path: str, temp_dir: Optional[str], headers: Dict[str, str]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'finished', finished_at = ?, file_path = ?, temp_dir = ?, headers = ? WHERE id = ?",
+                (time.time(), file_path, temp_dir, json.dumps(headers), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                (time.time(), error, job_id)
+            )
+
+    def requeue_orphans(self):
+        """Put running jobs whose worker is gone back in the queue."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, worker_pid FROM jobs WHERE state = 'running'").fetchall()
+            for row in rows:
+                if row['worker_pid'] == os.getpid() or not pid_alive(row['worker_pid']):
+                    logger.info(f"Requeueing job {row['id']} from stopped worker {row['worker_pid']}")
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'queued', started_at = NULL, worker_pid = NULL WHERE id = ? AND state = 'running'",
+                        (row['id'],)
+                    )
+
+    def requeue_owned(self):
+        """Put this worker's running jobs back in the queue on shutdown."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'queued', started_at = NULL, worker_pid = NULL WHERE state = 'running' AND worker_pid = ?",
+                (os.getpid(),)
+            )
+
+    def expire(self, retention: int, history_ttl: int):
+        """Remove files of jobs finished more than ``retention`` seconds ago."""
+        with self._lock:
+            now = time.time()
+            rows = self._conn.execute(
+                "SELECT id, temp_dir FROM jobs WHERE state = 'finished' AND finished_at < ?",
+                (now - retention,)
+            ).fetchall()
+            for row in rows:
+                remove_temp_dir(row['temp_dir'])
+                self._conn.execute("UPDATE jobs SET state = 'expired', file_path = NULL WHERE id = ?", (row['id'],))
+            self._conn.execute(
+                "DELETE FROM jobs WHERE state IN ('expired', 'failed') AND finished_at < ?",
+                (now - history_ttl,)
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+            counts = {state: 0 for state in JOB_STATES}
+            counts.update({row[0]: row[1] for row in rows})
+            return counts
+
+
+class JobScheduler:
+    """Runs queued jobs with bounded concurrency in the background.
+
+    ``runner`` receives the stored request dict and the job ID and returns
+    a DownloadedVideo. Its file is linked into a directory of the job's own
+    under JOBS_FILES_DIR, which is kept until the job's retention runs out,
+    and the download's temp dir is released right away.
+    """
+
+    def __init__(self, store: JobStore, runner: Callable[[Dict, str], Awaitable[Any]], concurrency: int, retention: int):
+        self.store = store
+        self.runner = runner
+        self.concurrency = concurrency
+        self.retention = retention
+        self._wake = asyncio.Event()
+        self._active = set()
+        self._task: Optional[asyncio.Task] = None
+        self._last_expire = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        tasks = list(self._active)
+        if self._task:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await run_in_threadpool(self.store.requeue_owned)
+
+    def notify(self):
+        self._wake.set()
+
+    async def _loop(self):
+        try:
+            await run_in_threadpool(self.store.requeue_orphans)
+        except sqlite3.Error as e:
+            logger.error(f"Error requeueing orphaned jobs: {str(e)}")
+        while True:
+            try:
+                while len(self._active) < self.concurrency:
+                    job = await run_in_threadpool(self.store.claim_next)
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run(job))
+                    self._active.add(task)
+                    task.add_done_callback(self._job_done)
+                if time.monotonic() - self._last_expire > 60:
+                    self._last_expire = time.monotonic()
+                    await run_in_threadpool(self.store.expire, self.retention, JOBS_HISTORY_TTL)
+            except sqlite3.Error as e:
+                logger.error(f"Job scheduler error: {str(e)}")
+            try:
+                # Other workers may enqueue jobs too, so poll as well as wait for a wake-up
+                await asyncio.wait_for(self._wake.wait(), timeout=JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _job_done(self, task: asyncio.Task):
+        self._active.discard(task)
+        self.notify()
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job['id']
+        logger.info(f"Starting job {job_id}")
+        try:
+            video = await self.runner(job['request'], job_id)
+            try:
+                path, job_dir = await run_in_threadpool(keep_job_file, job_id, video.path)
+            finally:
+                remove_temp_dir(video.temp_dir)
+            await run_in_threadpool(self.store.finish, job_id, path, job_dir, video.headers)
+            logger.info(f"Job {job_id} finished")
+        except asyncio.CancelledError:
+            raise
+        except HTTPException as he:
+            logger.error(f"Job {job_id} failed: {he.detail}")
+            await run_in_threadpool(self.store.fail, job_id, str(he.detail))
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            await run_in_threadpool(self.store.fail, job_id, str(e))
@@ -1,28 +1,52 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, PlainTextResponse, Response
 from pydantic import BaseModel, validator, HttpUrl
 from typing import Optional, List, Dict, Any
 import yt_dlp
 import os
-import tempfile
-import shutil
 import logging
 import traceback
 from urllib.parse import quote, urlparse
 import aiohttp
 import asyncio
 import json
+import copy
+import functools
 from datetime import datetime
 import hashlib
+import uuid
 import requests
-import io
-import ffmpeg
+from contextlib import asynccontextmanager
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables before the modules below read their configuration
 load_dotenv()
 
+from executor import ytdlp_executor
+from ytdl import ydl_pool
+from cache import metadata_cache
+from streaming import file_response, remove_temp_dir, retain_temp_dir
+from relay import check_signing_key, needs_relay, progressive_format, relay_response, sign_relay_token, url_expiry, verify_relay_token
+from progress import FINAL_STATUSES, progress_store
+from artifacts import ARTIFACT_CACHE_ENABLED, artifact_cache, artifact_key
+from transcode import (AUDIO_FORMATS, COMPRESSION_PRESET, COMPRESSION_PRESETS, audio_strategy, compress_to_file,
+                       plan_compression, stream_audio, stream_compressed)
+from clip import clip_bounds, cut_clip, range_proxy
+from thumbnails import THUMBNAIL_MAX_AGE, pick_width, thumbnail_cache, thumbnail_path, verify_thumbnail
+from coalesce import request_coalescer
+from admission import ADMISSION_INFO_COST, admission_controller, audio_cost, download_cost, is_admin
+from formats import expected_download_size, format_ladder, schedule_size_probes
+from scratch import scratch_space
+from segmented import SEGMENTED_DOWNLOADS, SEGMENT_MIN_SIZE, download_with_fallback
+from urls import DOWNLOAD_PLATFORMS, canonical_key, get_platform, is_playlist_url, is_supported_url
+from batch import BATCH_DOWNLOAD_CONCURRENCY, BATCH_MAX_ITEMS, ZipStream, attachment_filename, error_detail, ndjson_line, run_batch
+from jobs import JOBS_CONCURRENCY, JOBS_DB_PATH, JOBS_RETENTION, JobScheduler, JobStore
+from metrics import METRICS_ENABLED, merge_hook, monitor_event_loop_lag, register_collector, render_metrics, stage_timer, track_inflight
+from http_client import CircuitOpenError, UpstreamError, close_http_client, get_json, start_http_client
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,23 +62,12 @@ HOST = os.getenv("HOST", "0.0.0.0")  # Use 0.0.0.0 to listen on all interfaces
 # Configure CORS with environment variable
 FRONTEND_URL = os.getenv("FRONTEND_URL", "*")
 
-SUPPORTED_PLATFORMS = {
-    "youtube.com": "youtube",
-    "youtu.be": "youtube",
-    "facebook.com": "facebook",
-    "fb.watch": "facebook",
-    "instagram.com": "instagram",
-    "twitter.com": "twitter",
-    "x.com": "twitter",
-    "tiktok.com": "tiktok",
-    "linkedin.com": "linkedin"
-}
-
-# In-memory storage for download progress
-download_progress = {}
+# Server-Sent Events progress stream
+PROGRESS_POLL_INTERVAL = float(os.getenv("PROGRESS_POLL_INTERVAL", 0.5))
+PROGRESS_KEEPALIVE = float(os.getenv("PROGRESS_KEEPALIVE", 15))
 
-# Add at the top of the file with other global variables
-video_info_cache = {}
+# Protocols ffmpeg reads audio from directly; anything else is downloaded first
+AUDIO_INPUT_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')
 
 class VideoRequest(BaseModel):
     url: str
@@ -66,8 +79,8 @@ class VideoRequest(BaseModel):
     def validate_url(cls, v):
         if not v:
             raise ValueError('URL is required')
-        if not any(platform in v.lower() for platform in ['youtube.com', 'youtu.be', 'facebook.com', 'instagram.com', 'tiktok.com', 'twitter.com', 'pinterest.com']):
-            raise ValueError('Invalid URL. Please enter a valid video URL from YouTube, Facebook, Instagram, TikTok, Twitter, or Pinterest.')
+        if not is_supported_url(v):
+            raise ValueError('Invalid URL. Please enter a valid video URL from YouTube, Facebook, Instagram, TikTok, Twitter, LinkedIn, or Pinterest.')
         return v
 
 class VideoFormat(BaseModel):
@@ -81,6 +94,8 @@ class VideoFormat(BaseModel):
 class VideoResponse(BaseModel):
     title: str
     thumbnail: Optional[str] = None
+    # Signed /api/thumbnail path serving the thumbnail resized as WebP
+    thumbnail_proxy: Optional[str] = None
     duration: Optional[str] = None
     formats: List[VideoFormat]
     platform: str
@@ -96,9 +111,44 @@ class DownloadProgress(BaseModel):
 class VideoDownloadRequest(BaseModel):
     url: str
     format: str
-    fileName: str = None
+    fileName: Optional[str] = None
+    compress: bool = False
+    quality: Optional[int] = None
+    # "file" downloads the whole video before sending it, "stream" relays
+    # progressive formats to the client while they are still being fetched,
+    # "redirect" sends the client to the media URL (or a signed relay URL)
+    mode: str = "file"
+    # Client-chosen ID to follow the download at /api/progress/{download_id}
+    download_id: Optional[str] = None
+    # Compression preset: "fast", "balanced" or "quality" (default from COMPRESSION_PRESET)
+    preset: Optional[str] = None
+    # Stream only the audio as "mp3", "m4a" or "opus" instead of the video
+    audio_format: Optional[str] = None
+    # Cut a clip from start to end (in seconds), fetching only the byte ranges it needs
+    start: Optional[float] = None
+    end: Optional[float] = None
+
+class JobRequest(VideoDownloadRequest):
+    # Higher priorities are scheduled first
+    priority: int = 0
+
+class BatchRequest(BaseModel):
+    urls: List[str]
+    # Playlist URLs are replaced by the videos they contain
+    expand_playlists: bool = True
+
+class BatchDownloadRequest(BatchRequest):
+    quality: int = 720
     compress: bool = False
-    quality: int = None
+    preset: Optional[str] = None
+
+class DownloadedVideo:
+    """A finished download on disk together with the temp dir that owns it."""
+
+    def __init__(self, path: str, temp_dir: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.temp_dir = temp_dir
+        self.headers = headers or {}
 
 def generate_download_id(url: str) -> str:
     """Generate a unique download ID based on URL and timestamp."""
@@ -106,26 +156,68 @@ def generate_download_id(url: str) -> str:
     url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
     return f"{timestamp}_{url_hash}"
 
-def progress_hook(d):
+# download_id of a coalesced download's shared work -> download_ids of every request waiting on it
+progress_subscribers: Dict[str, List[str]] = {}
+
+def progress_hook(d, download_ids: Optional[List[str]] = None):
     """Track download progress."""
+    if download_ids is None:
+        download_ids = [d.get('info_dict', {}).get('download_id')]
     if d['status'] == 'downloading':
-        download_id = d.get('info_dict', {}).get('download_id')
-        if download_id:
-            download_progress[download_id] = {
-                'status': 'downloading',
-                'progress': d.get('_percent_str', '0%').replace('%', ''),
-                'speed': d.get('_speed_str', 'N/A'),
-                'eta': d.get('_eta_str', 'N/A')
-            }
+        # The store throttles these to a few writes per second
+        progress = {
+            'status': 'downloading',
+            'progress': d.get('_percent_str', '0%').replace('%', '').strip(),
+            'speed': d.get('_speed_str', 'N/A'),
+            'eta': d.get('_eta_str', 'N/A')
+        }
     elif d['status'] == 'finished':
-        download_id = d.get('info_dict', {}).get('download_id')
+        # One file is done; more files, the merge or compression may follow.
+        # The final "finished" is written once the whole download is ready.
+        progress = {
+            'status': 'processing',
+            'progress': '100'
+        }
+    else:
+        return
+    # Followers may join while the hook runs on a worker thread
+    for download_id in list(download_ids):
         if download_id:
-            download_progress[download_id] = {
-                'status': 'finished',
-                'progress': '100%'
-            }
+            progress_store.set(download_id, progress)
+
+def mark_finished(request: VideoDownloadRequest):
+    """Report the download as done to /api/progress, ending its event stream."""
+    if request.download_id:
+        progress_store.set(request.download_id, {'status': 'finished', 'progress': '100'})
+
+def progress_hooks(request: VideoDownloadRequest) -> List:
+    """yt-dlp progress hooks reporting under the request's download_id, or those of every request sharing it."""
+    if not request.download_id:
+        return [progress_hook]
+    download_ids = progress_subscribers.get(request.download_id, [request.download_id])
+    return [functools.partial(progress_hook, download_ids=download_ids)]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_signing_key()
+    await start_http_client()
+    # Warm the yt-dlp pool in the background so startup isn't delayed
+    warmup = asyncio.create_task(ytdlp_executor.run('warmup', ydl_pool.warm))
+    scratch_space.start_janitor()
+    job_scheduler.start()
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag()) if METRICS_ENABLED else None
+    yield
+    await job_scheduler.stop()
+    await scratch_space.stop_janitor()
+    await range_proxy.stop()
+    await close_http_client()
+    warmup.cancel()
+    if lag_monitor:
+        lag_monitor.cancel()
+    ytdlp_executor.shutdown()
+    ydl_pool.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -134,20 +226,165 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Url-Expires", "X-Compression-Strategy", "X-Audio-Strategy", "X-Clip-Strategy",
+                    "X-Bytes-Fetched", "X-Source-Bytes", "Retry-After"],
 )
 
-def get_platform(url: str) -> str:
-    """Determine the platform from the URL."""
-    if 'youtube.com' in url or 'youtu.be' in url:
-        return 'youtube'
-    elif 'facebook.com' in url or 'fb.watch' in url:
-        return 'facebook'
-    elif 'instagram.com' in url:
-        return 'instagram'
-    elif 'tiktok.com' in url:
-        return 'tiktok'
-    else:
-        raise ValueError("Unsupported platform")
+# Key under which cached info dicts keep the extractor's result from before format selection
+UNPROCESSED_INFO = '__unprocessed'
+
+def run_extract_cacheable(url: str, profile: str) -> Optional[Dict]:
+    """Extract video info for metadata_cache. Blocking, run it via ytdlp_executor.
+
+    Format selection copies the selected format's fields (url, format_id,
+    requested_formats, ...) into the info dict, and selecting again on that
+    dict keeps whichever of them the new format does not overwrite. The
+    extractor's result is kept under UNPROCESSED_INFO so later selections
+    start from it instead.
+    """
+    with ydl_pool.checkout(profile) as ydl:
+        raw = ydl.extract_info(url, download=False, process=False)
+        if not raw or raw.get('_type', 'video') != 'video':
+            # Playlists and URL redirects may hold lazy entries; they are extracted again when selected
+            return ydl.process_ie_result(raw, download=False) if raw else raw
+        info = ydl.process_ie_result(copy.deepcopy(raw), download=False)
+        if info is not None:
+            info[UNPROCESSED_INFO] = raw
+        return info
+
+def run_extract_info(url: str, profile: str, overrides: Optional[Dict] = None, info: Optional[Dict] = None) -> Optional[Dict]:
+    """Extract video info with a pooled yt-dlp instance. Blocking, run it via ytdlp_executor.
+
+    When ``info`` comes from metadata_cache only format selection runs,
+    skipping the network extraction.
+    """
+    with ydl_pool.checkout(profile, **(overrides or {})) as ydl:
+        if info is not None and info.get(UNPROCESSED_INFO):
+            return ydl.process_ie_result(copy.deepcopy(info[UNPROCESSED_INFO]), download=False)
+        return ydl.extract_info(url, download=False)
+
+def run_download(url: str, profile: str, overrides: Optional[Dict] = None, info: Optional[Dict] = None):
+    """Download a video with a pooled yt-dlp instance and return (info, filename). Blocking, run it via ytdlp_executor."""
+    with ydl_pool.checkout(profile, **(overrides or {})) as ydl:
+        if info is not None and info.get(UNPROCESSED_INFO):
+            info = ydl.process_ie_result(copy.deepcopy(info[UNPROCESSED_INFO]), download=True)
+        else:
+            info = ydl.extract_info(url, download=True)
+        filename = ydl.prepare_filename(info) if info else None
+        return info, filename
+
+def run_prepare_filename(profile: str, overrides: Dict, info: Dict) -> str:
+    """Output path yt-dlp would use for ``info``. Blocking, run it via ytdlp_executor."""
+    with ydl_pool.checkout(profile, **overrides) as ydl:
+        return ydl.prepare_filename(info)
+
+async def download_media(platform: str, url: str, profile: str, overrides: Dict, info: Dict):
+    """Download a video and return (info, filename), like run_download.
+
+    Progressive formats are fetched with the segmented multi-connection
+    engine; merged formats, small files and failed segmented fetches go
+    through yt-dlp. The "fetch" stage timing includes yt-dlp's ffmpeg
+    merge, which is also timed on its own as "merge".
+    """
+    with stage_timer('fetch', platform):
+        if SEGMENTED_DOWNLOADS:
+            selected = await ytdlp_executor.run(platform, run_extract_info, url, profile, {'format': overrides['format']}, info)
+            fmt = progressive_format(selected)
+            if fmt and (fmt['filesize'] is None or fmt['filesize'] >= SEGMENT_MIN_SIZE):
+                filename = await ytdlp_executor.run(platform, run_prepare_filename, profile, {'outtmpl': overrides['outtmpl']}, selected)
+                try:
+                    await download_with_fallback(fmt['url'], filename, fmt['http_headers'], fmt['filesize'],
+                                                 progress_hooks=overrides.get('progress_hooks'))
+                    return selected, filename
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    logger.warning(f"Segmented download failed, falling back to yt-dlp: {str(e)}")
+                    if os.path.exists(filename):
+                        os.unlink(filename)
+        if METRICS_ENABLED:
+            overrides = {**overrides, 'postprocessor_hooks': [merge_hook(platform)]}
+        return await ytdlp_executor.run(platform, run_download, url, profile, overrides, info)
+
+async def allocate_temp_dir(request: VideoDownloadRequest, info: Dict, max_height: Optional[int] = None) -> str:
+    """Scratch directory for a download, reserving the size of the format it will select."""
+    size = expected_download_size(info, max_height)
+    if size and request.compress:
+        # The compressed copy is written next to the download
+        size *= 2
+    return await scratch_space.allocate(size)
+
+async def get_cached_info(url: str, platform: str, need_urls: bool = False) -> Optional[Dict]:
+    """Get the yt-dlp info dict for a URL, extracting it at most once per TTL.
+
+    Pass ``need_urls`` when the signed format URLs will be used, so that
+    entries older than METADATA_URL_TTL are re-extracted.
+    """
+    async def extract():
+        with stage_timer('extract', platform):
+            return await ytdlp_executor.run(platform, run_extract_cacheable, url, 'info')
+
+    return await metadata_cache.get_or_load(canonical_key(url), extract, need_urls=need_urls)
+
+@app.get("/api/stats/executor")
+async def get_executor_stats():
+    """Queue depth and wait-time metrics of the yt-dlp worker pool."""
+    return ytdlp_executor.stats()
+
+@app.get("/api/stats/artifacts")
+async def get_artifact_stats():
+    """Hit ratio and bytes saved by the on-disk artifact cache."""
+    return artifact_cache.stats()
+
+@app.get("/api/stats/ytdl")
+async def get_ytdl_pool_stats():
+    """Instances created and reused per yt-dlp option profile."""
+    return ydl_pool.stats()
+
+@app.get("/api/stats/cache")
+async def get_cache_stats():
+    """Hit/miss counters of the metadata cache."""
+    return metadata_cache.stats()
+
+@app.get("/api/stats/scratch")
+async def get_scratch_stats():
+    """Reserved bytes per scratch root, quota waits and janitor removals."""
+    return scratch_space.stats()
+
+@app.get("/api/stats/admission")
+async def get_admission_stats(http_request: Request):
+    """Admission limits and global budget utilisation, plus the most expensive clients for ADMIN_TOKEN holders."""
+    return admission_controller.stats(include_clients=is_admin(http_request))
+
+@app.get("/api/stats/thumbnails")
+async def get_thumbnail_stats():
+    """Memory and disk tier usage and hit ratio of the thumbnail cache."""
+    return thumbnail_cache.stats()
+
+@app.get("/api/stats/coalesce")
+async def get_coalesce_stats():
+    """Leader/follower counts and coalesce ratio of deduplicated requests."""
+    return request_coalescer.stats()
+
+def cache_counters() -> Dict:
+    """Hit, miss and coalesced lookups of the metadata and artifact caches."""
+    values = {}
+    for name, stats in (('metadata', metadata_cache.stats()), ('artifacts', artifact_cache.stats())):
+        for result in ('hits', 'misses', 'coalesced'):
+            values[(('cache', name), ('result', result))] = stats[result]
+    return values
+
+if METRICS_ENABLED:
+    register_collector("video_downloader_cache_lookups_total", "Cache lookups by cache and result", cache_counters, kind='counter')
+    register_collector("video_downloader_executor_queue_depth", "yt-dlp jobs waiting for a worker",
+                       lambda: {(): ytdlp_executor.queue_depth})
+    register_collector("video_downloader_scratch_reserved_bytes", "Scratch space reserved by running jobs, per root",
+                       lambda: {(('root', root.name),): root.reserved for root in scratch_space.roots})
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics, when METRICS_ENABLED is set."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 async def fetch_from_rapidapi(platform: str, url: str) -> Dict:
     """Fetch video information from RapidAPI."""
@@ -164,27 +401,29 @@ async def fetch_from_rapidapi(platform: str, url: str) -> Dict:
     if platform == "youtube":
         params["format"] = "mp4"
     
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(api_config["url"], headers=headers, params=params) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"RapidAPI error for {platform}: {error_text}")
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail=f"Failed to fetch video from {platform}"
-                    )
-                
-                data = await response.json()
-                logger.info(f"RapidAPI response for {platform}: {data}")
-                return data
-                
-        except aiohttp.ClientError as e:
-            logger.error(f"RapidAPI request failed for {platform}: {str(e)}")
+    try:
+        with stage_timer('extract', platform):
+            data = await get_json(api_config["url"], headers=headers, params=params, breaker_key=api_config["host"])
+        logger.debug(f"RapidAPI response for {platform}: {data}")
+        return data
+        
+    except CircuitOpenError:
+        logger.warning(f"RapidAPI circuit open for {platform}, skipping request")
+        raise HTTPException(
+            status_code=503,
+            detail=f"{platform} service is temporarily unavailable"
+        )
+    except UpstreamError as e:
+        logger.error(f"RapidAPI error for {platform}: {str(e)}")
+        if e.status == 502:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to connect to {platform} service"
             )
+        raise HTTPException(
+            status_code=e.status,
+            detail=f"Failed to fetch video from {platform}"
+        )
 
 def parse_rapidapi_response(platform: str, data: Dict) -> VideoResponse:
     """Parse RapidAPI response into our VideoResponse format."""
@@ -292,13 +531,48 @@ def parse_rapidapi_response(platform: str, data: Dict) -> VideoResponse:
 @app.get("/api/progress/{download_id}")
 async def get_download_progress(download_id: str):
     """Get the progress of a download."""
-    if download_id not in download_progress:
+    progress = progress_store.get(download_id)
+    if progress is None:
         raise HTTPException(status_code=404, detail="Download not found")
-    return download_progress[download_id]
+    return progress
+
+@app.get("/api/progress/{download_id}/events")
+async def stream_download_progress(download_id: str, request: Request):
+    """Push progress updates as Server-Sent Events until the download ends."""
+    async def events():
+        last = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            progress = progress_store.get(download_id)
+            if progress is not None and progress != last:
+                last = progress
+                idle = 0.0
+                yield f"data: {json.dumps(progress)}\n\n"
+                if progress.get('status') in FINAL_STATUSES:
+                    return
+            elif idle >= PROGRESS_KEEPALIVE:
+                idle = 0.0
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+            await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+            idle += PROGRESS_POLL_INTERVAL
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/convert")
-async def convert_video(request: VideoRequest):
+async def convert_video(request: VideoRequest, http_request: Request):
     """Handle video conversion for all platforms."""
+    admission_controller.admit(http_request, ADMISSION_INFO_COST)
+    # Identical concurrent requests share one conversion
+    key = (canonical_key(request.url), request.quality)
+    return await request_coalescer.run('convert', key, lambda: perform_convert(request))
+
+async def perform_convert(request: VideoRequest):
+    """Convert a video URL into its download URLs."""
     try:
         platform = get_platform(request.url)
         logger.info(f"Processing convert request for platform: {platform}")
@@ -346,541 +620,898 @@ async def convert_video(request: VideoRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/formats")
-async def get_formats(url: str):
+async def get_formats(url: str, http_request: Request):
     """Get available formats for a video URL."""
+    admission_controller.admit(http_request, ADMISSION_INFO_COST)
     try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False
-        }
+        try:
+            platform = get_platform(url)
+        except ValueError:
+            platform = 'other'
+
+        info = await get_cached_info(url, platform)
+        if not info:
+            raise HTTPException(status_code=400, detail="Could not extract video information")
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if not info:
-                raise HTTPException(status_code=400, detail="Could not extract video information")
-            
-            # Define standard formats
-            standard_formats = [
-                {'format_id': '1080p', 'height': 1080, 'ext': 'mp4'},
-                {'format_id': '720p', 'height': 720, 'ext': 'mp4'},
-                {'format_id': '360p', 'height': 360, 'ext': 'mp4'},
-                {'format_id': '240p', 'height': 240, 'ext': 'mp4'},
-                {'format_id': '144p', 'height': 144, 'ext': 'mp4'}
-            ]
-            
-            return {"formats": standard_formats}
+        # Missing sizes are probed in the background and show up on the next request
+        schedule_size_probes(info)
+        return {"formats": format_ladder(info)}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting formats: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get video formats: {str(e)}")
 
-def compress_video(input_stream, quality):
-    input_file = None
-    output_file = None
+async def compress_video(input_path: str, quality, preset: Optional[str] = None, platform: str = 'unknown'):
+    """Compress a downloaded video next to the original.
+
+    Returns the path to serve and the strategy used (copy, audio or
+    transcode), or the original path and "none" if compression failed.
+    """
     try:
-        # Create temporary files with unique names
-        input_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        output_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        
-        # Close the files to release handles
-        input_file.close()
-        output_file.close()
-        
-        # Write input data to temporary file
-        with open(input_file.name, 'wb') as f:
-            f.write(input_stream.read())
-        
-        # Calculate bitrate based on quality
-        bitrate = {
-            1080: '5000k',
-            720: '2500k',
-            480: '1000k',
-            360: '750k',
-            240: '500k',
-            144: '250k'
-        }.get(quality, '1000k')
-        
-        # Run FFmpeg command
-        ffmpeg.input(input_file.name).output(
-            output_file.name,
-            vcodec='libx264',
-            acodec='aac',
-            video_bitrate=bitrate,
-            audio_bitrate='128k',
-            preset='medium',
-            movflags='faststart'
-        ).overwrite_output().run(quiet=True)
-        
-        # Read compressed output
-        with open(output_file.name, 'rb') as f:
-            compressed_data = f.read()
-        
-        if len(compressed_data) == 0:
-            raise ValueError("Compression resulted in empty file")
+        with stage_timer('compress', platform):
+            # Runs as an async subprocess in the bounded transcoding pool
+            output_path, strategy = await compress_to_file(input_path, quality, preset)
+            
+            if os.path.getsize(output_path) == 0:
+                raise ValueError("Compression resulted in empty file")
         
-        return io.BytesIO(compressed_data)
+        logger.info(f"Compressed {os.path.basename(input_path)} using strategy: {strategy}")
+        return output_path, strategy
     
     except Exception as e:
         logger.error(f"Compression error: {str(e)}")
         # Return original video if compression fails
-        input_stream.seek(0)
-        return input_stream
-    
-    finally:
-        # Clean up temp files
+        output_path = os.path.splitext(input_path)[0] + '_compressed.mp4'
         try:
-            if input_file and os.path.exists(input_file.name):
-                os.unlink(input_file.name)
-            if output_file and os.path.exists(output_file.name):
-                os.unlink(output_file.name)
+            if os.path.exists(output_path):
+                os.unlink(output_path)
         except Exception as e:
             logger.error(f"Error cleaning up temp files: {str(e)}")
+        return input_path, 'none'
 
-async def download_video(request: VideoDownloadRequest):
-    """Download video in specified quality."""
-    platform = get_platform(request.url)
+async def download_video(request: VideoDownloadRequest) -> DownloadedVideo:
+    """Download video in specified quality, compressing it if requested."""
+    with stage_timer('detect') as timer:
+        platform = timer.platform = get_platform(request.url)
     
-    if platform == 'youtube':
-        return await download_youtube_video(request)
+    if is_clip(request) and platform in DOWNLOAD_PLATFORMS:
+        video = await download_clip(request, platform)
+    elif platform == 'youtube':
+        video = await download_youtube_video(request)
     elif platform == 'facebook':
-        return await download_facebook_video(request)
+        video = await download_facebook_video(request)
     elif platform == 'instagram':
-        return await download_instagram_video(request)
+        video = await download_instagram_video(request)
     elif platform == 'tiktok':
-        return await download_tiktok_video(request)
+        video = await download_tiktok_video(request)
     else:
         raise HTTPException(status_code=400, detail="Unsupported platform")
 
+    if request.compress:
+        logger.info(f"Compressing {platform} video...")
+        video.path, strategy = await compress_video(video.path, request.quality, request.preset, platform)
+        video.headers['X-Compression-Strategy'] = strategy
+    return video
+
+def is_clip(request: VideoDownloadRequest) -> bool:
+    return request.start is not None or request.end is not None
+
+async def download_clip(request: VideoDownloadRequest, platform: str) -> DownloadedVideo:
+    """Cut request.start..request.end out of a video without downloading all of it.
+
+    Formats served over plain HTTP(S) are cut by ffmpeg seeking on the
+    remote file, stream-copied when the clip starts on a keyframe and
+    re-encoded otherwise. Segmented formats (HLS, DASH) fall back to
+    yt-dlp's download_ranges, which fetches only the segments covering the
+    clip. The response reports the bytes fetched next to the full size.
+    """
+    temp_dir = None
+    try:
+        info = await get_cached_info(request.url, platform, need_urls=True)
+        if not info:
+            raise HTTPException(status_code=400, detail="Could not extract video information")
+        start, end = clip_bounds(request.start, request.end, info.get('duration'))
+        selector = stream_format_selector(request, platform)
+        selected = await ytdlp_executor.run(platform, run_extract_info, request.url, 'info', {'format': selector}, info)
+        if not selected:
+            raise HTTPException(status_code=400, detail="Could not select a format for this video")
+        sources = selected.get('requested_formats') or [selected]
+
+        size = expected_download_size(info, None if platform == 'instagram' else request.quality)
+        if size and info.get('duration'):
+            size = int(size * (end - start) / info['duration']) + 1
+            if request.compress:
+                size *= 2
+        temp_dir = await scratch_space.allocate(size)
+
+        safe_title = ''.join(c for c in info.get('title', '') if c.isalnum() or c in (' ', '-', '_')).strip().replace(' ', '_')
+        filename = os.path.join(temp_dir, 'clip.mp4')
+        with stage_timer('fetch', platform):
+            if all(fmt.get('url') and fmt.get('protocol', 'https') in ('http', 'https') for fmt in sources):
+                result = await cut_clip(sources, start, end, filename, request.quality, request.preset)
+            else:
+                logger.info(f"Clip of {request.url} uses a segmented format, cutting it with yt-dlp")
+                profile = 'youtube-download' if platform == 'youtube' else 'download'
+                await ytdlp_executor.run(platform, run_download, request.url, profile, {
+                    'format': selector,
+                    'outtmpl': os.path.join(temp_dir, 'clip.%(ext)s'),
+                    'download_ranges': yt_dlp.utils.download_range_func(None, [(start, end)]),
+                    'progress_hooks': progress_hooks(request)
+                }, info)
+                # The section is written under a name derived from the template, not the one returned
+                outputs = [os.path.join(temp_dir, name) for name in os.listdir(temp_dir) if not name.endswith('.part')]
+                if not outputs:
+                    raise HTTPException(status_code=400, detail="Downloaded clip not found")
+                filename = max(outputs, key=os.path.getsize)
+                result = {'strategy': 'ytdlp', 'bytes_fetched': None, 'source_bytes': None}
+
+        if os.path.getsize(filename) == 0:
+            raise HTTPException(status_code=400, detail="Downloaded clip is empty")
+        output_filename = request.fileName or f"{safe_title}_{start:g}-{end:g}.{filename.rsplit('.', 1)[-1]}"
+        headers = {
+            "Content-Disposition": f'attachment; filename="{output_filename.encode("ascii", "ignore").decode("ascii")}"',
+            "Content-Type": "video/mp4",
+            "X-Clip-Strategy": result['strategy'],
+        }
+        if result['bytes_fetched'] is not None:
+            headers['X-Bytes-Fetched'] = str(result['bytes_fetched'])
+        if result['source_bytes'] is not None:
+            headers['X-Source-Bytes'] = str(result['source_bytes'])
+        return DownloadedVideo(path=filename, temp_dir=temp_dir, headers=headers)
+
+    except HTTPException:
+        remove_temp_dir(temp_dir)
+        raise
+    except Exception as e:
+        remove_temp_dir(temp_dir)
+        logger.error(f"Error cutting clip: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=400, detail=f"Failed to cut clip: {str(e)}")
+
+def stream_format_selector(request: VideoDownloadRequest, platform: str) -> str:
+    """Format selector matching the one used by the platform's download function."""
+    if platform == 'facebook':
+        return 'best'
+    if platform == 'instagram':
+        return request.format
+    return f'bestvideo[height<={request.quality}]+bestaudio/best[height<={request.quality}]'
+
+async def resolve_progressive(request: VideoDownloadRequest):
+    """Select the requested format from cached metadata.
+
+    Returns (format, output filename), or None when the selection needs
+    merging (or uses a segmented protocol) and so has to be downloaded.
+    """
+    platform = get_platform(request.url)
+    ydl_opts = {
+        'format': stream_format_selector(request, platform)
+    }
+    info = await get_cached_info(request.url, platform, need_urls=True)
+    if not info:
+        raise HTTPException(status_code=400, detail="Could not extract video information")
+    info = await ytdlp_executor.run(platform, run_extract_info, request.url, 'info', ydl_opts, info)
+    fmt = progressive_format(info)
+    if not fmt:
+        logger.info(f"No progressive format for {request.url}, falling back to full download")
+        return None
+    return fmt, request.fileName or f"{info.get('title') or platform + '_video'}.{fmt['ext']}"
+
+async def stream_video(request: VideoDownloadRequest, http_request: Request):
+    """Relay a progressive format straight from the video host.
+
+    Returns None when the selected format needs merging (or uses a
+    segmented protocol), in which case the caller falls back to the
+    regular download path.
+    """
+    resolved = await resolve_progressive(request)
+    if resolved is None:
+        return None
+    fmt, output_filename = resolved
+    logger.info(f"Relaying video for URL: {request.url}")
+    return await relay_response(
+        fmt,
+        headers={'Content-Disposition': f'attachment; filename="{quote(output_filename)}"'},
+        range_header=http_request.headers.get('range'),
+        platform=get_platform(request.url)
+    )
+
+async def redirect_video(request: VideoDownloadRequest, http_request: Request):
+    """Send the client to the media URL so the bytes never pass through us.
+
+    URLs bound to this server's IP are replaced by a short-lived signed
+    /api/relay URL. Returns None when the format has to be downloaded.
+    """
+    resolved = await resolve_progressive(request)
+    if resolved is None:
+        return None
+    fmt, output_filename = resolved
+    expires = url_expiry(fmt['url'])
+    relayed = needs_relay(fmt)
+    if relayed:
+        location = str(http_request.url_for('relay_video', token=sign_relay_token(fmt, output_filename, expires)))
+    else:
+        location = fmt['url']
+    headers = {'Location': location}
+    if expires:
+        headers['X-Url-Expires'] = str(expires)
+    return JSONResponse(
+        status_code=302,
+        content={"url": location, "expires_at": expires, "relayed": relayed, "filename": output_filename},
+        headers=headers
+    )
+
+async def stream_audio_download(request: VideoDownloadRequest, http_request: Request) -> StreamingResponse:
+    """Stream only the audio of a video as MP3, M4A or Opus.
+
+    The best audio-only format is selected directly (preferring one that
+    already has the target codec, which is then remuxed instead of
+    transcoded) and ffmpeg reads it straight from the video host. Formats
+    ffmpeg cannot read from a URL are downloaded to scratch space first.
+    """
+    target = AUDIO_FORMATS[request.audio_format]
+    platform = get_platform(request.url)
+    info = await get_cached_info(request.url, platform, need_urls=True)
+    if not info:
+        raise HTTPException(status_code=400, detail="Could not extract video information")
+    selected = await ytdlp_executor.run(platform, run_extract_info, request.url, 'info', {'format': target['selector']}, info)
+    if not selected:
+        raise HTTPException(status_code=400, detail="No audio available for this video")
+    start = end = None
+    if is_clip(request):
+        start, end = clip_bounds(request.start, request.end, info.get('duration'))
+    strategy = audio_strategy(selected.get('acodec'), request.audio_format)
+
+    temp_dir = None
+    if selected.get('url') and selected.get('protocol', 'https') in AUDIO_INPUT_PROTOCOLS:
+        source, http_headers = selected['url'], selected.get('http_headers')
+    else:
+        temp_dir = await scratch_space.allocate(selected.get('filesize') or selected.get('filesize_approx'))
+        try:
+            profile = 'youtube-download' if platform == 'youtube' else 'download'
+            _, source = await download_media(platform, request.url, profile, {
+                'format': target['selector'],
+                'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
+                'progress_hooks': progress_hooks(request)
+            }, info)
+        except BaseException:
+            remove_temp_dir(temp_dir)
+            raise
+        http_headers = None
+
+    logger.info(f"Streaming {request.audio_format} audio ({strategy}) for URL: {request.url}")
+    output_filename = request.fileName or f"{info.get('title') or platform + '_audio'}.{target['ext']}"
+    return StreamingResponse(
+        stream_audio(source, request.audio_format, strategy, http_headers, start, end),
+        media_type=target['media_type'],
+        headers={
+            'Content-Disposition': f'attachment; filename="{quote(output_filename)}"',
+            'X-Audio-Strategy': strategy
+        },
+        background=BackgroundTask(remove_temp_dir, temp_dir) if temp_dir else None
+    )
+
+@app.get("/api/thumbnail")
+async def get_thumbnail(url: str, sig: str, http_request: Request, w: Optional[int] = None):
+    """Serve a video thumbnail handed out as ``thumbnail_proxy``, resized to the nearest width to ``w``."""
+    verify_thumbnail(url, sig)
+    thumbnail = await thumbnail_cache.get(url, pick_width(w))
+    headers = {'ETag': thumbnail.etag, 'Cache-Control': f'public, max-age={THUMBNAIL_MAX_AGE}'}
+    if_none_match = http_request.headers.get('if-none-match')
+    if if_none_match:
+        tags = {tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')}
+        if '*' in tags or thumbnail.etag in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(content=thumbnail.body, media_type=thumbnail.content_type, headers=headers)
+
+@app.get("/api/relay/{token}")
+async def relay_video(token: str, http_request: Request):
+    """Relay a media URL handed out by mode=redirect."""
+    data = verify_relay_token(token)
+    return await relay_response(
+        data,
+        headers={'Content-Disposition': f'attachment; filename="{quote(data["filename"])}"'},
+        range_header=http_request.headers.get('range')
+    )
+
+def download_variant(request: VideoDownloadRequest, platform: str) -> str:
+    """Rendition of a video a download request produces."""
+    variant = request.format if platform == 'instagram' else str(request.quality)
+    if request.compress:
+        variant = f"{variant}:{request.preset or COMPRESSION_PRESET}"
+    if is_clip(request):
+        variant = f"{variant}@{request.start or 0}-{'end' if request.end is None else request.end}"
+    return variant
+
+async def produce_download(request: VideoDownloadRequest, platform: str, variant: str) -> DownloadedVideo:
+    """Download video, serving repeated requests from the artifact cache."""
+    if not ARTIFACT_CACHE_ENABLED:
+        return await download_video(request)
+    key = artifact_key(platform, canonical_key(request.url), variant, request.compress)
+    path, headers = await artifact_cache.get_or_produce(key, lambda: download_video(request))
+    # Cached files are owned by the cache, there is no temp dir to clean up
+    return DownloadedVideo(path=path, headers=headers)
+
+async def download_video_cached(request: VideoDownloadRequest) -> DownloadedVideo:
+    """Download video once for all identical concurrent requests, using the artifact cache."""
+    platform = get_platform(request.url)
+    variant = download_variant(request, platform)
+    key = (platform, canonical_key(request.url), variant, request.compress)
+    running = request_coalescer.subscribers('download', key)
+    if running and request.download_id:
+        # Joining a download that is under way: start from its current progress
+        current = progress_store.get(running[0])
+        if current:
+            progress_store.set(request.download_id, current)
+
+    # The shared work reports progress to every waiting request and leaves the filename to each of them
+    shared = request.copy(update={'fileName': None, 'download_id': f"shared-{uuid.uuid4().hex}"})
+
+    async def produce():
+        progress_subscribers[shared.download_id] = request_coalescer.subscribers('download', key)
+        try:
+            return await produce_download(shared, platform, variant)
+        finally:
+            progress_subscribers.pop(shared.download_id, None)
+
+    video = await request_coalescer.run(
+        'download',
+        key,
+        produce,
+        discard=lambda v: remove_temp_dir(v.temp_dir),
+        subscriber=request.download_id
+    )
+    # Every request sharing the file removes its temp dir once; the last one deletes it
+    retain_temp_dir(video.temp_dir)
+    headers = dict(video.headers)
+    if request.fileName:
+        headers['Content-Disposition'] = f'attachment; filename="{quote(request.fileName)}"'
+    mark_finished(request)
+    return DownloadedVideo(path=video.path, temp_dir=video.temp_dir, headers=headers)
+
+async def stream_compressed_video(request: VideoDownloadRequest) -> StreamingResponse:
+    """Pipe ffmpeg's fragmented MP4 output to the client while it encodes."""
+    source = await download_video_cached(request.copy(update={'compress': False}))
+    strategy = await plan_compression(source.path, request.quality, request.preset)
+    headers = {k: v for k, v in source.headers.items() if k != 'Content-Length'}
+    headers['X-Compression-Strategy'] = strategy
+    return StreamingResponse(
+        stream_compressed(source.path, request.quality, request.preset, strategy),
+        media_type='video/mp4',
+        headers=headers,
+        background=BackgroundTask(remove_temp_dir, source.temp_dir) if source.temp_dir else None
+    )
+
+def download_request_cost(request: VideoDownloadRequest) -> float:
+    """Admission cost of a download, from cached metadata when there is some."""
+    if request.mode == "redirect" and not request.compress and not request.audio_format and not is_clip(request):
+        # Only metadata is looked up, the client fetches the bytes
+        return ADMISSION_INFO_COST
+    info = metadata_cache.get(canonical_key(request.url))
+    if is_clip(request) and info and info.get('duration'):
+        # Charge for the clip, not the whole video
+        start, end = request.start or 0, request.end if request.end is not None else info['duration']
+        info = {**info, 'duration': max(0, min(end, info['duration']) - start)}
+    if request.audio_format:
+        return audio_cost(info)
+    return download_cost(info, request.quality, request.compress)
+
 @app.post("/api/download")
-async def handle_download(request: VideoDownloadRequest):
+async def handle_download(request: VideoDownloadRequest, http_request: Request):
     """Handle video download request."""
+    with track_inflight():
+        return await serve_download(request, http_request)
+
+async def serve_download(request: VideoDownloadRequest, http_request: Request):
+    """Answer a download request by streaming, redirecting or serving the downloaded file."""
     try:
-        return await download_video(request)
+        if request.preset and request.preset not in COMPRESSION_PRESETS:
+            raise HTTPException(status_code=400, detail=f"Unknown compression preset: {request.preset}")
+        if request.audio_format and request.audio_format not in AUDIO_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown audio format: {request.audio_format}")
+        admission_controller.admit(http_request, download_request_cost(request))
+
+        if request.audio_format:
+            response = await stream_audio_download(request, http_request)
+            mark_finished(request)
+            return response
+
+        # Clips are always cut on our side and served as a file
+        if request.mode == "stream" and request.compress and not is_clip(request):
+            return await stream_compressed_video(request)
+        if request.mode == "stream" and not is_clip(request):
+            response = await stream_video(request, http_request)
+            if response is not None:
+                mark_finished(request)
+                return response
+        if request.mode == "redirect" and not request.compress and not is_clip(request):
+            # Compressed output only exists on our side, so it is always served from here
+            response = await redirect_video(request, http_request)
+            if response is not None:
+                mark_finished(request)
+                return response
+
+        video = await download_video_cached(request)
+        # The temp dir is removed by a background task after the last byte is sent
+        return file_response(http_request, video.path, headers=video.headers, temp_dir=video.temp_dir,
+                             platform=get_platform(request.url))
+    except HTTPException as he:
+        if request.download_id:
+            progress_store.set(request.download_id, {'status': 'error', 'progress': '0', 'error': str(he.detail)})
+        raise
     except Exception as e:
         logger.error(f"Download error: {str(e)}\n{traceback.format_exc()}")
+        if request.download_id:
+            progress_store.set(request.download_id, {'status': 'error', 'progress': '0', 'error': str(e)})
         raise HTTPException(status_code=500, detail=str(e))
 
+async def run_download_job(request_data: Dict, job_id: str) -> DownloadedVideo:
+    """Run a queued job through the regular download path."""
+    # Report progress under the job ID unless the client chose its own
+    request = VideoDownloadRequest(**{**request_data, 'download_id': request_data.get('download_id') or job_id})
+    with track_inflight():
+        try:
+            return await download_video_cached(request)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            progress_store.set(request.download_id, {'status': 'error', 'progress': '0', 'error': str(detail)})
+            raise
+
+job_store = JobStore(JOBS_DB_PATH)
+job_scheduler = JobScheduler(job_store, run_download_job, concurrency=JOBS_CONCURRENCY, retention=JOBS_RETENTION)
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(request: JobRequest, http_request: Request):
+    """Queue a download and return its job ID immediately."""
+    try:
+        platform = get_platform(request.url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if platform not in DOWNLOAD_PLATFORMS:
+        raise HTTPException(status_code=400, detail="Unsupported platform")
+    if request.audio_format:
+        raise HTTPException(status_code=400, detail="Audio-only downloads are streamed, use /api/download")
+    # Charged when queued, so a client cannot queue more than it could download
+    admission_controller.admit(http_request, download_request_cost(request))
+    job_id = await run_in_threadpool(job_store.create, request.dict(exclude={'priority'}, exclude_none=True), request.priority)
+    job_scheduler.notify()
+    logger.info(f"Queued job {job_id} for URL: {request.url}")
+    return {"job_id": job_id, "state": "queued"}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the state and progress of a download job."""
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    progress_id = job['request'].get('download_id') or job_id
+    return {
+        "job_id": job_id,
+        "state": job['state'],
+        "priority": job['priority'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+        "error": job['error'],
+        "progress": progress_store.get(progress_id),
+        "file_url": f"/api/jobs/{job_id}/file" if job['state'] == 'finished' else None
+    }
+
+@app.get("/api/jobs/{job_id}/file")
+async def get_job_file(job_id: str, http_request: Request):
+    """Stream the finished artifact of a download job."""
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['state'] == 'expired':
+        raise HTTPException(status_code=410, detail="Job file has expired")
+    if job['state'] != 'finished':
+        raise HTTPException(status_code=409, detail=f"Job is {job['state']}")
+    if not job['file_path'] or not os.path.exists(job['file_path']):
+        raise HTTPException(status_code=410, detail="Job file is no longer available")
+    # The file stays until the job's retention runs out, so no cleanup here
+    return file_response(http_request, job['file_path'], headers=job['headers'])
+
+def batch_platform(url: str) -> str:
+    try:
+        return get_platform(url)
+    except ValueError:
+        return 'other'
+
+async def list_playlist(url: str) -> List[str]:
+    """Video URLs of a playlist, listing at most one more than a batch may hold."""
+    info = await ytdlp_executor.run('youtube', run_extract_info, url, 'playlist', {'playlistend': BATCH_MAX_ITEMS + 1})
+    entries = (info or {}).get('entries') or []
+    return [entry.get('url') or entry.get('webpage_url') for entry in entries if entry]
+
+async def expand_batch_urls(request: BatchRequest, http_request: Request) -> List[str]:
+    """Video URLs of a batch with playlists expanded and duplicates removed."""
+    if len(request.urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch is limited to {BATCH_MAX_ITEMS} videos")
+    playlists = list(dict.fromkeys(url for url in request.urls if request.expand_playlists and is_playlist_url(url)))
+    if playlists:
+        # Listing a playlist is a metadata lookup, charged before it runs
+        admission_controller.admit(http_request, ADMISSION_INFO_COST * len(playlists))
+    listed = dict(zip(playlists, await asyncio.gather(*(list_playlist(url) for url in playlists))))
+    urls = []
+    for url in request.urls:
+        if url in listed:
+            urls.extend(listed[url])
+        else:
+            urls.append(url)
+
+    unique = {}
+    for url in urls:
+        if url:
+            unique.setdefault(canonical_key(url), url)
+    if not unique:
+        raise HTTPException(status_code=400, detail="No URLs to process")
+    if len(unique) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch is limited to {BATCH_MAX_ITEMS} videos")
+    return list(unique.values())
+
+@app.post("/api/batch/info")
+async def batch_info(request: BatchRequest, http_request: Request):
+    """Get info for many URLs at once, streamed as NDJSON lines in completion order."""
+    urls = await expand_batch_urls(request, http_request)
+    admission_controller.admit(http_request, ADMISSION_INFO_COST * len(urls))
+
+    async def lines():
+        async for index, info, error in run_batch(urls, lookup_video_info, batch_platform):
+            if error is None:
+                yield ndjson_line({"index": index, "url": urls[index], "ok": True, "info": info})
+            else:
+                yield ndjson_line({"index": index, "url": urls[index], "ok": False, "error": error_detail(error)})
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def batch_download_request(url: str, request: BatchDownloadRequest) -> VideoDownloadRequest:
+    """Download request for one batch item, with the format selector the frontend uses."""
+    if batch_platform(url) in ('instagram', 'tiktok'):
+        video_format = 'best'
+    else:
+        video_format = f'bestvideo[height<={request.quality}]+bestaudio/best[height<={request.quality}]'
+    return VideoDownloadRequest(url=url, format=video_format, quality=request.quality,
+                                compress=request.compress, preset=request.preset)
+
+@app.post("/api/batch/download")
+async def batch_download(request: BatchDownloadRequest, http_request: Request):
+    """Download many videos into a ZIP archive that is streamed while it is built.
+
+    Videos are added in the order they finish downloading. Failed items are
+    listed in an errors.json entry at the end of the archive.
+    """
+    if request.preset and request.preset not in COMPRESSION_PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown compression preset: {request.preset}")
+    urls = await expand_batch_urls(request, http_request)
+    admission_controller.admit(http_request, sum(
+        download_request_cost(batch_download_request(url, request)) for url in urls
+    ))
+
+    async def archive():
+        zip_stream = ZipStream()
+        errors = []
+        downloads = run_batch(
+            urls,
+            lambda url: download_video_cached(batch_download_request(url, request)),
+            batch_platform,
+            concurrency=BATCH_DOWNLOAD_CONCURRENCY,
+            cleanup=lambda video: remove_temp_dir(video.temp_dir)
+        )
+        async for index, video, error in downloads:
+            if error is not None:
+                logger.error(f"Batch download failed for {urls[index]}: {error_detail(error)}")
+                errors.append({"index": index, "url": urls[index], "error": error_detail(error)})
+                continue
+            try:
+                name = f"{index + 1:03d} - {attachment_filename(video.headers, 'video.mp4')}"
+                async for chunk in zip_stream.add_file(name, video.path):
+                    yield chunk
+            finally:
+                remove_temp_dir(video.temp_dir)
+        if errors:
+            yield zip_stream.add_bytes('errors.json', json.dumps(errors, indent=2).encode())
+        yield zip_stream.close()
+
+    return StreamingResponse(
+        archive(),
+        media_type='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="videos.zip"'}
+    )
+
 async def convert_youtube_video(request: VideoRequest):
     """Handle YouTube video conversion using yt-dlp."""
     try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'no_playlist': True,
-            'playlist_items': '1',
-            'no_download': True,
-            'format_sort': ['res', 'fps', 'codec', 'size', 'br', 'asr', 'ext'],
-            'merge_output_format': 'mp4',
-            'retries': 10,
-            'fragment_retries': 10,
-            'file_access_retries': 10,
-            'extractor_retries': 10,
-            'ignoreerrors': True,
-            'no_check_certificate': True,
-            'prefer_insecure': True,
-            'legacyserverconnect': True,
-            'source_address': '0.0.0.0',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                    'player_skip': ['webpage', 'config', 'js']
-                }
-            },
-            'socket_timeout': 30,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-        }
+        info = await get_cached_info(request.url, 'youtube')
+        if not info:
+            raise HTTPException(status_code=400, detail="Could not extract video information")
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(request.url, download=False)
-            if not info:
-                raise HTTPException(status_code=400, detail="Could not extract video information")
+        formats = []
+        if 'formats' in info:
+            # Create a dictionary to store unique resolutions
+            unique_formats = {}
+            
+            for f in info['formats']:
+                if f.get('vcodec') != 'none' and f.get('acodec') != 'none':
+                    height = f.get('height', 0)
+                    if height and height not in unique_formats:
+                        unique_formats[height] = f
 
-            formats = []
-            if 'formats' in info:
-                # Create a dictionary to store unique resolutions
-                unique_formats = {}
-                
-                for f in info['formats']:
-                    if f.get('vcodec') != 'none' and f.get('acodec') != 'none':
-                        height = f.get('height', 0)
-                        if height and height not in unique_formats:
-                            unique_formats[height] = f
-
-                # Convert dictionary to list and sort by height
-                for height, f in sorted(unique_formats.items(), reverse=True):
-                    formats.append(VideoFormat(
-                        resolution=f"{height}p",
-                        url=f.get('url', ''),
-                        size=f.get('filesize_str'),
-                        quality=f"{height}p",
-                        format_id=f"{height}p"  # Use resolution as format_id
-                    ))
+            # Convert dictionary to list and sort by height
+            for height, f in sorted(unique_formats.items(), reverse=True):
+                formats.append(VideoFormat(
+                    resolution=f"{height}p",
+                    url=f.get('url', ''),
+                    size=f.get('filesize_str'),
+                    quality=f"{height}p",
+                    format_id=f"{height}p"  # Use resolution as format_id
+                ))
 
-            return VideoResponse(
-                title=info.get('title', ''),
-                thumbnail=info.get('thumbnail', ''),
-                duration=str(info.get('duration', '')),
-                formats=formats,
-                platform="youtube"
-            )
+        return VideoResponse(
+            title=info.get('title', ''),
+            thumbnail=info.get('thumbnail', ''),
+            thumbnail_proxy=thumbnail_path(info.get('thumbnail')),
+            duration=str(info.get('duration', '')),
+            formats=formats,
+            platform="youtube"
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in convert_youtube_video: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=400, detail=str(e))
 
-async def download_youtube_video(request: VideoDownloadRequest):
+async def download_youtube_video(request: VideoDownloadRequest) -> DownloadedVideo:
     temp_dir = None
     try:
-        temp_dir = tempfile.mkdtemp()
+        # Download the video, reusing the metadata from /api/info when it is still fresh
+        info = await get_cached_info(request.url, 'youtube', need_urls=True)
+        if not info:
+            raise HTTPException(status_code=400, detail="Could not extract video information")
+        temp_dir = await allocate_temp_dir(request, info, request.quality)
         
         ydl_opts = {
             'format': f'bestvideo[height<={request.quality}]+bestaudio/best[height<={request.quality}]',
-            'merge_output_format': 'mp4',
             'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'quiet': True,
-            'no_warnings': True
+            'progress_hooks': progress_hooks(request)
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Download the video
-            info = ydl.extract_info(request.url, download=True)
+        info, filename = await download_media('youtube', request.url, 'youtube-download', ydl_opts, info)
+        if not info:
+            raise HTTPException(status_code=400, detail="Could not extract video information")
+        
+        # Get the downloaded file path
+        if not os.path.exists(filename):
+            raise HTTPException(status_code=400, detail="Downloaded file not found")
+        
+        # Check file size
+        file_size = os.path.getsize(filename)
+        if file_size == 0:
+            raise HTTPException(status_code=400, detail="Downloaded file is empty")
+        
+        # Create safe filename with proper encoding
+        safe_title = ''.join(c for c in info.get('title', '') if c.isalnum() or c in (' ', '-', '_')).strip()
+        safe_title = safe_title.replace(' ', '_')
+        output_filename = request.fileName or f"{safe_title}_{request.quality}p.mp4"
+        
+        # Final size check
+        if os.path.getsize(filename) == 0:
+            raise HTTPException(status_code=400, detail="Final video file is empty")
+        
+        # Return the video with properly encoded headers
+        return DownloadedVideo(
+            path=filename,
+            temp_dir=temp_dir,
+            headers={
+                "Content-Disposition": f'attachment; filename="{output_filename.encode("ascii", "ignore").decode("ascii")}"',
+                "Content-Type": "video/mp4"
+            }
+        )
+        
+    except HTTPException:
+        remove_temp_dir(temp_dir)
+        raise
+    except Exception as e:
+        remove_temp_dir(temp_dir)
+        logger.error(f"Error downloading video: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=400, detail=f"Failed to download video: {str(e)}")
+
+async def download_facebook_video(request: VideoDownloadRequest) -> DownloadedVideo:
+    """Download Facebook video using yt-dlp."""
+    temp_dir = None
+    try:
+        try:
+            # First get video info without downloading
+            info = await get_cached_info(request.url, 'facebook', need_urls=True)
             if not info:
                 raise HTTPException(status_code=400, detail="Could not extract video information")
+            temp_dir = await allocate_temp_dir(request, info)
             
-            # Get the downloaded file path
-            filename = ydl.prepare_filename(info)
-            if not os.path.exists(filename):
-                raise HTTPException(status_code=400, detail="Downloaded file not found")
-            
-            # Check file size
-            file_size = os.path.getsize(filename)
-            if file_size == 0:
-                raise HTTPException(status_code=400, detail="Downloaded file is empty")
+            # Store thumbnail and title
+            thumbnail_url = info.get('thumbnail', '')
+            original_title = info.get('title', '')
             
-            # Create safe filename with proper encoding
-            safe_title = ''.join(c for c in info.get('title', '') if c.isalnum() or c in (' ', '-', '_')).strip()
+            # Create safe filename from original title
+            safe_title = ''.join(c for c in original_title if c.isascii() and (c.isalnum() or c in (' ', '-', '_'))).strip()
             safe_title = safe_title.replace(' ', '_')
-            output_filename = request.fileName or f"{safe_title}_{request.quality}p.mp4"
+            if not safe_title:
+                safe_title = 'facebook_video'
             
-            # Read file into memory
-            with open(filename, 'rb') as f:
-                video_data = f.read()
-            
-            if len(video_data) == 0:
-                raise HTTPException(status_code=400, detail="Video data is empty")
-            
-            buffer = io.BytesIO(video_data)
+            # Configure download options
+            download_opts = {
+                'format': 'best',  # Always use best available format for Facebook
+                'outtmpl': {
+                    'default': os.path.join(temp_dir, f"{safe_title}.%(ext)s")
+                },
+                'progress_hooks': progress_hooks(request)
+            }
             
-            # Compress if requested
-            if request.compress:
-                try:
-                    compressed_buffer = compress_video(buffer, request.quality)
-                    if compressed_buffer.getbuffer().nbytes > 0:
-                        buffer = compressed_buffer
-                    else:
-                        logger.warning("Compression resulted in empty file, using original")
-                        buffer.seek(0)
-                except Exception as e:
-                    logger.error(f"Compression error: {str(e)}")
-                    buffer.seek(0)
+            # Download the video
+            info, filename = await download_media('facebook', request.url, 'download', download_opts, info)
             
-            # Final size check
-            final_size = buffer.getbuffer().nbytes
-            if final_size == 0:
-                raise HTTPException(status_code=400, detail="Final video buffer is empty")
+            if not filename or not os.path.exists(filename):
+                raise HTTPException(status_code=404, detail="Video file not found after download")
             
-            # Return the video with properly encoded headers
-            return StreamingResponse(
-                buffer,
-                media_type="video/mp4",
-                headers={
-                    "Content-Disposition": f'attachment; filename="{output_filename.encode("ascii", "ignore").decode("ascii")}"',
-                    "Content-Type": "video/mp4",
-                    "Content-Length": str(final_size)
-                }
-            )
+            # Use the safe title for the output filename
+            output_filename = f"{safe_title}.mp4"
             
-    except Exception as e:
-        logger.error(f"Error downloading video: {str(e)}")
-        logger.error(traceback.format_exc())
-        raise HTTPException(status_code=400, detail=f"Failed to download video: {str(e)}")
-    finally:
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                logger.error(f"Error cleaning up temp directory: {str(e)}")
-
-async def download_facebook_video(request: VideoDownloadRequest):
-    """Download Facebook video using yt-dlp."""
-    temp_dir = tempfile.mkdtemp()
-    try:
-        # First get video info without downloading
-        info_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            'socket_timeout': 30,
-            'retries': 10,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            # Return the video with headers
+            headers = {
+                'Content-Disposition': f'attachment; filename="{quote(output_filename)}"',
+                'Content-Type': 'video/mp4',
+                'X-Video-Title': quote(original_title),
+                'X-Video-Thumbnail': quote(thumbnail_path(thumbnail_url) or '')
             }
-        }
-        
-        with yt_dlp.YoutubeDL(info_opts) as ydl:
-            try:
-                # First get video info
-                info = ydl.extract_info(request.url, download=False)
-                if not info:
-                    raise HTTPException(status_code=400, detail="Could not extract video information")
-                
-                # Store thumbnail and title
-                thumbnail_url = info.get('thumbnail', '')
-                original_title = info.get('title', '')
-                
-                # Create safe filename from original title
-                safe_title = ''.join(c for c in original_title if c.isascii() and (c.isalnum() or c in (' ', '-', '_'))).strip()
-                safe_title = safe_title.replace(' ', '_')
-                if not safe_title:
-                    safe_title = 'facebook_video'
-                
-                # Configure download options
-                download_opts = {
-                    'quiet': True,
-                    'no_warnings': True,
-                    'format': 'best',  # Always use best available format for Facebook
-                    'outtmpl': {
-                        'default': os.path.join(temp_dir, f"{safe_title}.%(ext)s")
-                    },
-                    'socket_timeout': 30,
-                    'retries': 10,
-                    'http_headers': {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                    }
-                }
+            
+            return DownloadedVideo(path=filename, temp_dir=temp_dir, headers=headers)
                 
-                # Download the video
-                with yt_dlp.YoutubeDL(download_opts) as ydl_download:
-                    info = ydl_download.extract_info(request.url, download=True)
-                    filename = ydl_download.prepare_filename(info)
-                    
-                    if not os.path.exists(filename):
-                        raise HTTPException(status_code=404, detail="Video file not found after download")
-                    
-                    with open(filename, 'rb') as f:
-                        video_buffer = io.BytesIO(f.read())
-                    
-                    if request.compress:
-                        video_buffer = compress_video(video_buffer, request.quality)
-                    
-                    # Use the safe title for the output filename
-                    output_filename = f"{safe_title}.mp4"
-                    
-                    # Return the video with headers
-                    headers = {
-                        'Content-Disposition': f'attachment; filename="{quote(output_filename)}"',
-                        'Content-Type': 'video/mp4',
-                        'X-Video-Title': quote(original_title),
-                        'X-Video-Thumbnail': quote(thumbnail_url)
-                    }
-                    
-                    return StreamingResponse(
-                        video_buffer,
-                        media_type='video/mp4',
-                        headers=headers
-                    )
-                    
-            except Exception as e:
-                logger.error(f"Facebook download error: {str(e)}")
-                raise HTTPException(status_code=400, detail=f"Failed to download Facebook video: {str(e)}")
-    finally:
-        try:
-            shutil.rmtree(temp_dir)
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"Error cleaning up temporary directory: {str(e)}")
+            logger.error(f"Facebook download error: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Failed to download Facebook video: {str(e)}")
+    except BaseException:
+        # On success the temp dir is removed once the response has been sent
+        remove_temp_dir(temp_dir)
+        raise
 
 @app.get("/api/info")
-async def get_video_info(url: str):
+async def get_video_info(url: str, http_request: Request):
     """Get video information including title, thumbnail, and available formats."""
+    admission_controller.admit(http_request, ADMISSION_INFO_COST)
+    return await lookup_video_info(url)
+
+async def lookup_video_info(url: str):
+    """The /api/info response for a URL."""
+    # Identical concurrent requests share one lookup
+    return await request_coalescer.run('info', canonical_key(url), lambda: build_video_info(url))
+
+async def build_video_info(url: str):
+    """Build the /api/info response for a URL."""
     try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            'socket_timeout': 30,
-            'retries': 10,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
+        # Get platform-specific thumbnail
+        platform = get_platform(url)
+
+        info = await get_cached_info(url, platform)
+        if not info:
+            raise HTTPException(status_code=400, detail="Could not extract video information")
+        
+        thumbnail = info.get("thumbnail", "")
+        
+        # Missing sizes are probed in the background and show up on the next request
+        schedule_size_probes(info)
+        
+        response_data = {
+            "title": info.get("title", ""),
+            "duration": info.get("duration", ""),
+            "thumbnail": thumbnail,
+            "thumbnail_proxy": thumbnail_path(thumbnail),
+            "formats": format_ladder(info),
+            "platform": platform
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if not info:
-                raise HTTPException(status_code=400, detail="Could not extract video information")
-            
-            # Get platform-specific thumbnail
-            platform = get_platform(url)
-            thumbnail = info.get("thumbnail", "")
-            
-            # Define standard formats
-            standard_formats = [
-                {'format_id': '1080p', 'height': 1080, 'ext': 'mp4'},
-                {'format_id': '720p', 'height': 720, 'ext': 'mp4'},
-                {'format_id': '480p', 'height': 480, 'ext': 'mp4'},
-                {'format_id': '360p', 'height': 360, 'ext': 'mp4'},
-                {'format_id': '240p', 'height': 240, 'ext': 'mp4'},
-                {'format_id': '144p', 'height': 144, 'ext': 'mp4'}
-            ]
-            
-            response_data = {
-                "title": info.get("title", ""),
-                "duration": info.get("duration", ""),
-                "thumbnail": thumbnail,
-                "formats": standard_formats,
-                "platform": platform
-            }
-            
-            return response_data
+        return response_data
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=400, detail=str(e))
 
-async def update_video_info(url: str, info: dict):
-    """Update video info in memory cache."""
-    try:
-        # Generate a unique key based on the URL
-        video_id = url.split('v=')[-1] if 'v=' in url else url.split('/')[-1]
-        cache_key = f"video_info_{video_id}"
-        
-        # Store in memory cache
-        video_info_cache[cache_key] = {
-            "title": info.get("title", ""),
-            "thumbnail": info.get("thumbnail", ""),
-            "duration": info.get("duration", ""),
-            "formats": info.get("formats", []),
-            "platform": info.get("platform", "unknown")
-        }
-        return video_info_cache[cache_key]
-    except Exception as e:
-        logger.error(f"Error updating video info: {str(e)}")
-        return info
-
-async def download_instagram_video(request: VideoDownloadRequest):
+async def download_instagram_video(request: VideoDownloadRequest) -> DownloadedVideo:
     """Download Instagram video using yt-dlp."""
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = None
     try:
-        ydl_opts = {
-            'format': request.format,  # Use the format from the request
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            'progress_hooks': [progress_hook],
-            'verbose': True
-        }
-        
         logger.info(f"Starting Instagram video download for URL: {request.url}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(request.url, download=True)
-                if not info:
-                    raise HTTPException(status_code=400, detail="Could not extract video information")
-                
-                filename = ydl.prepare_filename(info)
-                if not os.path.exists(filename):
-                    raise HTTPException(status_code=404, detail="Video file not found after download")
-                
-                logger.info(f"Instagram video downloaded successfully: {filename}")
-                
-                with open(filename, 'rb') as f:
-                    video_buffer = io.BytesIO(f.read())
-                
-                if request.compress:
-                    logger.info("Compressing Instagram video...")
-                    video_buffer = compress_video(video_buffer, request.quality)
-                
-                return StreamingResponse(
-                    video_buffer,
-                    media_type='video/mp4',
-                    headers={
-                        'Content-Disposition': f'attachment; filename="{quote(info["title"])}.mp4"'
-                    }
-                )
-                
-            except yt_dlp.utils.DownloadError as e:
-                logger.error(f"Instagram download error: {str(e)}")
-                raise HTTPException(status_code=400, detail=f"Failed to download Instagram video: {str(e)}")
-            except Exception as e:
-                logger.error(f"Unexpected error during Instagram download: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
-    finally:
         try:
-            shutil.rmtree(temp_dir)
+            info = await get_cached_info(request.url, 'instagram', need_urls=True)
+            if not info:
+                raise HTTPException(status_code=400, detail="Could not extract video information")
+            temp_dir = await allocate_temp_dir(request, info)
+            ydl_opts = {
+                'format': request.format,  # Use the format from the request
+                'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+                'progress_hooks': progress_hooks(request)
+            }
+            info, filename = await download_media('instagram', request.url, 'download', ydl_opts, info)
+            if not info:
+                raise HTTPException(status_code=400, detail="Could not extract video information")
+            
+            if not filename or not os.path.exists(filename):
+                raise HTTPException(status_code=404, detail="Video file not found after download")
+            
+            logger.info(f"Instagram video downloaded successfully: {filename}")
+            
+            return DownloadedVideo(
+                path=filename,
+                temp_dir=temp_dir,
+                headers={
+                    'Content-Disposition': f'attachment; filename="{quote(info["title"])}.mp4"'
+                }
+            )
+            
+        except HTTPException:
+            raise
+        except yt_dlp.utils.DownloadError as e:
+            logger.error(f"Instagram download error: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Failed to download Instagram video: {str(e)}")
         except Exception as e:
-            logger.error(f"Error cleaning up temp directory: {str(e)}")
+            logger.error(f"Unexpected error during Instagram download: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    except BaseException:
+        # On success the temp dir is removed once the response has been sent
+        remove_temp_dir(temp_dir)
+        raise
 
-async def download_tiktok_video(request: VideoDownloadRequest):
+async def download_tiktok_video(request: VideoDownloadRequest) -> DownloadedVideo:
     """Download TikTok video using yt-dlp."""
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = None
     try:
-        ydl_opts = {
-            'format': f'bestvideo[height<={request.quality}]+bestaudio/best[height<={request.quality}]',
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            'progress_hooks': [progress_hook],
-            'verbose': True
-        }
-        
         logger.info(f"Starting TikTok video download for URL: {request.url}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(request.url, download=True)
-                if not info:
-                    raise HTTPException(status_code=400, detail="Could not extract video information")
-                
-                filename = ydl.prepare_filename(info)
-                if not os.path.exists(filename):
-                    raise HTTPException(status_code=404, detail="Video file not found after download")
-                
-                logger.info(f"TikTok video downloaded successfully: {filename}")
-                
-                with open(filename, 'rb') as f:
-                    video_buffer = io.BytesIO(f.read())
-                
-                if request.compress:
-                    logger.info("Compressing TikTok video...")
-                    video_buffer = compress_video(video_buffer, request.quality)
-                
-                return StreamingResponse(
-                    video_buffer,
-                    media_type='video/mp4',
-                    headers={
-                        'Content-Disposition': f'attachment; filename="{quote(info["title"])}.mp4"'
-                    }
-                )
-                
-            except yt_dlp.utils.DownloadError as e:
-                logger.error(f"TikTok download error: {str(e)}")
-                raise HTTPException(status_code=400, detail=f"Failed to download TikTok video: {str(e)}")
-            except Exception as e:
-                logger.error(f"Unexpected error during TikTok download: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
-    finally:
         try:
-            shutil.rmtree(temp_dir)
+            info = await get_cached_info(request.url, 'tiktok', need_urls=True)
+            if not info:
+                raise HTTPException(status_code=400, detail="Could not extract video information")
+            temp_dir = await allocate_temp_dir(request, info, request.quality)
+            ydl_opts = {
+                'format': f'bestvideo[height<={request.quality}]+bestaudio/best[height<={request.quality}]',
+                'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+                'progress_hooks': progress_hooks(request)
+            }
+            info, filename = await download_media('tiktok', request.url, 'download', ydl_opts, info)
+            if not info:
+                raise HTTPException(status_code=400, detail="Could not extract video information")
+            
+            if not filename or not os.path.exists(filename):
+                raise HTTPException(status_code=404, detail="Video file not found after download")
+            
+            logger.info(f"TikTok video downloaded successfully: {filename}")
+            
+            return DownloadedVideo(
+                path=filename,
+                temp_dir=temp_dir,
+                headers={
+                    'Content-Disposition': f'attachment; filename="{quote(info["title"])}.mp4"'
+                }
+            )
+            
+        except HTTPException:
+            raise
+        except yt_dlp.utils.DownloadError as e:
+            logger.error(f"TikTok download error: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Failed to download TikTok video: {str(e)}")
         except Exception as e:
-            logger.error(f"Error cleaning up temporary directory: {str(e)}")
+            logger.error(f"Unexpected error during TikTok download: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    except BaseException:
+        # On success the temp dir is removed once the response has been sent
+        remove_temp_dir(temp_dir)
+        raise
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,258 @@
+"""Prometheus metrics for the download pipeline.
+
+Metrics are kept in-process and rendered in the Prometheus text format at
+``/metrics``. With METRICS_ENABLED off every hook returns immediately and
+``stage_timer`` hands out a shared no-op context manager.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+# Seconds between event-loop lag samples
+METRICS_LAG_INTERVAL = float(os.getenv("METRICS_LAG_INTERVAL", 0.5))
+
+# Pipeline stage durations in seconds, from a fast cache lookup to a long transcode
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+class Gauge:
+    """Gauge that is either set directly or read from ``collect`` at scrape time.
+
+    With ``kind="counter"`` it exposes totals that another component
+    already keeps (cache hit counters), read at scrape time.
+    """
+
+    def __init__(self, name: str, help_text: str, collect: Optional[Callable[[], Dict[Labels, float]]] = None,
+                 kind: str = 'gauge'):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+        self.kind = kind
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def render(self) -> List[str]:
+        values = dict(self._values)
+        if self.collect:
+            try:
+                values.update(self.collect())
+            except Exception as e:
+                logger.error(f"Error collecting metric {self.name}: {str(e)}")
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "video_downloader_stage_seconds",
+    "Duration of download pipeline stages (detect, extract, fetch, merge, compress, stream)"
+))
+inflight_downloads = registry.register(Gauge("video_downloader_inflight_downloads", "Downloads currently being handled"))
+event_loop_lag = registry.register(Gauge("video_downloader_event_loop_lag_seconds", "Latest measured event loop lag"))
+bytes_served = registry.register(Counter("video_downloader_bytes_served_total", "Bytes of video sent to clients"))
+
+
+class _StageTimer:
+    """Observes the duration of a block; the outcome is "error" if it raises."""
+
+    __slots__ = ('stage', 'platform', 'outcome', 'started')
+
+    def __init__(self, stage: str, platform: str):
+        self.stage = stage
+        self.platform = platform
+        self.outcome = 'ok'
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = self.outcome if exc_type is None else 'error'
+        stage_seconds.observe(time.perf_counter() - self.started, stage=self.stage, platform=self.platform, outcome=outcome)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+    platform = outcome = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def stage_timer(stage: str, platform: str = 'unknown'):
+    """Time a pipeline stage. Set ``.platform`` or ``.outcome`` on the timer inside the block to relabel it."""
+    if not METRICS_ENABLED:
+        return _NOOP_TIMER
+    return _StageTimer(stage, platform)
+
+
+def observe_stage(stage: str, platform: str, outcome: str, seconds: float):
+    if METRICS_ENABLED:
+        stage_seconds.observe(seconds, stage=stage, platform=platform, outcome=outcome)
+
+
+def count_bytes_served(amount: int, platform: str = 'unknown'):
+    if METRICS_ENABLED:
+        bytes_served.inc(amount, platform=platform)
+
+
+@contextmanager
+def track_inflight() -> Iterator[None]:
+    if not METRICS_ENABLED:
+        yield
+        return
+    inflight_downloads.inc()
+    try:
+        yield
+    finally:
+        inflight_downloads.dec()
+
+
+def merge_hook(platform: str) -> Callable[[Dict], None]:
+    """yt-dlp postprocessor hook timing ffmpeg merges of separate video and audio."""
+    started = {}
+
+    def hook(d):
+        if d.get('postprocessor') != 'FFmpegMerger':
+            return
+        if d['status'] == 'started':
+            started['at'] = time.perf_counter()
+        elif d['status'] == 'finished' and 'at' in started:
+            observe_stage('merge', platform, 'ok', time.perf_counter() - started.pop('at'))
+
+    return hook
+
+
+async def monitor_event_loop_lag():
+    """Sample event loop lag until cancelled."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(METRICS_LAG_INTERVAL)
+        event_loop_lag.set(max(0.0, time.perf_counter() - start - METRICS_LAG_INTERVAL))
+
+
+def register_collector(name: str, help_text: str, collect: Callable[[], Dict[Labels, float]], kind: str = 'gauge'):
+    """Expose values read from another component (cache stats, queue depth) at scrape time."""
+    return registry.register(Gauge(name, help_text, collect, kind))
+
+
+def temp_disk_usage() -> Dict[Labels, float]:
+    usage = os.statvfs(tempfile.gettempdir())
+    return {(): (usage.f_blocks - usage.f_bfree) * usage.f_frsize}
+
+
+register_collector("video_downloader_temp_disk_used_bytes", "Used bytes on the filesystem holding temp downloads", temp_disk_usage)
+
+
+def render_metrics() -> str:
+    return registry.render()
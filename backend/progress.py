@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# "sqlite" shares progress between the uvicorn workers of a host, "memory" keeps it in this process
+PROGRESS_BACKEND = os.getenv("PROGRESS_BACKEND", "sqlite")
+PROGRESS_DB_PATH = os.getenv("PROGRESS_DB_PATH", os.path.join(tempfile.gettempdir(), "video_downloader_progress.sqlite3"))
+# Seconds finished/failed entries stay readable
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", 600))
+# Seconds before an entry that stopped updating is dropped (e.g. its worker died)
+PROGRESS_STALE_TTL = int(os.getenv("PROGRESS_STALE_TTL", 3600))
+# Minimum seconds between two "downloading" writes for the same download
+PROGRESS_MIN_INTERVAL = float(os.getenv("PROGRESS_MIN_INTERVAL", 0.25))
+
+FINAL_STATUSES = ('finished', 'error')
+PURGE_INTERVAL = 30
+
+
+def entry_ttl(data: Dict) -> int:
+    return PROGRESS_TTL if data.get('status') in FINAL_STATUSES else PROGRESS_STALE_TTL
+
+
+class ProgressStore:
+    """Base class for download progress backends.
+
+    Writes come from yt-dlp progress hooks on worker threads, so backends
+    must be thread-safe. ``set`` drops "downloading" updates that arrive
+    faster than PROGRESS_MIN_INTERVAL; final statuses are always written.
+    """
+
+    def __init__(self, min_interval: float = PROGRESS_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._last_write: Dict[str, float] = {}
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, download_id: str, data: Dict):
+        now = time.monotonic()
+        with self._lock:
+            final = data.get('status') in FINAL_STATUSES
+            if data.get('status') == 'downloading' and now - self._last_write.get(download_id, 0.0) < self.min_interval:
+                return
+            if final:
+                self._last_write.pop(download_id, None)
+            else:
+                self._last_write[download_id] = now
+            purge = now - self._last_purge > PURGE_INTERVAL
+            if purge:
+                self._last_purge = now
+        self._write(download_id, data, time.time() + entry_ttl(data))
+        if purge:
+            self.purge_expired()
+
+    def get(self, download_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def _write(self, download_id: str, data: Dict, expires_at: float):
+        raise NotImplementedError
+
+    def purge_expired(self):
+        raise NotImplementedError
+
+
+class MemoryProgressStore(ProgressStore):
+    """Progress kept in a dict; only visible to the worker that wrote it."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries: Dict[str, Dict] = {}
+
+    def _write(self, download_id: str, data: Dict, expires_at: float):
+        with self._lock:
+            self._entries[download_id] = {'data': data, 'expires_at': expires_at}
+
+    def get(self, download_id: str) -> Optional[Dict]:
+        entry = self._entries.get(download_id)
+        if entry is None or entry['expires_at'] < time.time():
+            return None
+        return entry['data']
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for download_id in [k for k, v in self._entries.items() if v['expires_at'] < now]:
+                del self._entries[download_id]
+
+
+class SqliteProgressStore(ProgressStore):
+    """Progress kept in a local SQLite file shared by all workers on the host."""
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS progress ("
+            "download_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, download_id: str, data: Dict, expires_at: float):
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO progress (download_id, data, expires_at) VALUES (?, ?, ?)",
+                (download_id, json.dumps(data), expires_at)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Error writing progress for {download_id}: {str(e)}")
+
+    def get(self, download_id: str) -> Optional[Dict]:
+        row = self._conn().execute(
+            "SELECT data FROM progress WHERE download_id = ? AND expires_at >= ?",
+            (download_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def purge_expired(self):
+        try:
+            self._conn().execute("DELETE FROM progress WHERE expires_at < ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.error(f"Error purging progress entries: {str(e)}")
+
+
+def create_progress_store() -> ProgressStore:
+    if PROGRESS_BACKEND == "sqlite":
+        return SqliteProgressStore(PROGRESS_DB_PATH)
+    if PROGRESS_BACKEND != "memory":
+        logger.warning(f"Unknown PROGRESS_BACKEND {PROGRESS_BACKEND}, using memory")
+    return MemoryProgressStore()
+
+
+progress_store = create_progress_store()
@@ -0,0 +1,165 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import aiohttp
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from http_client import get_http_session
+from metrics import METRICS_ENABLED, count_bytes_served, observe_stage
+from streaming import STREAM_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+RELAY_PROTOCOLS = ('http', 'https')
+# Upstream headers passed through to the client unchanged
+RELAY_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'Last-Modified', 'ETag')
+
+# Key for signed relay and thumbnail URLs; required, with the same value on every worker
+RELAY_SIGNING_KEY = os.getenv("RELAY_SIGNING_KEY", "")
+# Longest lifetime of a signed relay URL in seconds
+RELAY_TOKEN_TTL = int(os.getenv("RELAY_TOKEN_TTL", 300))
+
+# Query parameters carrying the expiry of signed CDN URLs
+EXPIRY_PARAMS = ('expire', 'expires', 'x-expires', 'Expires')
+
+
+def progressive_format(info: Optional[Dict]) -> Optional[Dict]:
+    """Return the selected format if it is a single progressive HTTP stream.
+
+    Merged selections (separate video and audio) and segmented protocols
+    such as HLS or DASH return None, since their bytes cannot be relayed
+    as they arrive.
+    """
+    if not info or info.get('requested_formats'):
+        return None
+    if not info.get('url') or info.get('protocol', 'https') not in RELAY_PROTOCOLS:
+        return None
+    return {
+        'url': info['url'],
+        'http_headers': info.get('http_headers') or {},
+        'ext': info.get('ext') or 'mp4',
+        'filesize': info.get('filesize'),
+    }
+
+
+def url_expiry(url: str) -> Optional[int]:
+    """Unix time at which a signed media URL stops working, if it says so."""
+    params = parse_qs(urlsplit(url).query)
+    for name in EXPIRY_PARAMS:
+        value = params.get(name, [''])[0]
+        if value.isdigit():
+            return int(value)
+    # Facebook and Instagram CDNs use a hex timestamp in "oe"
+    value = params.get('oe', [''])[0]
+    try:
+        return int(value, 16) if value else None
+    except ValueError:
+        return None
+
+
+def needs_relay(fmt: Dict) -> bool:
+    """Whether a media URL only works when fetched from this server.
+
+    YouTube binds its URLs to the requesting IP address ("ip" parameter),
+    so clients get a signed relay URL instead of the upstream one.
+    """
+    return 'ip' in parse_qs(urlsplit(fmt['url']).query)
+
+
+def check_signing_key():
+    """Refuse to start without RELAY_SIGNING_KEY.
+
+    A key generated per process would make signed URLs fail with 403 on
+    every other worker and after every restart.
+    """
+    if not RELAY_SIGNING_KEY:
+        raise RuntimeError("RELAY_SIGNING_KEY is not set; set it to a long random secret shared by all workers")
+
+
+def _sign(payload: bytes) -> str:
+    digest = hmac.new(RELAY_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def sign_relay_token(fmt: Dict, filename: str, expires: Optional[int] = None) -> str:
+    """Token for /api/relay that lets a client fetch ``fmt`` through us until it expires."""
+    expires = min(expires or time.time() + RELAY_TOKEN_TTL, time.time() + RELAY_TOKEN_TTL)
+    payload = json.dumps({
+        'url': fmt['url'],
+        'http_headers': fmt.get('http_headers') or {},
+        'ext': fmt.get('ext'),
+        'filename': filename,
+        'expires': int(expires),
+    }, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=') + '.' + _sign(payload)
+
+
+def verify_relay_token(token: str) -> Dict:
+    """Decode a relay token, raising 403 for a bad signature and 410 once expired."""
+    try:
+        encoded, signature = token.split('.', 1)
+        payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid relay token")
+    if not hmac.compare_digest(_sign(payload), signature):
+        raise HTTPException(status_code=403, detail="Invalid relay token")
+    data = json.loads(payload)
+    if data['expires'] < time.time():
+        raise HTTPException(status_code=410, detail="Relay link has expired")
+    return data
+
+
+async def relay_response(fmt: Dict, headers: Optional[Dict[str, str]] = None, range_header: Optional[str] = None,
+                         platform: str = 'unknown') -> StreamingResponse:
+    """Relay a progressive format to the client while it is being fetched."""
+    request_headers = dict(fmt.get('http_headers') or {})
+    if range_header:
+        request_headers['Range'] = range_header
+
+    session = get_http_session()
+    try:
+        upstream = await session.get(fmt['url'], headers=request_headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Relay connection failed: {str(e)}")
+        raise HTTPException(status_code=502, detail="Failed to connect to video host")
+
+    if upstream.status not in (200, 206):
+        upstream.release()
+        logger.error(f"Relay upstream returned {upstream.status}")
+        raise HTTPException(status_code=502, detail=f"Video host returned {upstream.status}")
+
+    async def body():
+        started = time.perf_counter()
+        sent = 0
+        outcome = 'error'
+        try:
+            async for chunk in upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+                sent += len(chunk)
+                yield chunk
+            outcome = 'ok'
+        finally:
+            upstream.release()
+            if METRICS_ENABLED:
+                observe_stage('stream', platform, outcome, time.perf_counter() - started)
+                count_bytes_served(sent, platform)
+
+    response_headers = dict(headers or {})
+    for name in RELAY_RESPONSE_HEADERS:
+        if name in upstream.headers:
+            response_headers[name] = upstream.headers[name]
+
+    return StreamingResponse(
+        body(),
+        status_code=upstream.status,
+        media_type=upstream.headers.get('Content-Type', 'video/mp4'),
+        headers=response_headers,
+    )
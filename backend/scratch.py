@@ -0,0 +1,271 @@
+"""Scratch space for downloads and transcodes.
+
+Every download gets its own directory under a per-process owner
+directory ``<root>/<pid>-<token>``. The owner keeps an flock on
+``<owner>/.lock`` for as long as it runs, which the kernel drops when
+the process dies (even on SIGKILL). The janitor therefore removes the
+directories of dead workers even when their PID has been reused, as well
+as any scratch directory older than SCRATCH_STALE_AGE.
+
+Each directory reserves its expected size against the byte quota of its
+root. When a root is full, new downloads wait for space and get a 503 if
+none frees up within SCRATCH_WAIT_TIMEOUT. Small videos can be placed on
+a tmpfs (SCRATCH_FAST_DIR) and larger ones on disk.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Disk-backed scratch root and its byte quota
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "video_downloader_scratch"))
+SCRATCH_QUOTA_BYTES = int(os.getenv("SCRATCH_QUOTA_BYTES", 5 * 1024 ** 3))
+# Optional RAM-backed root (e.g. /dev/shm/video_downloader_scratch) for videos up to SCRATCH_FAST_MAX_FILESIZE
+SCRATCH_FAST_DIR = os.getenv("SCRATCH_FAST_DIR", "")
+SCRATCH_FAST_QUOTA_BYTES = int(os.getenv("SCRATCH_FAST_QUOTA_BYTES", 512 * 1024 ** 2))
+SCRATCH_FAST_MAX_FILESIZE = int(os.getenv("SCRATCH_FAST_MAX_FILESIZE", 64 * 1024 ** 2))
+# Reserved for downloads whose size is not known up front
+SCRATCH_DEFAULT_RESERVATION = int(os.getenv("SCRATCH_DEFAULT_RESERVATION", 512 * 1024 ** 2))
+# Free space left on the filesystem for everything else
+SCRATCH_MIN_FREE_BYTES = int(os.getenv("SCRATCH_MIN_FREE_BYTES", 256 * 1024 ** 2))
+# Seconds a download waits for scratch space before it is rejected
+SCRATCH_WAIT_TIMEOUT = float(os.getenv("SCRATCH_WAIT_TIMEOUT", 30))
+# Scratch directories older than this are removed by the janitor
+SCRATCH_STALE_AGE = int(os.getenv("SCRATCH_STALE_AGE", 6 * 3600))
+SCRATCH_JANITOR_INTERVAL = int(os.getenv("SCRATCH_JANITOR_INTERVAL", 600))
+
+SCRATCH_POLL_INTERVAL = 0.5
+LOCK_NAME = '.lock'
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by another user
+        return True
+    return True
+
+
+def _owner_alive(owner_dir: str) -> bool:
+    """Whether the process that created an owner directory is still running."""
+    try:
+        pid = int(os.path.basename(owner_dir).split('-', 1)[0])
+    except ValueError:
+        return True
+    if not _pid_alive(pid):
+        return False
+    # The PID may have been reused; the lock is only held by the real owner
+    try:
+        with open(os.path.join(owner_dir, LOCK_NAME), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+    except OSError:
+        return True
+
+
+class ScratchRoot:
+    """One scratch filesystem location with its own quota."""
+
+    def __init__(self, name: str, path: str, quota: int):
+        self.name = name
+        self.path = path
+        self.quota = quota
+        self.reserved = 0
+        self.jobs = 0
+        self._owner_dir: Optional[str] = None
+        self._owner_pid: Optional[int] = None
+        self._lock_file = None
+
+    def owner_dir(self) -> str:
+        """This process's directory under the root, created (and locked) on first use."""
+        if self._owner_pid != os.getpid():
+            # Also covers a fork after import, which must not share the parent's directory
+            owner_dir = os.path.join(self.path, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+            os.makedirs(owner_dir, exist_ok=True)
+            lock_file = open(os.path.join(owner_dir, LOCK_NAME), 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._owner_dir, self._owner_pid, self._lock_file = owner_dir, os.getpid(), lock_file
+        return self._owner_dir
+
+    def free_bytes(self) -> int:
+        os.makedirs(self.path, exist_ok=True)
+        usage = os.statvfs(self.path)
+        return usage.f_bavail * usage.f_frsize
+
+    def fits(self, size: int) -> bool:
+        # A single job larger than the quota still runs once the root is idle
+        if self.reserved and self.reserved + size > self.quota:
+            return False
+        return self.free_bytes() - size >= SCRATCH_MIN_FREE_BYTES
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "quota_bytes": self.quota,
+            "reserved_bytes": self.reserved,
+            "jobs": self.jobs,
+            "free_bytes": self.free_bytes(),
+        }
+
+
+class ScratchSpace:
+    """Hands out per-job scratch directories under a byte quota."""
+
+    def __init__(self, roots: List[ScratchRoot], fast_max_filesize: int):
+        self.roots = roots
+        self.fast_max_filesize = fast_max_filesize
+        self._reservations: Dict[str, Tuple[ScratchRoot, int]] = {}
+        # release() is called from the threadpool when background tasks clean up
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.rejected = 0
+        self.swept = 0
+        self._janitor: Optional[asyncio.Task] = None
+
+    def _root_for(self, size: Optional[int]) -> ScratchRoot:
+        fast = [root for root in self.roots if root.name == 'fast']
+        if fast and size is not None and size <= self.fast_max_filesize and fast[0].fits(size):
+            return fast[0]
+        return next(root for root in self.roots if root.name == 'disk')
+
+    def _try_reserve(self, root: ScratchRoot, size: int) -> bool:
+        with self._lock:
+            if not root.fits(size):
+                return False
+            root.reserved += size
+            root.jobs += 1
+            return True
+
+    async def allocate(self, expected_size: Optional[int] = None) -> str:
+        """Create a scratch directory for a job expected to write ``expected_size`` bytes.
+
+        Waits while the chosen root is over its quota and raises a 503 once
+        SCRATCH_WAIT_TIMEOUT has passed.
+        """
+        size = expected_size or SCRATCH_DEFAULT_RESERVATION
+        root = self._root_for(expected_size)
+        deadline = time.monotonic() + SCRATCH_WAIT_TIMEOUT
+        if not self._try_reserve(root, size):
+            self.waits += 1
+            logger.info(f"Scratch space {root.name} is full, waiting to reserve {size} bytes")
+            # Space is also freed by other workers, so poll rather than wait for our own releases
+            while not self._try_reserve(root, size):
+                if time.monotonic() >= deadline:
+                    self.rejected += 1
+                    raise HTTPException(status_code=503, detail="Server is out of scratch space, please try again shortly")
+                await asyncio.sleep(SCRATCH_POLL_INTERVAL)
+        try:
+            path = tempfile.mkdtemp(dir=root.owner_dir())
+        except BaseException:
+            self._unreserve(root, size)
+            raise
+        with self._lock:
+            self._reservations[path] = (root, size)
+        return path
+
+    def _unreserve(self, root: ScratchRoot, size: int):
+        with self._lock:
+            root.reserved -= size
+            root.jobs -= 1
+
+    def release(self, path: Optional[str]):
+        """Return the reservation of a scratch directory that has been removed."""
+        with self._lock:
+            reservation = self._reservations.pop(path, None)
+        if reservation:
+            self._unreserve(*reservation)
+
+    def _remove(self, path: str):
+        shutil.rmtree(path, ignore_errors=True)
+        self.swept += 1
+        self.release(path)
+
+    def sweep(self) -> int:
+        """Remove scratch directories of dead workers and stale ones. Blocking."""
+        removed = self.swept
+        cutoff = time.time() - SCRATCH_STALE_AGE
+        with self._lock:
+            reserved = set(self._reservations)
+        # Directories removed by another worker (e.g. an expired job) no longer hold space here
+        for path in reserved:
+            if not os.path.exists(path):
+                self.release(path)
+        for root in self.roots:
+            try:
+                owners = [os.path.join(root.path, name) for name in os.listdir(root.path)]
+            except FileNotFoundError:
+                continue
+            own = root._owner_dir if root._owner_pid == os.getpid() else None
+            for owner_dir in owners:
+                if not os.path.isdir(owner_dir):
+                    continue
+                if owner_dir != own and not _owner_alive(owner_dir):
+                    logger.info(f"Removing scratch space of dead worker: {owner_dir}")
+                    self._remove(owner_dir)
+                    continue
+                for name in os.listdir(owner_dir):
+                    path = os.path.join(owner_dir, name)
+                    if name == LOCK_NAME or path in reserved:
+                        continue
+                    try:
+                        if os.stat(path).st_mtime < cutoff:
+                            logger.info(f"Removing stale scratch directory: {path}")
+                            self._remove(path)
+                    except OSError:
+                        continue
+        return self.swept - removed
+
+    async def _janitor_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.sweep)
+            except Exception as e:
+                logger.error(f"Scratch janitor error: {str(e)}")
+            await asyncio.sleep(SCRATCH_JANITOR_INTERVAL)
+
+    def start_janitor(self):
+        """Sweep now and then every SCRATCH_JANITOR_INTERVAL seconds."""
+        for root in self.roots:
+            root.owner_dir()
+        self._janitor = asyncio.create_task(self._janitor_loop())
+
+    async def stop_janitor(self):
+        if self._janitor:
+            self._janitor.cancel()
+            await asyncio.gather(self._janitor, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "roots": {root.name: root.stats() for root in self.roots},
+            "waits": self.waits,
+            "rejected": self.rejected,
+            "swept": self.swept,
+        }
+
+
+def build_roots() -> List[ScratchRoot]:
+    roots = [ScratchRoot('disk', SCRATCH_DIR, SCRATCH_QUOTA_BYTES)]
+    if SCRATCH_FAST_DIR:
+        roots.append(ScratchRoot('fast', SCRATCH_FAST_DIR, SCRATCH_FAST_QUOTA_BYTES))
+    return roots
+
+
+scratch_space = ScratchSpace(build_roots(), SCRATCH_FAST_MAX_FILESIZE)
@@ -0,0 +1,204 @@
+"""Multi-connection download of a single media URL.
+
+CDNs that throttle each connection are fetched as several byte ranges at
+once over the shared HTTP client. Each range is written into a
+pre-allocated file at its offset, and the total length is checked at the end.
+Servers that ignore ``Range`` are downloaded over one connection instead.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from http_client import get_http_session
+
+logger = logging.getLogger(__name__)
+
+# Use segmented downloads for progressive formats
+SEGMENTED_DOWNLOADS = os.getenv("SEGMENTED_DOWNLOADS", "true").lower() == "true"
+# Connections per download and across all downloads in this worker
+SEGMENT_CONNECTIONS = int(os.getenv("SEGMENT_CONNECTIONS", 4))
+SEGMENT_GLOBAL_CONNECTIONS = int(os.getenv("SEGMENT_GLOBAL_CONNECTIONS", 16))
+# Files smaller than this are not worth splitting
+SEGMENT_MIN_SIZE = int(os.getenv("SEGMENT_MIN_SIZE", 8 * 1024 * 1024))
+SEGMENT_RETRIES = int(os.getenv("SEGMENT_RETRIES", 3))
+SEGMENT_READ_SIZE = 256 * 1024
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+_connections: Optional[asyncio.Semaphore] = None
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def connection_budget() -> asyncio.Semaphore:
+    """Semaphore bounding segment connections across all downloads."""
+    global _connections
+    if _connections is None:
+        _connections = asyncio.Semaphore(SEGMENT_GLOBAL_CONNECTIONS)
+    return _connections
+
+
+def split_ranges(size: int, parts: int) -> List[Tuple[int, int]]:
+    """Split ``size`` bytes into ``parts`` inclusive (start, end) ranges."""
+    parts = max(1, min(parts, size))
+    step = -(-size // parts)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+class _Progress:
+    """Reports combined progress of all segments in yt-dlp's hook format."""
+
+    def __init__(self, total: int, hooks: List[Callable[[Dict], None]]):
+        self.total = total
+        self.hooks = hooks
+        self.downloaded = 0
+        self.started = time.monotonic()
+
+    def add(self, count: int):
+        self.downloaded += count
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        speed = self.downloaded / elapsed
+        remaining = (self.total - self.downloaded) / speed if speed else 0
+        self._emit({
+            'status': 'downloading',
+            'downloaded_bytes': self.downloaded,
+            'total_bytes': self.total,
+            '_percent_str': f"{self.downloaded * 100 / self.total:.1f}%" if self.total else '0%',
+            '_speed_str': f"{speed / 1024 / 1024:.2f}MiB/s",
+            '_eta_str': f"{int(remaining)}s",
+        })
+
+    def finish(self):
+        self._emit({'status': 'finished', 'downloaded_bytes': self.downloaded, 'total_bytes': self.total})
+
+    def _emit(self, data: Dict):
+        for hook in self.hooks:
+            try:
+                hook(data)
+            except Exception as e:
+                logger.error(f"Progress hook error: {str(e)}")
+
+
+async def _write(fd: int, data: bytes, offset: int):
+    await asyncio.get_running_loop().run_in_executor(None, os.pwrite, fd, data, offset)
+
+
+async def probe_length(url: str, headers: Dict[str, str]) -> Optional[int]:
+    """Total length of a resource if the server honors byte ranges, else None."""
+    async with connection_budget():
+        async with get_http_session().get(url, headers={**headers, 'Range': 'bytes=0-0'}) as response:
+            if response.status != 206:
+                return None
+            match = CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+            if not match or match.group(3) == '*':
+                return None
+            return int(match.group(3))
+
+
+async def _fetch_range(url: str, headers: Dict[str, str], fd: int, start: int, end: int, progress: _Progress):
+    """Fetch one byte range into the file, resuming after dropped connections."""
+    position = start
+    for attempt in range(SEGMENT_RETRIES + 1):
+        try:
+            async with connection_budget():
+                request_headers = {**headers, 'Range': f'bytes={position}-{end}'}
+                async with get_http_session().get(url, headers=request_headers) as response:
+                    if response.status != 206:
+                        raise RangeNotSupported(f"Range request answered with {response.status}")
+                    match = CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                    if not match or int(match.group(1)) != position:
+                        raise RangeNotSupported("Server returned a different range")
+                    async for chunk in response.content.iter_chunked(SEGMENT_READ_SIZE):
+                        chunk = chunk[:end + 1 - position]
+                        await _write(fd, chunk, position)
+                        position += len(chunk)
+                        progress.add(len(chunk))
+                        if position > end:
+                            return
+            if position > end:
+                return
+            raise aiohttp.ClientPayloadError(f"Segment ended early at byte {position}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == SEGMENT_RETRIES:
+                raise
+            logger.warning(f"Segment {start}-{end} interrupted at byte {position}, retrying: {str(e)}")
+
+
+async def _fetch_single(url: str, headers: Dict[str, str], path: str, progress: _Progress) -> int:
+    """Plain single-connection download, for servers without range support."""
+    written = 0
+    async with connection_budget():
+        async with get_http_session().get(url, headers=headers) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+            progress.total = response.content_length or progress.total
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                async for chunk in response.content.iter_chunked(SEGMENT_READ_SIZE):
+                    await _write(fd, chunk, written)
+                    written += len(chunk)
+                    progress.add(len(chunk))
+            finally:
+                os.close(fd)
+    if progress.total and written != progress.total:
+        raise IOError(f"Expected {progress.total} bytes, got {written}")
+    return written
+
+
+async def fetch_to_file(url: str, path: str, headers: Optional[Dict[str, str]] = None, size: Optional[int] = None,
+                        connections: int = SEGMENT_CONNECTIONS,
+                        progress_hooks: Optional[List[Callable[[Dict], None]]] = None) -> int:
+    """Download ``url`` into ``path`` over up to ``connections`` ranges and return its size."""
+    headers = dict(headers or {})
+    progress = _Progress(size or 0, progress_hooks or [])
+    length = await probe_length(url, headers)
+    if length is None or length < SEGMENT_MIN_SIZE or connections <= 1:
+        if length is None:
+            logger.info("Server does not honor Range, downloading over one connection")
+        written = await _fetch_single(url, headers, path, progress)
+        progress.finish()
+        return written
+
+    progress.total = length
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # Reserve the whole file up front so segments can be written in place
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, length)
+        else:
+            os.ftruncate(fd, length)
+        tasks = [
+            asyncio.ensure_future(_fetch_range(url, headers, fd, start, end, progress))
+            for start, end in split_ranges(length, connections)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    finally:
+        os.close(fd)
+
+    if progress.downloaded != length or os.path.getsize(path) != length:
+        raise IOError(f"Expected {length} bytes, got {progress.downloaded}")
+    progress.finish()
+    return length
+
+
+async def download_with_fallback(url: str, path: str, headers: Optional[Dict[str, str]] = None, size: Optional[int] = None,
+                                 progress_hooks: Optional[List[Callable[[Dict], None]]] = None) -> int:
+    """``fetch_to_file`` that retries over one connection if the segmented fetch fails."""
+    try:
+        return await fetch_to_file(url, path, headers, size, progress_hooks=progress_hooks)
+    except RangeNotSupported as e:
+        logger.info(f"Segmented download not possible, using one connection: {str(e)}")
+        return await fetch_to_file(url, path, headers, size, connections=1, progress_hooks=progress_hooks)
@@ -0,0 +1,148 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from metrics import METRICS_ENABLED, count_bytes_served, observe_stage
+from scratch import scratch_space
+
+logger = logging.getLogger(__name__)
+
+# Size of each read when streaming a file from disk
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 1024 * 1024))
+
+# Temp dirs served to several coalesced requests, by remaining users
+_temp_dir_refs: Dict[str, int] = {}
+_temp_dir_lock = threading.Lock()
+
+
+def retain_temp_dir(temp_dir: Optional[str]):
+    """Register one more user of a temp dir; each user calls remove_temp_dir once."""
+    if temp_dir:
+        with _temp_dir_lock:
+            _temp_dir_refs[temp_dir] = _temp_dir_refs.get(temp_dir, 0) + 1
+
+
+def remove_temp_dir(temp_dir: Optional[str]):
+    """Remove a download's temp directory, logging instead of raising.
+
+    A retained directory is only removed once its last user releases it.
+    """
+    with _temp_dir_lock:
+        if temp_dir in _temp_dir_refs:
+            _temp_dir_refs[temp_dir] -= 1
+            if _temp_dir_refs[temp_dir] > 0:
+                return
+            del _temp_dir_refs[temp_dir]
+    if temp_dir and os.path.exists(temp_dir):
+        try:
+            shutil.rmtree(temp_dir)
+        except Exception as e:
+            logger.error(f"Error cleaning up temp directory: {str(e)}")
+    # Scratch directories hand their reserved space back
+    scratch_space.release(temp_dir)
+
+
+def _after_send(temp_dir: Optional[str], platform: str, started: float, sent: int):
+    """Background task run once a file response has been sent."""
+    if METRICS_ENABLED:
+        observe_stage('stream', platform, 'ok', time.perf_counter() - started)
+        count_bytes_served(sent, platform)
+    remove_temp_dir(temp_dir)
+
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single "bytes=start-end" range into inclusive offsets.
+
+    Returns None when the header is absent or not something we serve as a
+    partial response (multiple ranges, other units). Raises ValueError when
+    the range cannot be satisfied for this file.
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start_str, _, end_str = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(end_str)
+            if suffix == 0:
+                raise ValueError("Empty suffix range")
+            start = max(0, file_size - suffix)
+            end = file_size - 1
+    except ValueError:
+        raise ValueError(f"Invalid range: {range_header}")
+    end = min(end, file_size - 1)
+    if start > end or start >= file_size:
+        raise ValueError(f"Unsatisfiable range: {range_header}")
+    return start, end
+
+
+async def iter_file_range(path: str, start: int, end: int, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield bytes start..end (inclusive) of a file without loading it into memory."""
+    with open(path, 'rb') as f:
+        await run_in_threadpool(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await run_in_threadpool(f.read, min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(
+    request: Optional[Request],
+    path: str,
+    media_type: str = 'video/mp4',
+    headers: Optional[Dict[str, str]] = None,
+    temp_dir: Optional[str] = None,
+    platform: str = 'unknown',
+) -> Response:
+    """Stream a file from disk, honouring Range requests.
+
+    ``temp_dir`` is removed by a background task once the last byte has
+    been sent, not when the handler returns. The same task records the
+    stream duration and bytes served under ``platform``.
+    """
+    headers = dict(headers or {})
+    headers.pop('Content-Length', None)
+    headers['Accept-Ranges'] = 'bytes'
+    stat_result = os.stat(path)
+    file_size = stat_result.st_size
+    started = time.perf_counter()
+
+    def background_for(sent: int) -> Optional[BackgroundTask]:
+        if not temp_dir and not METRICS_ENABLED:
+            return None
+        return BackgroundTask(_after_send, temp_dir, platform, started, sent)
+
+    try:
+        byte_range = parse_range_header(request.headers.get('range') if request else None, file_size)
+    except ValueError:
+        headers['Content-Range'] = f'bytes */{file_size}'
+        return Response(status_code=416, headers=headers, background=background_for(0))
+
+    if byte_range is None:
+        # FileResponse sets Content-Length and uses zero-copy sendfile where the server supports it
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result, background=background_for(file_size))
+
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file_range(path, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+        background=background_for(end - start + 1),
+    )
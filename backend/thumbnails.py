@@ -0,0 +1,287 @@
+"""Thumbnail proxy with resizing and a two-tier cache.
+
+Upstream thumbnail URLs are handed to clients as signed ``/api/thumbnail``
+paths, so the proxy only fetches images this server pointed at. Images
+are fetched over the shared HTTP client, scaled down to the nearest of
+THUMBNAIL_WIDTHS and re-encoded as WebP. Results are kept in a
+byte-bounded LRU in memory and in a byte-bounded LRU directory on disk,
+and served with an ETag so browsers revalidate instead of re-downloading.
+
+Pillow is optional; without it images are proxied and cached unresized.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import tempfile
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from coalesce import request_coalescer
+from http_client import get_http_session
+from relay import RELAY_SIGNING_KEY
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Widths thumbnails are rendered at; requests are rounded up to the next one
+THUMBNAIL_WIDTHS = tuple(sorted(int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "160,320,640,1280").split(',') if w.strip()))
+THUMBNAIL_DEFAULT_WIDTH = int(os.getenv("THUMBNAIL_DEFAULT_WIDTH", 640))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+THUMBNAIL_MEMORY_MAX_BYTES = int(os.getenv("THUMBNAIL_MEMORY_MAX_BYTES", 32 * 1024 ** 2))
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "video_downloader_thumbnails"))
+THUMBNAIL_DISK_MAX_BYTES = int(os.getenv("THUMBNAIL_DISK_MAX_BYTES", 512 * 1024 ** 2))
+# Upstream images larger than this are rejected
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.getenv("THUMBNAIL_MAX_SOURCE_BYTES", 10 * 1024 ** 2))
+# Cache-Control max-age sent to clients
+THUMBNAIL_MAX_AGE = int(os.getenv("THUMBNAIL_MAX_AGE", 86400))
+
+# Some CDNs refuse requests without a browser user agent
+THUMBNAIL_REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept': 'image/webp,image/*;q=0.8',
+}
+
+
+def _sign(url: str) -> str:
+    digest = hmac.new(RELAY_SIGNING_KEY.encode(), b'thumbnail:' + url.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def thumbnail_path(url: Optional[str]) -> Optional[str]:
+    """Signed /api/thumbnail path for an upstream thumbnail URL; append ``&w=<width>`` to pick a size."""
+    if not url:
+        return None
+    return f"/api/thumbnail?url={quote(url, safe='')}&sig={_sign(url)}"
+
+
+def verify_thumbnail(url: str, sig: str):
+    if not hmac.compare_digest(_sign(url), sig):
+        raise HTTPException(status_code=403, detail="Invalid thumbnail signature")
+
+
+def pick_width(width: Optional[int]) -> int:
+    """The configured width a requested width is served at."""
+    width = width or THUMBNAIL_DEFAULT_WIDTH
+    return next((w for w in THUMBNAIL_WIDTHS if w >= width), THUMBNAIL_WIDTHS[-1])
+
+
+def render_thumbnail(data: bytes, width: int, content_type: str) -> Tuple[bytes, str]:
+    """Scale an image down to ``width`` and encode it as WebP. Blocking."""
+    if Image is None:
+        return data, content_type
+    with Image.open(io.BytesIO(data)) as image:
+        # Lets the JPEG decoder skip detail that is thrown away anyway
+        image.draft('RGB', (width, width * 4))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        # Never upscales, keeps the aspect ratio
+        image.thumbnail((width, width * 4), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+    return output.getvalue(), 'image/webp'
+
+
+async def fetch_image(url: str) -> Tuple[bytes, str]:
+    """Download an upstream image, raising 502 if it fails or is not an image."""
+    try:
+        async with get_http_session().get(url, headers=THUMBNAIL_REQUEST_HEADERS) as upstream:
+            if upstream.status != 200:
+                raise HTTPException(status_code=502, detail=f"Thumbnail host returned {upstream.status}")
+            content_type = upstream.headers.get('Content-Type', '').split(';')[0].strip()
+            if not content_type.startswith('image/'):
+                raise HTTPException(status_code=502, detail="Thumbnail host did not return an image")
+            if (upstream.content_length or 0) > THUMBNAIL_MAX_SOURCE_BYTES:
+                raise HTTPException(status_code=502, detail="Thumbnail is too large")
+            data = bytearray()
+            async for chunk in upstream.content.iter_chunked(64 * 1024):
+                data += chunk
+                if len(data) > THUMBNAIL_MAX_SOURCE_BYTES:
+                    raise HTTPException(status_code=502, detail="Thumbnail is too large")
+            return bytes(data), content_type
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Thumbnail fetch failed: {str(e)}")
+        raise HTTPException(status_code=502, detail="Failed to connect to thumbnail host")
+
+
+def thumbnail_key(url: str, width: int) -> str:
+    raw = json.dumps([url, width, 'webp' if Image is not None else 'original'])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class Thumbnail:
+    __slots__ = ('body', 'content_type', 'etag')
+
+    def __init__(self, body: bytes, content_type: str, etag: str):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+
+
+class ThumbnailCache:
+    """Rendered thumbnails in a memory LRU backed by a disk LRU.
+
+    The disk tier works like the artifact cache: files are renamed into
+    place and recency is the file mtime, so workers can share a directory.
+    Disk hits are promoted to memory. Concurrent misses for the same image
+    and width share one fetch and render.
+    """
+
+    def __init__(self, root: str, memory_max_bytes: int, disk_max_bytes: int):
+        self.root = root
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, Thumbnail]" = OrderedDict()
+        self._memory_bytes = 0
+        # Disk usage is counted once and then tracked, so writes only walk the directory when evicting
+        self._disk_bytes: Optional[int] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        directory = os.path.join(self.root, key[:2])
+        return os.path.join(directory, f"{key}.bin"), os.path.join(directory, f"{key}.json")
+
+    def _remember(self, key: str, thumbnail: Thumbnail):
+        if len(thumbnail.body) > self.memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous:
+            self._memory_bytes -= len(previous.body)
+        self._memory[key] = thumbnail
+        self._memory_bytes += len(thumbnail.body)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.body)
+
+    def read(self, key: str) -> Optional[Thumbnail]:
+        """Read a thumbnail from the disk tier. Blocking."""
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(data_path, 'rb') as f:
+                body = f.read()
+            # Bump recency for LRU eviction
+            os.utime(data_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return Thumbnail(body, meta['content_type'], meta['etag'])
+
+    def write(self, key: str, thumbnail: Thumbnail):
+        """Store a rendered thumbnail in the disk tier. Blocking."""
+        data_path, meta_path = self._paths(key)
+        tmp_suffix = f".tmp-{uuid.uuid4().hex}"
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            with open(data_path + tmp_suffix, 'wb') as f:
+                f.write(thumbnail.body)
+            with open(meta_path + tmp_suffix, 'w') as f:
+                json.dump({'content_type': thumbnail.content_type, 'etag': thumbnail.etag}, f)
+            os.replace(data_path + tmp_suffix, data_path)
+            os.replace(meta_path + tmp_suffix, meta_path)
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._disk_bytes += len(thumbnail.body)
+            if self._disk_bytes > self.disk_max_bytes:
+                self.evict()
+        except OSError as e:
+            # The memory tier still serves it
+            logger.error(f"Error writing thumbnail to disk: {str(e)}")
+
+    def _entries(self):
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith('.bin'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """Delete least recently used thumbnails on disk until under the byte budget."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            for victim in (path, path[:-len('.bin')] + '.json'):
+                try:
+                    os.unlink(victim)
+                except OSError:
+                    pass
+            total -= size
+            self.evictions += 1
+        self._disk_bytes = total
+
+    async def _produce(self, key: str, url: str, width: int) -> Thumbnail:
+        thumbnail = await run_in_threadpool(self.read, key)
+        if thumbnail is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            data, content_type = await fetch_image(url)
+            try:
+                body, content_type = await run_in_threadpool(render_thumbnail, data, width, content_type)
+            except Exception as e:
+                logger.error(f"Error resizing thumbnail: {str(e)}")
+                raise HTTPException(status_code=502, detail="Thumbnail host returned an unreadable image")
+            thumbnail = Thumbnail(body, content_type, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+            await run_in_threadpool(self.write, key, thumbnail)
+        self._remember(key, thumbnail)
+        return thumbnail
+
+    async def get(self, url: str, width: int) -> Thumbnail:
+        """The thumbnail of ``url`` at ``width``, from memory, disk or upstream."""
+        key = thumbnail_key(url, width)
+        thumbnail = self._memory.get(key)
+        if thumbnail is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return thumbnail
+        return await request_coalescer.run('thumbnail', key, lambda: self._produce(key, url, width))
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "resizing": Image is not None,
+            "widths": list(THUMBNAIL_WIDTHS),
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "memory_max_bytes": self.memory_max_bytes,
+            "disk_entries": len(entries),
+            "disk_bytes": sum(size for _, size, _ in entries),
+            "disk_max_bytes": self.disk_max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_MEMORY_MAX_BYTES, THUMBNAIL_DISK_MAX_BYTES)
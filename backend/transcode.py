@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+import ffmpeg
+
+from streaming import STREAM_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Concurrent ffmpeg processes; encoding is CPU bound so this defaults to the core count
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", os.cpu_count() or 2))
+# Threads per ffmpeg process, 0 lets ffmpeg decide
+TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", 0))
+# "quality" matches the encoder settings used before presets existed
+COMPRESSION_PRESET = os.getenv("COMPRESSION_PRESET", "quality")
+
+# Named speed/quality trade-offs for compression
+COMPRESSION_PRESETS = {
+    'fast': {'preset': 'veryfast', 'bitrate_scale': 0.8, 'audio_bitrate': '96k'},
+    'balanced': {'preset': 'faster', 'bitrate_scale': 1.0, 'audio_bitrate': '128k'},
+    'quality': {'preset': 'medium', 'bitrate_scale': 1.0, 'audio_bitrate': '128k'},
+}
+
+# Target video bitrate in kbit/s by output height
+BITRATES = {
+    1080: 5000,
+    720: 2500,
+    480: 1000,
+    360: 750,
+    240: 500,
+    144: 250
+}
+
+# Sources within this factor of the target bitrate are not worth re-encoding
+BITRATE_TOLERANCE = float(os.getenv("BITRATE_TOLERANCE", 1.15))
+
+# Compression strategies, cheapest first
+STRATEGY_COPY = 'copy'
+STRATEGY_AUDIO = 'audio'
+STRATEGY_TRANSCODE = 'transcode'
+
+# Fragmented MP4 can be written to a pipe; faststart needs a seekable file
+FRAGMENTED_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+# Every audio packet is a keyframe, so audio is fragmented by duration instead
+AUDIO_MOVFLAGS = 'empty_moov+default_base_moof'
+AUDIO_FRAGMENT_DURATION = 1000000
+
+# Audio-only outputs. ``selector`` prefers sources that can be remuxed without re-encoding.
+AUDIO_FORMATS = {
+    'mp3': {
+        'codec': 'mp3', 'encoder': 'libmp3lame', 'bitrate': '192k', 'container': 'mp3',
+        'ext': 'mp3', 'media_type': 'audio/mpeg', 'selector': 'bestaudio[acodec=mp3]/bestaudio/best',
+    },
+    'm4a': {
+        'codec': 'aac', 'encoder': 'aac', 'bitrate': '128k', 'container': 'mp4',
+        'ext': 'm4a', 'media_type': 'audio/mp4', 'selector': 'bestaudio[ext=m4a]/bestaudio/best',
+    },
+    'opus': {
+        'codec': 'opus', 'encoder': 'libopus', 'bitrate': '96k', 'container': 'ogg',
+        'ext': 'opus', 'media_type': 'audio/ogg', 'selector': 'bestaudio[acodec=opus]/bestaudio/best',
+    },
+}
+
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def transcode_slots() -> asyncio.Semaphore:
+    """Semaphore bounding concurrent ffmpeg processes."""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(TRANSCODE_WORKERS)
+    return _slots
+
+
+def resolve_preset(name: Optional[str]) -> Dict:
+    name = name or COMPRESSION_PRESET
+    if name not in COMPRESSION_PRESETS:
+        raise ValueError(f"Unknown compression preset: {name}")
+    return COMPRESSION_PRESETS[name]
+
+
+def target_bitrates(quality, preset: Optional[str]):
+    """Target (video, audio) bitrates in kbit/s for a quality and preset."""
+    settings = resolve_preset(preset)
+    video = int(BITRATES.get(quality, 1000) * settings['bitrate_scale'])
+    audio = int(settings['audio_bitrate'].rstrip('k'))
+    return video, audio
+
+
+async def probe(input_path: str) -> Dict:
+    """Run ffprobe on a file and return its parsed JSON output."""
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', input_path,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe exited with {process.returncode}: {stderr.decode(errors='ignore').strip()}")
+    return json.loads(stdout)
+
+
+def _kbps(stream: Dict, fallback: Optional[str] = None) -> Optional[float]:
+    value = stream.get('bit_rate') or fallback
+    try:
+        return int(value) / 1000
+    except (TypeError, ValueError):
+        return None
+
+
+def choose_strategy(info: Dict, quality, preset: Optional[str] = None) -> str:
+    """Pick the cheapest strategy that still meets the compression target.
+
+    Stream copy when the video is already H.264 at or below the target
+    height and bitrate and the audio is AAC within budget, audio-only
+    re-encode when just the audio is off, otherwise a full transcode.
+    """
+    streams = info.get('streams', [])
+    video = next((st for st in streams if st.get('codec_type') == 'video'), None)
+    audio = next((st for st in streams if st.get('codec_type') == 'audio'), None)
+    if video is None:
+        return STRATEGY_TRANSCODE
+
+    target_video, target_audio = target_bitrates(quality, preset)
+    # Container bitrate includes audio, so it is only an upper bound for the video stream
+    video_kbps = _kbps(video, info.get('format', {}).get('bit_rate'))
+    video_ok = (
+        video.get('codec_name') == 'h264'
+        and (not quality or (video.get('height') or 0) <= int(quality))
+        and video_kbps is not None
+        and video_kbps <= target_video * BITRATE_TOLERANCE
+    )
+    if not video_ok:
+        return STRATEGY_TRANSCODE
+
+    if audio is None:
+        return STRATEGY_COPY
+    audio_kbps = _kbps(audio)
+    audio_ok = (
+        audio.get('codec_name') == 'aac'
+        and audio_kbps is not None
+        and audio_kbps <= target_audio * BITRATE_TOLERANCE
+    )
+    return STRATEGY_COPY if audio_ok else STRATEGY_AUDIO
+
+
+async def plan_compression(input_path: str, quality, preset: Optional[str] = None) -> str:
+    """Probe a file and choose its compression strategy, transcoding if probing fails."""
+    try:
+        return choose_strategy(await probe(input_path), quality, preset)
+    except Exception as e:
+        logger.warning(f"ffprobe failed, falling back to full transcode: {str(e)}")
+        return STRATEGY_TRANSCODE
+
+
+def compress_args(input_path: str, quality, preset: Optional[str], output: str, strategy: str = STRATEGY_TRANSCODE) -> List[str]:
+    """Build the ffmpeg command line for compressing a video."""
+    target_video, target_audio = target_bitrates(quality, preset)
+    options = {}
+    if strategy == STRATEGY_TRANSCODE:
+        options.update({
+            'vcodec': 'libx264',
+            'video_bitrate': f'{target_video}k',
+            'preset': resolve_preset(preset)['preset'],
+        })
+        if TRANSCODE_THREADS:
+            options['threads'] = TRANSCODE_THREADS
+    else:
+        options['vcodec'] = 'copy'
+    if strategy == STRATEGY_COPY:
+        options['acodec'] = 'copy'
+    else:
+        options.update({'acodec': 'aac', 'audio_bitrate': f'{target_audio}k'})
+    if output == 'pipe:1':
+        options['format'] = 'mp4'
+        options['movflags'] = FRAGMENTED_MOVFLAGS
+    else:
+        options['movflags'] = 'faststart'
+    stream = ffmpeg.input(input_path).output(output, **options)
+    return ffmpeg.compile(stream, overwrite_output=True) + ['-loglevel', 'error', '-nostdin']
+
+
+async def compress_to_file(input_path: str, quality, preset: Optional[str] = None, strategy: Optional[str] = None):
+    """Compress into a seekable faststart MP4 next to the input.
+
+    Returns the output path and the strategy that was used.
+    """
+    output_path = os.path.splitext(input_path)[0] + '_compressed.mp4'
+    strategy = strategy or await plan_compression(input_path, quality, preset)
+    await run_ffmpeg(compress_args(input_path, quality, preset, output_path, strategy))
+    return output_path, strategy
+
+
+async def run_ffmpeg(args: List[str]):
+    """Run an ffmpeg command to completion in the transcoding pool."""
+    async with transcode_slots():
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await process.communicate()
+        except BaseException:
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr.decode(errors='ignore').strip()}")
+
+
+def clip_args(inputs: List[str], start: float, end: float, output: str, strategy: str,
+              quality=None, preset: Optional[str] = None) -> List[str]:
+    """Build the ffmpeg command line cutting start..end out of one or two (video, audio) inputs.
+
+    Seeking happens on the inputs, so ffmpeg only reads the part of each
+    source around the clip. Stream copy starts at the keyframe at or
+    before ``start``; a transcode starts exactly there.
+    """
+    sources = [ffmpeg.input(url, ss=start, t=end - start) for url in inputs]
+    streams = [sources[0].video, sources[1].audio] if len(sources) > 1 else [sources[0]]
+    options = {'movflags': 'faststart', 'avoid_negative_ts': 'make_zero', 'strict': 'experimental'}
+    if strategy == STRATEGY_COPY:
+        options['c'] = 'copy'
+    else:
+        target_video, _ = target_bitrates(quality, preset)
+        options.update({
+            'vcodec': 'libx264',
+            'video_bitrate': f'{target_video}k',
+            'preset': resolve_preset(preset)['preset'],
+            'acodec': 'copy',
+        })
+        if TRANSCODE_THREADS:
+            options['threads'] = TRANSCODE_THREADS
+    stream = ffmpeg.output(*streams, output, **options)
+    return ffmpeg.compile(stream, overwrite_output=True) + ['-loglevel', 'error', '-nostdin']
+
+
+async def keyframe_near(url: str, position: float, tolerance: float) -> bool:
+    """Whether the video of ``url`` has a keyframe within ``tolerance`` seconds of ``position``."""
+    if position <= 0:
+        return True
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+        '-read_intervals', f"{max(0.0, position - tolerance)}%{position + tolerance}",
+        '-show_entries', 'frame=best_effort_timestamp_time', '-print_format', 'json', url,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe exited with {process.returncode}: {stderr.decode(errors='ignore').strip()}")
+    for frame in json.loads(stdout).get('frames', []):
+        try:
+            if abs(float(frame['best_effort_timestamp_time']) - position) <= tolerance:
+                return True
+        except (KeyError, ValueError):
+            continue
+    return False
+
+
+async def stream_compressed(input_path: str, quality, preset: Optional[str] = None, strategy: str = STRATEGY_TRANSCODE) -> AsyncIterator[bytes]:
+    """Yield fragmented MP4 output of ffmpeg as it is produced."""
+    async for chunk in stream_ffmpeg(compress_args(input_path, quality, preset, 'pipe:1', strategy)):
+        yield chunk
+
+
+def normalize_acodec(acodec: Optional[str]) -> Optional[str]:
+    """Codec family of a yt-dlp ``acodec`` or ffprobe ``codec_name`` value."""
+    if not acodec or acodec == 'none':
+        return None
+    acodec = acodec.lower()
+    # MP3 in an MP4 container
+    if acodec in ('mp3', 'mp4a.40.34', 'mp4a.6b'):
+        return 'mp3'
+    if acodec.startswith('mp4a') or acodec == 'aac':
+        return 'aac'
+    return acodec.split('.')[0]
+
+
+def audio_strategy(acodec: Optional[str], audio_format: str) -> str:
+    """Remux (copy) when the source audio already is the target codec, else transcode."""
+    if normalize_acodec(acodec) == AUDIO_FORMATS[audio_format]['codec']:
+        return STRATEGY_COPY
+    return STRATEGY_TRANSCODE
+
+
+def audio_args(source: str, audio_format: str, strategy: str, http_headers: Optional[Dict[str, str]] = None,
+               start: Optional[float] = None, end: Optional[float] = None) -> List[str]:
+    """Build the ffmpeg command line extracting audio (optionally start..end) from a file or URL to stdout."""
+    target = AUDIO_FORMATS[audio_format]
+    input_options = {}
+    if start:
+        input_options['ss'] = start
+    if end is not None:
+        input_options['t'] = end - (start or 0)
+    if http_headers:
+        input_options['headers'] = ''.join(f"{name}: {value}\r\n" for name, value in http_headers.items())
+    options = {'vn': None, 'format': target['container']}
+    if strategy == STRATEGY_COPY:
+        options['acodec'] = 'copy'
+    else:
+        options.update({'acodec': target['encoder'], 'audio_bitrate': target['bitrate']})
+        if TRANSCODE_THREADS:
+            options['threads'] = TRANSCODE_THREADS
+    if target['container'] == 'mp4':
+        options.update({'movflags': AUDIO_MOVFLAGS, 'frag_duration': AUDIO_FRAGMENT_DURATION})
+    stream = ffmpeg.input(source, **input_options).output('pipe:1', **options)
+    return ffmpeg.compile(stream) + ['-loglevel', 'error', '-nostdin']
+
+
+async def stream_audio(source: str, audio_format: str, strategy: str, http_headers: Optional[Dict[str, str]] = None,
+                       start: Optional[float] = None, end: Optional[float] = None) -> AsyncIterator[bytes]:
+    """Yield audio-only output of ffmpeg as it is produced.
+
+    ``source`` may be a media URL, which ffmpeg reads directly (seeking
+    with range requests where the container needs it).
+    """
+    async for chunk in stream_ffmpeg(audio_args(source, audio_format, strategy, http_headers, start, end)):
+        yield chunk
+
+
+async def stream_ffmpeg(args: List[str]) -> AsyncIterator[bytes]:
+    """Run ffmpeg in the transcoding pool and yield its stdout as it is produced."""
+    async with transcode_slots():
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            while True:
+                chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            stderr = await process.stderr.read()
+            await process.wait()
+            if process.returncode != 0:
+                # Headers are already sent, so all we can do is log and cut the stream
+                logger.error(f"ffmpeg exited with {process.returncode}: {stderr.decode(errors='ignore').strip()}")
+        finally:
+            if process.returncode is None:
+                # Client went away mid-stream
+                process.kill()
+                await process.wait()
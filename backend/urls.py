@@ -0,0 +1,187 @@
+"""Platform detection and canonical video IDs for supported URLs.
+
+Every cache and deduplication key is built from ``canonical_key`` so that
+``youtu.be/X``, ``youtube.com/watch?v=X&t=5`` and ``m.youtube.com/shorts/X``
+all refer to the same video.
+"""
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit
+
+# Registered domains per platform; subdomains (www., m., vm., ...) match too
+SUPPORTED_PLATFORMS = {
+    "youtube.com": "youtube",
+    "youtu.be": "youtube",
+    "youtube-nocookie.com": "youtube",
+    "facebook.com": "facebook",
+    "fb.com": "facebook",
+    "fb.watch": "facebook",
+    "instagram.com": "instagram",
+    "instagr.am": "instagram",
+    "tiktok.com": "tiktok",
+    "twitter.com": "twitter",
+    "x.com": "twitter",
+    "linkedin.com": "linkedin",
+    "pinterest.com": "pinterest",
+    "pin.it": "pinterest",
+}
+
+# Platforms the download endpoints can fetch with yt-dlp
+DOWNLOAD_PLATFORMS = ('youtube', 'facebook', 'instagram', 'tiktok')
+
+YOUTUBE_ID = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YOUTUBE_PATH = re.compile(r'^/(?:shorts|embed|live|v|e)/([A-Za-z0-9_-]{11})')
+FACEBOOK_PATH = re.compile(r'/(?:videos|reel|watch/live)/(?:[^/]+/)?(\d+)')
+INSTAGRAM_PATH = re.compile(r'/(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)')
+TIKTOK_PATH = re.compile(r'/(?:video|v|photo)/(\d+)')
+TWITTER_PATH = re.compile(r'/status(?:es)?/(\d+)')
+LINKEDIN_PATH = re.compile(r'(?:activity[:-]|ugcPost[:-])(\d+)')
+PINTEREST_PATH = re.compile(r'/pin/(?:[^/]*--)?(\d+)')
+
+# Query parameters that only track where a link was shared; dropped from fallback keys
+TRACKING_PARAMS = frozenset(('si', 'feature', 'igsh', 'igshid', 'ref', 'ref_src', 'fbclid', 'gclid', 'mibextid',
+                             'is_from_webapp', 'sender_device', 's'))
+
+
+def _platform_for_host(host: str) -> Optional[str]:
+    # Try the host and each parent domain: m.youtube.com, youtube.com, com
+    while host:
+        platform = SUPPORTED_PLATFORMS.get(host)
+        if platform:
+            return platform
+        _, _, host = host.partition('.')
+    return None
+
+
+def _youtube_id(host: str, path: str, query: str) -> Optional[str]:
+    if host == 'youtu.be' or host.endswith('.youtu.be'):
+        video_id = path.strip('/').split('/')[0]
+        return video_id if YOUTUBE_ID.match(video_id) else None
+    video_id = parse_qs(query).get('v', [''])[0]
+    if YOUTUBE_ID.match(video_id):
+        return video_id
+    match = YOUTUBE_PATH.match(path)
+    if match:
+        return match.group(1)
+    playlist_id = parse_qs(query).get('list', [''])[0]
+    return f"playlist:{playlist_id}" if playlist_id else None
+
+
+def _facebook_id(host: str, path: str, query: str) -> Optional[str]:
+    if host == 'fb.watch':
+        # Short links redirect to a video ID we cannot see without a request
+        code = path.strip('/')
+        return f"fb.watch/{code}" if code else None
+    params = parse_qs(query)
+    video_id = params.get('v', [''])[0] or params.get('story_fbid', [''])[0] or params.get('fbid', [''])[0]
+    if video_id.isdigit():
+        return video_id
+    match = FACEBOOK_PATH.search(path)
+    return match.group(1) if match else None
+
+
+def _short_code(host: str, path: str, short_hosts: Tuple[str, ...]) -> Optional[str]:
+    if host in short_hosts:
+        code = path.strip('/').split('/')[0]
+        return f"{host}/{code}" if code else None
+    return None
+
+
+def _tiktok_id(host: str, path: str, query: str) -> Optional[str]:
+    short = _short_code(host, path, ('vm.tiktok.com', 'vt.tiktok.com'))
+    if short:
+        return short
+    if path.startswith('/t/'):
+        return f"{host}{path.rstrip('/')}"
+    match = TIKTOK_PATH.search(path)
+    return match.group(1) if match else None
+
+
+def _pinterest_id(host: str, path: str, query: str) -> Optional[str]:
+    short = _short_code(host, path, ('pin.it',))
+    if short:
+        return short
+    match = PINTEREST_PATH.search(path)
+    return match.group(1) if match else None
+
+
+def _pattern_id(pattern):
+    def extract(host: str, path: str, query: str) -> Optional[str]:
+        match = pattern.search(path)
+        return match.group(1) if match else None
+    return extract
+
+
+ID_EXTRACTORS = {
+    'youtube': _youtube_id,
+    'facebook': _facebook_id,
+    'instagram': _pattern_id(INSTAGRAM_PATH),
+    'tiktok': _tiktok_id,
+    'twitter': _pattern_id(TWITTER_PATH),
+    'linkedin': _pattern_id(LINKEDIN_PATH),
+    'pinterest': _pinterest_id,
+}
+
+
+@lru_cache(maxsize=4096)
+def parse_video_url(url: str) -> Tuple[str, str]:
+    """Map a URL to (platform, canonical_id).
+
+    URLs whose video ID is not recognised fall back to host and path plus
+    the sorted query string, without tracking parameters, since the query
+    may be what identifies the resource. Raises ValueError for hosts of
+    unsupported platforms.
+    """
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    host = (parts.hostname or '').rstrip('.')
+    platform = _platform_for_host(host)
+    if platform is None:
+        raise ValueError("Unsupported platform")
+    if host.startswith(('www.', 'm.', 'mobile.', 'web.')):
+        host = host.split('.', 1)[1]
+    path = parts.path or '/'
+    canonical_id = ID_EXTRACTORS[platform](host, path, parts.query)
+    if canonical_id:
+        return platform, canonical_id
+    params = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                    if name not in TRACKING_PARAMS and not name.startswith('utm_'))
+    query = f"?{urlencode(params)}" if params else ''
+    return platform, f"{host}{path.rstrip('/')}{query}"
+
+
+def get_platform(url: str) -> str:
+    """Determine the platform from the URL."""
+    return parse_video_url(url)[0]
+
+
+def is_playlist_url(url: str) -> bool:
+    """Whether a URL lists several videos rather than pointing at one."""
+    try:
+        platform, canonical_id = parse_video_url(url)
+    except ValueError:
+        return False
+    if platform != 'youtube' or YOUTUBE_ID.match(canonical_id):
+        return False
+    return 'list' in parse_qs(urlsplit(url.strip()).query)
+
+
+def is_supported_url(url: str) -> bool:
+    try:
+        parse_video_url(url)
+    except ValueError:
+        return False
+    return True
+
+
+def canonical_key(url: str) -> str:
+    """Key that is the same for different URLs of one video."""
+    try:
+        platform, canonical_id = parse_video_url(url)
+    except ValueError:
+        # Unsupported hosts still get a stable, if unnormalized, key
+        return f"other:{url.strip()}"
+    return f"{platform}:{canonical_id}"
@@ -0,0 +1,191 @@
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import yt_dlp
+
+from ytdl_cache import cache_opts, cache_stats, prune_cache, save_cookie_jar
+
+logger = logging.getLogger(__name__)
+
+# Long-lived YoutubeDL instances per option profile
+YTDL_POOL_SIZE = int(os.getenv("YTDL_POOL_SIZE", os.getenv("YTDLP_WORKERS", 8)))
+# Instances created per profile at startup
+YTDL_PREWARM = int(os.getenv("YTDL_PREWARM", 1))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+BASE_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'socket_timeout': 30,
+    'retries': 10,
+    'http_headers': {
+        'User-Agent': USER_AGENT
+    },
+    # Player JS, nsig functions and cookies persist across workers and restarts
+    **cache_opts()
+}
+
+# Option profiles. Per-request values (format, outtmpl, progress_hooks)
+# are applied at checkout instead of creating a new profile for them.
+PROFILES = {
+    # Metadata extraction for /api/info, /api/formats, /api/convert and the metadata cache
+    'info': BASE_OPTS,
+    # YouTube downloads merge separate video and audio into mp4
+    'youtube-download': {
+        **BASE_OPTS,
+        'merge_output_format': 'mp4'
+    },
+    # Facebook, Instagram and TikTok downloads
+    'download': BASE_OPTS,
+    # Playlist listing for batch requests, without extracting every entry
+    'playlist': {
+        **BASE_OPTS,
+        'extract_flat': 'in_playlist'
+    },
+}
+
+# Extractors loaded when warming an instance
+WARM_EXTRACTORS = ('Youtube', 'Facebook', 'Instagram', 'TikTok')
+
+
+class YoutubeDLPool:
+    """Pool of reusable YoutubeDL objects, one queue per option profile.
+
+    Reusing an instance keeps its loaded extractors, cookie jar, HTTP
+    opener and the player/signature caches yt-dlp builds while extracting.
+    An instance is used by one worker thread at a time.
+    """
+
+    def __init__(self, profiles: Dict[str, Dict], max_per_profile: int):
+        self.profiles = profiles
+        self.max_per_profile = max_per_profile
+        self._idle: Dict[str, queue.LifoQueue] = {name: queue.LifoQueue() for name in profiles}
+        self._created: Dict[str, int] = {name: 0 for name in profiles}
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.reuses = 0
+
+    def _create(self, profile: str) -> yt_dlp.YoutubeDL:
+        return yt_dlp.YoutubeDL(dict(self.profiles[profile]))
+
+    def _acquire(self, profile: str) -> yt_dlp.YoutubeDL:
+        if profile not in self.profiles:
+            raise ValueError(f"Unknown yt-dlp profile: {profile}")
+        try:
+            ydl = self._idle[profile].get_nowait()
+            self.reuses += 1
+            return ydl
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created[profile] < self.max_per_profile
+            if create:
+                self._created[profile] += 1
+        if create:
+            return self._create(profile)
+        # All instances busy: wait for one to come back
+        ydl = self._idle[profile].get()
+        self.reuses += 1
+        return ydl
+
+    def _apply(self, ydl: yt_dlp.YoutubeDL, overrides: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply per-request options and return what is needed to undo them."""
+        saved = {
+            'params': {key: ydl.params.get(key) for key in overrides},
+            'format_selector': getattr(ydl, 'format_selector', None),
+            'progress_hooks': list(getattr(ydl, '_progress_hooks', [])),
+            'postprocessor_hooks': list(getattr(ydl, '_postprocessor_hooks', [])),
+        }
+        for key, value in overrides.items():
+            if key == 'progress_hooks':
+                ydl._progress_hooks = list(value)
+            elif key == 'postprocessor_hooks':
+                ydl._postprocessor_hooks = list(value)
+            elif key == 'outtmpl':
+                ydl.params['outtmpl'] = value if isinstance(value, dict) else {'default': value}
+                if hasattr(ydl, 'outtmpl_dict'):
+                    # Older yt-dlp versions cache the parsed template
+                    ydl.outtmpl_dict = ydl.parse_outtmpl()
+            elif key == 'format':
+                ydl.params['format'] = value
+                # The selector is compiled once in __init__
+                ydl.format_selector = ydl.build_format_selector(value) if value else None
+            else:
+                ydl.params[key] = value
+        return saved
+
+    def _restore(self, ydl: yt_dlp.YoutubeDL, saved: Dict[str, Any]):
+        for key, value in saved['params'].items():
+            if key in ('progress_hooks', 'postprocessor_hooks'):
+                continue
+            if value is None:
+                ydl.params.pop(key, None)
+            else:
+                ydl.params[key] = value
+        if 'outtmpl' in saved['params'] and hasattr(ydl, 'outtmpl_dict'):
+            ydl.outtmpl_dict = ydl.parse_outtmpl()
+        ydl.format_selector = saved['format_selector']
+        ydl._progress_hooks = saved['progress_hooks']
+        ydl._postprocessor_hooks = saved['postprocessor_hooks']
+
+    @contextmanager
+    def checkout(self, profile: str, **overrides) -> Iterator[yt_dlp.YoutubeDL]:
+        """Borrow an instance of a profile with per-request options applied."""
+        ydl = self._acquire(profile)
+        self.checkouts += 1
+        saved = self._apply(ydl, overrides) if overrides else None
+        try:
+            yield ydl
+        finally:
+            if saved is not None:
+                self._restore(ydl, saved)
+            self._idle[profile].put(ydl)
+
+    def warm(self, profiles: Optional[List[str]] = None, count: int = YTDL_PREWARM):
+        """Create instances ahead of time and load the common extractors. Blocking."""
+        prune_cache()
+        for profile in profiles or list(self.profiles):
+            instances = []
+            for _ in range(min(count, self.max_per_profile)):
+                ydl = self._acquire(profile)
+                for name in WARM_EXTRACTORS:
+                    try:
+                        ydl.get_info_extractor(name)
+                    except Exception as e:
+                        logger.warning(f"Could not warm extractor {name}: {str(e)}")
+                instances.append(ydl)
+            for ydl in instances:
+                self._idle[profile].put(ydl)
+        logger.info(f"Pre-warmed yt-dlp profiles: {', '.join(profiles or self.profiles)}")
+
+    def close(self):
+        for idle in self._idle.values():
+            while True:
+                try:
+                    ydl = idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    # yt-dlp writes the cookie file in place; save it atomically instead
+                    save_cookie_jar(ydl.cookiejar, ydl.params.pop('cookiefile', None))
+                    ydl.__exit__(None, None, None)
+                except Exception as e:
+                    logger.error(f"Error closing YoutubeDL instance: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "created": dict(self._created),
+            "idle": {name: q.qsize() for name, q in self._idle.items()},
+            "checkouts": self.checkouts,
+            "reuses": self.reuses,
+            "disk_cache": cache_stats(),
+        }
+
+
+ydl_pool = YoutubeDLPool(PROFILES, YTDL_POOL_SIZE)
@@ -0,0 +1,136 @@
+"""On-disk yt-dlp cache and cookie store shared by all workers.
+
+yt-dlp keeps extracted player code and signature functions in its
+``cachedir`` and writes each entry atomically, so one directory can be
+shared between uvicorn workers and survives restarts. Cookies are saved
+through ``save_cookie_jar`` under a file lock and replaced atomically.
+
+Invalidate or inspect the cache from the backend directory:
+
+    python ytdl_cache.py stats|prune|clear
+"""
+import fcntl
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+YTDL_CACHE_DIR = os.getenv("YTDL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "video_downloader_ytdl_cache"))
+YTDL_CACHE_MAX_BYTES = int(os.getenv("YTDL_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+YTDL_COOKIE_FILE = os.getenv("YTDL_COOKIE_FILE", os.path.join(YTDL_CACHE_DIR, "cookies.txt"))
+
+LOCK_FILE = os.path.join(YTDL_CACHE_DIR, ".lock")
+
+
+@contextmanager
+def cache_lock(exclusive: bool = True) -> Iterator[None]:
+    """Cross-process lock guarding pruning, clearing and cookie writes."""
+    os.makedirs(YTDL_CACHE_DIR, exist_ok=True)
+    with open(LOCK_FILE, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def cache_opts() -> Dict[str, str]:
+    """yt-dlp options pointing at the shared cache directory and cookie file."""
+    os.makedirs(YTDL_CACHE_DIR, exist_ok=True)
+    return {'cachedir': YTDL_CACHE_DIR, 'cookiefile': YTDL_COOKIE_FILE}
+
+
+def _cache_files():
+    for directory, _, files in os.walk(YTDL_CACHE_DIR):
+        for name in files:
+            path = os.path.join(directory, name)
+            if path in (LOCK_FILE, YTDL_COOKIE_FILE):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield st.st_mtime, st.st_size, path
+
+
+def cache_stats() -> Dict[str, int]:
+    files = list(_cache_files())
+    return {
+        "files": len(files),
+        "bytes": sum(size for _, size, _ in files),
+        "max_bytes": YTDL_CACHE_MAX_BYTES,
+    }
+
+
+def prune_cache(max_bytes: int = YTDL_CACHE_MAX_BYTES) -> int:
+    """Delete the oldest cache entries until the cache fits in ``max_bytes``."""
+    removed = 0
+    with cache_lock():
+        files = sorted(_cache_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"Pruned {removed} yt-dlp cache entries")
+    return removed
+
+
+def clear_cache(include_cookies: bool = False):
+    """Invalidate all cached player and signature data."""
+    with cache_lock():
+        for name in os.listdir(YTDL_CACHE_DIR):
+            path = os.path.join(YTDL_CACHE_DIR, name)
+            if path == LOCK_FILE or (path == YTDL_COOKIE_FILE and not include_cookies):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.unlink(path)
+    logger.info("Cleared yt-dlp cache")
+
+
+def save_cookie_jar(cookiejar, path: Optional[str] = YTDL_COOKIE_FILE):
+    """Write a cookie jar to the shared file atomically."""
+    if not path or cookiejar is None:
+        return
+    with cache_lock():
+        tmp_path = f"{path}.tmp-{os.getpid()}-{int(time.time() * 1000)}"
+        try:
+            cookiejar.save(tmp_path, ignore_discard=True, ignore_expires=True)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error saving cookies: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def main(argv) -> int:
+    command = argv[1] if len(argv) > 1 else 'stats'
+    if command == 'stats':
+        print(cache_stats())
+    elif command == 'prune':
+        print(f"Removed {prune_cache()} entries")
+    elif command == 'clear':
+        clear_cache(include_cookies='--cookies' in argv)
+        print("Cache cleared")
+    else:
+        print("Usage: python ytdl_cache.py stats|prune|clear [--cookies]")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
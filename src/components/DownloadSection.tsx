@@ -19,6 +19,7 @@ interface VideoFormat {
 interface VideoInfo {
   title: string;
   thumbnail: string;
+  thumbnailProxy?: string;
   duration: string | number;
   formats: VideoFormat[];
   platform: string;
@@ -81,6 +82,23 @@ const VideoPreview: React.FC<{
     setError(null);
     setDownloadProgress(0);
     setIsCompressing(false);
+
+    // Follow the server-side download over Server-Sent Events while the request is running
+    const downloadId = `${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+    const progressEvents = new EventSource(`http://127.0.0.1:8000/api/progress/${downloadId}/events`);
+    progressEvents.onmessage = (event) => {
+      const progress = JSON.parse(event.data);
+      if (progress.status === 'downloading') {
+        setIsCompressing(false);
+        setDownloadProgress(parseFloat(progress.progress) || 0);
+      } else if (progress.status === 'processing') {
+        // A file is done; merging or compression follows
+        setDownloadProgress(100);
+        setIsCompressing(true);
+      } else {
+        progressEvents.close();
+      }
+    };
     
     try {
       // Create safe filename from video title
@@ -98,7 +116,8 @@ const VideoPreview: React.FC<{
         format: isTikTok || isInstagram ? 'best' : `bestvideo[height<=${quality}]+bestaudio/best[height<=${quality}]`,
         filename: fileName,
         quality: isTikTok || isInstagram ? 1080 : parseInt(quality),
-        platform: videoInfo.platform || 'youtube'
+        platform: videoInfo.platform || 'youtube',
+        download_id: downloadId
       };
 
       console.log('Starting download with params:', downloadParams); // Debug log
@@ -144,6 +163,7 @@ const VideoPreview: React.FC<{
       URL.revokeObjectURL(downloadUrl);
       document.body.removeChild(a);
 
+      progressEvents.close();
       setDownloadingFormat(null);
       setDownloadProgress(0);
       setIsCompressing(false);
@@ -153,6 +173,7 @@ const VideoPreview: React.FC<{
       setDownloadingFormat(null);
       setDownloadProgress(0);
       setIsCompressing(false);
+      progressEvents.close();
       setError(
         error instanceof Error ? error.message : 
         typeof error === 'string' ? error :
@@ -162,7 +183,10 @@ const VideoPreview: React.FC<{
   };
 
   const getThumbnailUrl = (videoInfo: VideoInfo) => {
-    if (!videoInfo || !videoInfo.thumbnail) return '';
+    if (!videoInfo) return '';
+    // Resized WebP served by the backend, which also avoids hotlink/referrer checks
+    if (videoInfo.thumbnailProxy) return videoInfo.thumbnailProxy;
+    if (!videoInfo.thumbnail) return '';
     
     // For YouTube videos, ensure we're using the high-quality thumbnail
     if (videoInfo.platform === 'youtube' && videoInfo.url) {
@@ -369,6 +393,7 @@ const DownloadSection: React.FC = () => {
         title: info.title || '',
         duration: info.duration || '',
         thumbnail: info.thumbnail || '',
+        thumbnailProxy: info.thumbnail_proxy ? `http://127.0.0.1:8000${info.thumbnail_proxy}&w=640` : undefined,
         formats: info.formats || [],
         platform: info.platform || getPlatformFromUrl(url),
         url: url
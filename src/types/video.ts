@@ -10,6 +10,7 @@ export interface VideoFormat {
 export interface VideoInfo {
     title: string;
     thumbnail?: string;
+    thumbnail_proxy?: string;
     duration?: string;
     formats: VideoFormat[];
     platform: string;